@@ -0,0 +1,161 @@
+# admin_console.py - Queries behind the /admin/users console
+#
+# Users are listed by id with keyset pagination: a page is "the next
+# PAGE_SIZE ids after (or before) this one", answered from the primary key
+# index however deep the page, instead of an OFFSET that reads and throws
+# away every earlier row. A page and its per-user counts come from one
+# statement: the page of ids as a CTE, joined to friend counts and to bill
+# counts and totals grouped by user, visit date and currency for just those
+# ids. Spend is converted into REPORTING_CURRENCY per group, as on the
+# dashboard; like the dashboard, it counts bills not yet archived.
+#
+# Bulk actions are single UPDATE statements over either the selected ids or
+# everything matching the current filter, so approving every pending
+# request is one statement whether it matches ten users or a million. The
+# 'admin' account and the acting admin are never changed. Revoking access
+# and setting roles are for super admins only, and only a super admin can
+# change another super admin. A role comes with the admin flags that
+# admin_required checks: 'user' clears them, the admin roles set them.
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+import fx
+
+PAGE_SIZE = 50
+STATUSES = ('admins', 'pending', 'users')
+ROLES = ('user', 'admin', 'super_admin')
+ACTIONS = ('approve', 'reject', 'revoke', 'role')
+SUPER_ADMIN_ACTIONS = ('revoke', 'role')
+PROTECTED_USERNAME = 'admin'
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def user_filter(search='', status=''):
+    """Condition for users whose name starts with search, in one of STATUSES"""
+    from app import db, User
+
+    criteria = []
+    if search:
+        criteria.append(User.username.like(f'{_escape_like(search)}%', escape='\\'))
+    if status == 'admins':
+        criteria.append(db.and_(User.is_admin.is_(True), User.admin_approved.is_(True)))
+    elif status == 'pending':
+        criteria.append(db.and_(User.admin_requested.is_(True), User.admin_approved.isnot(True)))
+    elif status == 'users':
+        criteria.append(db.or_(User.is_admin.isnot(True), User.admin_approved.isnot(True)))
+    return db.and_(db.true(), *criteria)
+
+
+def user_page(condition, after=None, before=None, limit=PAGE_SIZE):
+    """(rows, has_previous, has_next) for the users matching condition, by id
+
+    after/before are the last/first id of the page being left. Each row is
+    (user, friends, bills, spend, currencies without a rate).
+    """
+    from app import db, Bill, Friend, User
+
+    page = select(User.id).where(condition)
+    if before is not None:
+        page = page.where(User.id < before).order_by(User.id.desc())
+    else:
+        if after is not None:
+            page = page.where(User.id > after)
+        page = page.order_by(User.id)
+    # One extra row tells whether there is another page in this direction
+    page = page.limit(limit + 1).cte('page')
+    page_ids = select(page.c.id)
+    friends = select(Friend.user_id, func.count().label('friends')).where(
+        Friend.user_id.in_(page_ids)).group_by(Friend.user_id).subquery()
+    bills = select(
+        Bill.user_id, Bill.visit_date, Bill.currency,
+        func.count().label('bills'), func.sum(Bill.total_amount).label('spend'),
+    ).where(Bill.user_id.in_(page_ids), Bill.deleted_at.is_(None)).group_by(
+        Bill.user_id, Bill.visit_date, Bill.currency).subquery()
+
+    statement = select(
+        User, func.coalesce(friends.c.friends, 0), bills.c.visit_date, bills.c.currency,
+        func.coalesce(bills.c.bills, 0), bills.c.spend,
+    ).join(page, page.c.id == User.id).outerjoin(
+        friends, friends.c.user_id == User.id).outerjoin(bills, bills.c.user_id == User.id)
+
+    users, friend_counts, bill_counts, groups = {}, {}, defaultdict(int), defaultdict(list)
+    for user, friend_count, visit_date, currency, bill_count, spend in db.session.execute(statement):
+        users[user.id] = user
+        friend_counts[user.id] = friend_count
+        bill_counts[user.id] += bill_count
+        if visit_date is not None:
+            groups[user.id].append((visit_date, currency, spend))
+
+    ids = sorted(users)
+    more = len(ids) > limit
+    if before is not None:
+        ids = ids[-limit:]
+        has_previous, has_next = more, True
+    else:
+        ids = ids[:limit]
+        has_previous, has_next = after is not None, more
+
+    rows = []
+    for user_id in ids:
+        spend, missing = fx.convert_sums(groups[user_id])
+        rows.append((users[user_id], friend_counts[user_id], bill_counts[user_id], spend, missing))
+    return rows, has_previous, has_next
+
+
+def status_counts():
+    """Users in total, approved admins and pending requests, from one grouped query"""
+    from app import db, User
+
+    counts = {'total': 0, 'admins': 0, 'pending': 0}
+    for is_admin, requested, approved, count in db.session.query(
+            User.is_admin, User.admin_requested, User.admin_approved, func.count()).group_by(
+            User.is_admin, User.admin_requested, User.admin_approved):
+        counts['total'] += count
+        if is_admin and approved:
+            counts['admins'] += count
+        elif requested and not approved:
+            counts['pending'] += count
+    return counts
+
+
+def bulk_update(action, acting_user_id, condition, role=None, super_admin=False):
+    """Apply action to the users matching condition in one UPDATE; returns users changed (commits)
+
+    super_admin says whether the acting user is one; without it
+    SUPER_ADMIN_ACTIONS raise PermissionError and super admins are skipped.
+    """
+    from app import db, User
+
+    if action not in ACTIONS or (action == 'role' and role not in ROLES):
+        raise ValueError(f'Unknown action {action!r}')
+    if action in SUPER_ADMIN_ACTIONS and not super_admin:
+        raise PermissionError(action)
+    condition = db.and_(condition, User.id != acting_user_id, User.username != PROTECTED_USERNAME)
+    if not super_admin:
+        condition = db.and_(condition, db.or_(User.role.is_(None), User.role != 'super_admin'))
+    granted = {User.is_admin: True, User.admin_requested: True, User.admin_approved: True,
+               User.approved_by: acting_user_id, User.approved_at: datetime.utcnow()}
+    revoked = {User.is_admin: False, User.admin_requested: False, User.admin_approved: False,
+               User.role: 'user', User.approved_by: None, User.approved_at: None}
+    if action == 'approve':
+        condition = db.and_(condition, User.admin_approved.isnot(True))
+        values = {**granted, User.role: 'admin'}
+    elif action == 'reject':
+        condition = db.and_(condition, User.admin_requested.is_(True), User.admin_approved.isnot(True))
+        values = {User.admin_requested: False}
+    elif action == 'revoke' or role == 'user':
+        condition = db.and_(condition, db.or_(User.is_admin.is_(True), User.admin_approved.is_(True),
+                                              User.role != 'user'))
+        values = revoked
+    else:
+        condition = db.and_(condition, db.or_(User.role.is_(None), User.role != role,
+                                              User.is_admin.isnot(True), User.admin_approved.isnot(True)))
+        values = {**granted, User.role: role}
+    count = User.query.filter(condition).update(values, synchronize_session=False)
+    db.session.commit()
+    return count
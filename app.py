@@ -1,16 +1,51 @@
 import os
+import click
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import AddConstraint, CreateTable
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 import csv
 import io
-import requests
+import json
+import logging
 import re
+import sys
+
+import admin_console
+import app_logging
+import archive
+import bill_import
+import bulk_delete
+import columnar_export
+import compression
+import contacts
+import export_jobs
+import fx
+import idempotency
+import line_items
+import notifications
+import ocr_client
+import query_log
+import rate_limit
+import receipts
+import rollups
+import share_status
+import share_writes
+import statements
+import sync
+from auth_middleware import admin_required
 
 app = Flask(__name__)
 
+# Helper modules do `from app import ...`; make that resolve to this module
+# even when the app is started with `python app.py`
+sys.modules.setdefault('app', sys.modules[__name__])
+
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'fallback-secret-key')
 database_url = os.environ.get('DATABASE_URL', 'sqlite:///bill_sharing.db')
 
@@ -26,7 +61,100 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# OCR.space client: timeouts (seconds), retries, circuit breaker and hedging
+app.config['OCR_API_URL'] = os.environ.get('OCR_API_URL', ocr_client.OCR_SPACE_URL)
+app.config['OCR_API_KEY'] = os.environ.get('OCR_API_KEY', 'helloworld')
+app.config['OCR_CONNECT_TIMEOUT'] = float(os.environ.get('OCR_CONNECT_TIMEOUT', 3.05))
+app.config['OCR_READ_TIMEOUT'] = float(os.environ.get('OCR_READ_TIMEOUT', 20))
+app.config['OCR_MAX_ATTEMPTS'] = int(os.environ.get('OCR_MAX_ATTEMPTS', 3))
+app.config['OCR_BREAKER_THRESHOLD'] = int(os.environ.get('OCR_BREAKER_THRESHOLD', 5))
+app.config['OCR_BREAKER_RESET'] = float(os.environ.get('OCR_BREAKER_RESET', 60))
+app.config['OCR_HEDGE_AFTER'] = float(os.environ.get('OCR_HEDGE_AFTER', 0))  # 0 disables hedging
+app.config['OCR_POOL_SIZE'] = int(os.environ.get('OCR_POOL_SIZE', 10))  # keep-alive connections per worker
+# Batch receipt upload (see receipts.py): concurrent scans per worker process
+app.config['OCR_BATCH_WORKERS'] = int(os.environ.get('OCR_BATCH_WORKERS', 4))
+app.config['OCR_BATCH_MAX_FILES'] = int(os.environ.get('OCR_BATCH_MAX_FILES', 50))
+
+# Background exports: reports above the row limit are built off-request
+app.config['EXPORT_FOLDER'] = os.environ.get('EXPORT_FOLDER', 'exports')
+app.config['EXPORT_SYNC_ROW_LIMIT'] = int(os.environ.get('EXPORT_SYNC_ROW_LIMIT', 5000))
+app.config['EXPORT_RETENTION_HOURS'] = int(os.environ.get('EXPORT_RETENTION_HOURS', 24))
+app.config['EXPORT_REUSE_MINUTES'] = int(os.environ.get('EXPORT_REUSE_MINUTES', 15))
+app.config['EXPORT_MAX_WORKERS'] = int(os.environ.get('EXPORT_MAX_WORKERS', 2))
+# Month-end statements (see statements.py): one worker process per CPU by default
+app.config['STATEMENT_FOLDER'] = os.environ.get('STATEMENT_FOLDER', 'statements')
+app.config['STATEMENT_WORKERS'] = int(os.environ.get('STATEMENT_WORKERS', os.cpu_count() or 1))
+
+# Structured logging through a background writer thread (see app_logging.py)
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+app.config['LOG_SAMPLE'] = os.environ.get('LOG_SAMPLE', '')  # e.g. "app=0.1,ocr_client=0.5"
+app_logging.setup_logging(app.config['LOG_LEVEL'], app.config['LOG_SAMPLE'])
+log = logging.getLogger('app')
+
+# Archival of old bills (see archive.py): a separate SQLite file, or range
+# partitions by visit_date in the main Postgres database
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 730))
+ARCHIVE_BIND = 'archive' if database_url.startswith('sqlite') else None
+if ARCHIVE_BIND:
+    root, ext = os.path.splitext(database_url)
+    app.config['SQLALCHEMY_BINDS'] = {
+        ARCHIVE_BIND: os.environ.get('ARCHIVE_DATABASE_URL', f'{root}_archive{ext or ".db"}'),
+    }
+
+# Slow-query log (see query_log.py); 0 leaves it off
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 0))
+app.config['SLOW_QUERY_EXPLAIN'] = os.environ.get('SLOW_QUERY_EXPLAIN', '1') == '1'
+
+# Delta sync (see sync.py): on Postgres, changes younger than this are held
+# back until concurrent transactions that logged before them have committed
+app.config['SYNC_SETTLE_SECONDS'] = float(os.environ.get(
+    'SYNC_SETTLE_SECONDS', 0 if database_url.startswith('sqlite') else 5))
+
+# Bill currencies (see fx.py). Bills from before currencies were recorded
+# are in DEFAULT_CURRENCY, as are imported rows without a Currency column;
+# reports convert everything into REPORTING_CURRENCY. It defaults to USD,
+# the "$" every report and CSV showed before bills had a currency; set it
+# before the first start of this version if those amounts were something else.
+app.config['DEFAULT_CURRENCY'] = os.environ.get('DEFAULT_CURRENCY', 'USD').upper()
+app.config['REPORTING_CURRENCY'] = os.environ.get('REPORTING_CURRENCY', app.config['DEFAULT_CURRENCY']).upper()
+app.config['FX_RATES_FILE'] = os.environ.get('FX_RATES_FILE', 'fx_rates.csv')
+
+# Rate limiting of expensive routes (see rate_limit.py). The buckets live in
+# a local SQLite file so every worker process on the host shares them.
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+app.config['RATE_LIMIT_DB'] = os.environ.get('RATE_LIMIT_DB', 'rate_limits.db')
+app.config['RATE_LIMIT_MAX_WAIT'] = float(os.environ.get('RATE_LIMIT_MAX_WAIT', 2))  # seconds a request may queue
+# Reverse proxies in front of the app (1 on Render). Their X-Forwarded-For
+# gives the client address that anonymous rate-limit buckets are keyed on;
+# without it every visitor shares the proxy's address and its bucket.
+app.config['TRUSTED_PROXY_HOPS'] = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+if app.config['TRUSTED_PROXY_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_HOPS'],
+                            x_proto=app.config['TRUSTED_PROXY_HOPS'])
+
+# Bulk deletes (see bulk_delete.py). Deletes of more bills than this are
+# soft-deleted at once and purged in the background, in chunks.
+app.config['BULK_DELETE_SYNC_LIMIT'] = int(os.environ.get('BULK_DELETE_SYNC_LIMIT', 500))
+app.config['PURGE_CHUNK_SIZE'] = int(os.environ.get('PURGE_CHUNK_SIZE', 500))
+app.config['PURGE_PAUSE'] = float(os.environ.get('PURGE_PAUSE', 0.05))  # seconds between chunks
+
+# Response compression and static assets (see compression.py)
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))  # bytes; smaller bodies go as-is
+app.config['ASSET_FOLDER'] = os.environ.get('ASSET_FOLDER', 'static_dist')  # output of `flask build-assets`
+
+# Idempotency keys on share submissions (see idempotency.py)
+app.config['IDEMPOTENCY_KEY_HOURS'] = int(os.environ.get('IDEMPOTENCY_KEY_HOURS', 24))
+
 db = SQLAlchemy(app)
+compression.install(app)
+query_log.install(app)
+rate_limit.install(app)
+sync.install(db)
+bulk_delete.install(app, db)
+# Amounts with their currency symbol: {{ bill.total_amount|money(bill.currency) }}
+app.add_template_filter(fx.format_money, 'money')
+app.add_template_filter(fx.symbol, 'currency_symbol')
 
 # MODELS - SIMPLIFIED
 class User(db.Model):
@@ -37,22 +165,50 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     password = db.Column(db.String(120), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Admin access (see auth_middleware.admin_required)
+    is_admin = db.Column(db.Boolean, default=False)
+    role = db.Column(db.String(20), default='user')
+    admin_requested = db.Column(db.Boolean, default=False)
+    admin_approved = db.Column(db.Boolean, default=False)
+    approved_by = db.Column(db.Integer)
+    approved_at = db.Column(db.DateTime)
+
+    @property
+    def is_super_admin(self):
+        # Checked by auth_middleware.super_admin_required
+        return bool(self.is_admin and self.admin_approved and self.role == 'super_admin')
 
 class Friend(db.Model):
     __tablename__ = 'friend'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        db.Index('uq_friend_user_phone', 'user_id', 'phone_e164', unique=True),
+        {'extend_existing': True},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     country_code = db.Column(db.String(5), default='+91')
     whatsapp_number = db.Column(db.String(20), nullable=False)
+    phone_e164 = db.Column(db.String(16))  # normalized, see contacts.py
     avatar = db.Column(db.String(50), default='avatar1.png')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+def _unassigned_default(context):
+    parameters = context.get_current_parameters()
+    return share_status.to_assign(parameters.get('total_amount'), parameters.get('discount_amount'))
+
+def _default_currency():
+    return app.config['DEFAULT_CURRENCY']
+
 class Bill(db.Model):
     __tablename__ = 'bill'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        db.Index('ix_bill_user_unassigned', 'user_id', 'unassigned_amount'),
+        db.Index('ix_bill_deleted_at', 'deleted_at'),
+        # Ids are never reused once archived (see archive.py)
+        {'extend_existing': True, 'sqlite_autoincrement': True},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -63,16 +219,36 @@ class Bill(db.Model):
     service_charge = db.Column(db.Float, default=0.0)
     tax_amount = db.Column(db.Float, default=0.0)  # Changed to default 0.0
     total_amount = db.Column(db.Float, nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default=_default_currency)
     bill_image = db.Column(db.String(300))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Split status, maintained by share_status.py alongside every share write
+    share_count = db.Column(db.Integer, nullable=False, default=0)
+    shared_amount = db.Column(db.Float, nullable=False, default=0.0)
+    unassigned_amount = db.Column(db.Float, default=_unassigned_default)
+    # Receipt line items read by OCR, as JSON (see line_items.py)
+    line_items = db.Column(db.Text)
+    # Set by a large bulk delete until the purge removes the row (see bulk_delete.py)
+    deleted_at = db.Column(db.DateTime)
+
+    @property
+    def split_status(self):
+        return share_status.status(self.share_count, self.unassigned_amount or 0.0)
 
 class BillShare(db.Model):
     __tablename__ = 'bill_share'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        db.Index('ix_bill_share_bill', 'bill_id'),
+        db.Index('ix_bill_share_friend', 'friend_id'),
+        # One row per item per friend; share writes upsert on it (see share_writes.py)
+        db.Index('uq_bill_share_item', 'bill_id', 'friend_id', 'food_item', unique=True),
+        {'extend_existing': True, 'sqlite_autoincrement': True},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    bill_id = db.Column(db.Integer, db.ForeignKey('bill.id'), nullable=False)
-    friend_id = db.Column(db.Integer, db.ForeignKey('friend.id'), nullable=False)
+    # Shares go with their bill or friend in the database (ON DELETE CASCADE)
+    bill_id = db.Column(db.Integer, db.ForeignKey('bill.id', ondelete='CASCADE'), nullable=False)
+    friend_id = db.Column(db.Integer, db.ForeignKey('friend.id', ondelete='CASCADE'), nullable=False)
     food_item = db.Column(db.String(200), nullable=False)
     food_amount = db.Column(db.Float, nullable=False)
     tax_share = db.Column(db.Float, default=0.0)  # Changed to default 0.0
@@ -80,8 +256,174 @@ class BillShare(db.Model):
     total_share = db.Column(db.Float, nullable=False)
     shared_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    bill = db.relationship('Bill', backref='shares')
-    friend = db.relationship('Friend', backref='bill_shares')
+    bill = db.relationship('Bill', backref=db.backref('shares', passive_deletes='all'))
+    friend = db.relationship('Friend', backref=db.backref('bill_shares', passive_deletes='all'))
+
+class ExportJob(db.Model):
+    """Background CSV export (see export_jobs.py)"""
+    __tablename__ = 'export_job'
+    __table_args__ = {'extend_existing': True}
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    kind = db.Column(db.String(30), nullable=False)
+    params = db.Column(db.Text, nullable=False)
+    params_key = db.Column(db.String(64), nullable=False, index=True)
+    status = db.Column(db.String(10), nullable=False, default='queued')  # queued / running / done / failed
+    rows_done = db.Column(db.Integer, default=0)
+    rows_total = db.Column(db.Integer, default=0)
+    file_path = db.Column(db.String(300))
+    download_name = db.Column(db.String(300))
+    error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class SpendRollup(db.Model):
+    """Spend per user, period bucket, currency and dimension key (see rollups.py)"""
+    __tablename__ = 'spend_rollup'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'grain', 'period_start', 'currency', 'dimension', 'dim_key',
+                            name='uq_spend_rollup_bucket'),
+        {'extend_existing': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    grain = db.Column(db.String(5), nullable=False)  # day / month
+    period_start = db.Column(db.Date, nullable=False)
+    currency = db.Column(db.String(3), nullable=False)  # the bills' own, converted when read
+    dimension = db.Column(db.String(20), nullable=False)  # restaurant / friend / category
+    dim_key = db.Column(db.String(200), nullable=False)
+    label = db.Column(db.String(200))
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+    entry_count = db.Column(db.Integer, nullable=False, default=0)
+
+class ReceiptReview(db.Model):
+    """Receipt from a batch upload, scanned and waiting to become a bill (see receipts.py)"""
+    __tablename__ = 'receipt_review'
+    __table_args__ = (
+        db.Index('ix_receipt_review_user_status', 'user_id', 'status'),
+        {'extend_existing': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    batch_id = db.Column(db.String(32), nullable=False, index=True)
+    image_filename = db.Column(db.String(300), nullable=False)
+    original_filename = db.Column(db.String(300))
+    status = db.Column(db.String(10), nullable=False, default='scanning')  # scanning / pending / confirmed
+    error = db.Column(db.String(300))
+    extracted_text = db.Column(db.Text)
+    restaurant_name = db.Column(db.String(200))
+    visit_date = db.Column(db.Date)
+    base_amount = db.Column(db.Float, default=0.0)
+    discount_amount = db.Column(db.Float, default=0.0)
+    service_charge = db.Column(db.Float, default=0.0)
+    tax_amount = db.Column(db.Float, default=0.0)
+    total_amount = db.Column(db.Float, default=0.0)
+    line_items = db.Column(db.Text)  # JSON, see line_items.py
+    bill_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    scanned_at = db.Column(db.DateTime)
+
+class ChangeLog(db.Model):
+    """One write to a bill, share or friend; id is the sync cursor (see sync.py)"""
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        db.Index('ix_change_log_user_seq', 'user_id', 'id'),
+        # Never reuse a sequence number, even after compaction
+        {'extend_existing': True, 'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    entity = db.Column(db.String(10), nullable=False)  # bill / share / friend
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(6), nullable=False)  # upsert / delete
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class IdempotencyKey(db.Model):
+    """A submitted form's key and the result to replay on a retry (see idempotency.py)"""
+    __tablename__ = 'idempotency_key'
+    __table_args__ = (
+        db.Index('ix_idempotency_key_user_created', 'user_id', 'created_at'),
+        {'extend_existing': True},
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    endpoint = db.Column(db.String(50), nullable=False)
+    result = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ArchiveRun(db.Model):
+    """One archival pass; reports read the archive below the newest cutoff"""
+    __tablename__ = 'archive_run'
+    __table_args__ = {'extend_existing': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    cutoff = db.Column(db.Date, nullable=False)
+    bills_moved = db.Column(db.Integer, nullable=False, default=0)
+    shares_moved = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+# Archive tables carry no foreign keys: on SQLite they live in another file,
+# and the primary keys include visit_date because Postgres partitions on it
+class ArchivedBill(db.Model):
+    __tablename__ = 'bill_archive'
+    __bind_key__ = ARCHIVE_BIND
+    __table_args__ = (
+        db.Index('ix_bill_archive_user_date', 'user_id', 'visit_date'),
+        {'extend_existing': True, 'postgresql_partition_by': 'RANGE (visit_date)'},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    visit_date = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    restaurant_name = db.Column(db.String(200), nullable=False)
+    base_amount = db.Column(db.Float, nullable=False)
+    discount_amount = db.Column(db.Float, default=0.0)
+    service_charge = db.Column(db.Float, default=0.0)
+    tax_amount = db.Column(db.Float, default=0.0)
+    total_amount = db.Column(db.Float, nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default=_default_currency)
+    bill_image = db.Column(db.String(300))
+    created_at = db.Column(db.DateTime)
+    share_count = db.Column(db.Integer, default=0)
+    shared_amount = db.Column(db.Float, default=0.0)
+    unassigned_amount = db.Column(db.Float)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ArchivedBillShare(db.Model):
+    __tablename__ = 'bill_share_archive'
+    __bind_key__ = ARCHIVE_BIND
+    __table_args__ = (
+        db.Index('ix_bill_share_archive_friend', 'user_id', 'friend_id', 'visit_date'),
+        db.Index('ix_bill_share_archive_bill', 'bill_id'),
+        {'extend_existing': True, 'postgresql_partition_by': 'RANGE (visit_date)'},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    visit_date = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    bill_id = db.Column(db.Integer, nullable=False)
+    friend_id = db.Column(db.Integer, nullable=False)
+    food_item = db.Column(db.String(200), nullable=False)
+    food_amount = db.Column(db.Float, nullable=False)
+    tax_share = db.Column(db.Float, default=0.0)
+    service_charge_share = db.Column(db.Float, default=0.0)
+    total_share = db.Column(db.Float, nullable=False)
+    shared_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    bill = db.relationship(
+        'ArchivedBill', viewonly=True,
+        primaryjoin='and_(foreign(ArchivedBillShare.bill_id) == ArchivedBill.id, '
+                    'foreign(ArchivedBillShare.visit_date) == ArchivedBill.visit_date)',
+    )
 
 
 # SIMPLIFIED AUTH MIDDLEWARE (remove admin checks)
@@ -90,11 +432,14 @@ def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
-            flash('Please log in to access this page.', 'error')
-            return redirect(url_for('login'))
+            return login_redirect()
         return f(*args, **kwargs)
     return decorated_function
 
+def login_redirect():
+    flash('Please log in to access this page.', 'error')
+    return redirect(url_for('login'))
+
 def get_current_user():
     if 'user_id' not in session:
         return None
@@ -158,7 +503,7 @@ def extract_amounts_from_text(text):
     text_clean = re.sub(r'[^\w\s\.\$:]', ' ', text_lower)  # Remove special chars except $, ., :
     text_clean = re.sub(r'\s+', ' ', text_clean)  # Normalize spaces
 
-    print(f"Cleaned OCR Text: {text_clean}")  # Debug output
+    log.debug('OCR text cleaned: %d chars', len(text_clean))
 
     # Try to extract amounts using patterns
     for amount_type, pattern_list in patterns.items():
@@ -168,7 +513,7 @@ def extract_amounts_from_text(text):
                 try:
                     # Take the last match (often the final amount in bill)
                     amounts[amount_type] = float(matches[-1])
-                    print(f"Found {amount_type}: {amounts[amount_type]}")  # Debug
+                    log.debug('OCR found %s: %.2f', amount_type, amounts[amount_type])
                     break
                 except ValueError:
                     continue
@@ -184,7 +529,7 @@ def extract_amounts_from_text(text):
                                if 1.0 <= float(amt) <= 10000.0]
                 if valid_amounts:
                     amounts['total'] = max(valid_amounts)
-                    print(f"Found total from currency: {amounts['total']}")  # Debug
+                    log.debug('OCR total from currency amounts: %.2f', amounts['total'])
             except:
                 pass
 
@@ -192,7 +537,7 @@ def extract_amounts_from_text(text):
     if amounts['subtotal'] == 0 and amounts['total'] > 0:
         amounts['subtotal'] = amounts['total'] - amounts['tax'] - amounts['service_charge'] + amounts['discount']
         if amounts['subtotal'] > 0:
-            print(f"Calculated subtotal: {amounts['subtotal']}")  # Debug
+            log.debug('OCR subtotal calculated: %.2f', amounts['subtotal'])
 
     # Ensure amounts make logical sense
     if amounts['total'] > 0:
@@ -203,32 +548,217 @@ def extract_amounts_from_text(text):
             if amounts['subtotal'] == 0:
                 amounts['subtotal'] = amounts['total'] - amounts['tax'] - amounts['service_charge'] + amounts['discount']
 
-    print(f"Final amounts: {amounts}")  # Debug
+    log.debug('OCR amounts extracted: %s', amounts)
     return amounts
 
-def ocr_space_file(filename, overlay=False, api_key='helloworld', language='eng'):
+def ocr_space_bytes(content, filename, overlay=False, api_key=None, language='eng'):
+    """OCR.space API request with an in-memory image (timeouts, retries and breaker in ocr_client)."""
+    client = ocr_client.get_client()
+    if api_key and api_key != client.api_key:
+        client = ocr_client.OCRClient(url=client.url, api_key=api_key, breaker=client.breaker, session=client.session)
+    return client.parse(content, filename=filename, overlay=overlay, language=language)
+
+def ocr_space_file(filename, overlay=False, api_key=None, language='eng'):
     """OCR.space API request with local file."""
-    payload = {
-        'isOverlayRequired': overlay,
-        'apikey': api_key,
-        'language': language,
-    }
     with open(filename, 'rb') as f:
-        r = requests.post(
-            'https://api.ocr.space/parse/image',
-            files={filename: f},
-            data=payload,
-        )
-    return r.json()
+        content = f.read()
+    return ocr_space_bytes(content, os.path.basename(filename), overlay=overlay, api_key=api_key, language=language)
+
+# Columns added to existing tables after they first shipped. create_all()
+# only creates missing tables, so upgrade_schema() adds these in place.
+SCHEMA_UPGRADES = {
+    'user': [
+        ('is_admin', 'BOOLEAN DEFAULT FALSE'),
+        ('role', "VARCHAR(20) DEFAULT 'user'"),
+        ('admin_requested', 'BOOLEAN DEFAULT FALSE'),
+        ('admin_approved', 'BOOLEAN DEFAULT FALSE'),
+        ('approved_by', 'INTEGER'),
+        ('approved_at', 'TIMESTAMP'),
+    ],
+    'friend': [
+        ('phone_e164', 'VARCHAR(16)'),
+    ],
+    'bill': [
+        ('share_count', 'INTEGER DEFAULT 0'),
+        ('shared_amount', 'FLOAT DEFAULT 0'),
+        ('unassigned_amount', 'FLOAT'),
+        ('line_items', 'TEXT'),
+        ('currency', f"VARCHAR(3) DEFAULT '{app.config['DEFAULT_CURRENCY']}'"),
+        ('deleted_at', 'TIMESTAMP'),
+    ],
+    'bill_archive': [
+        ('currency', f"VARCHAR(3) DEFAULT '{app.config['DEFAULT_CURRENCY']}'"),
+    ],
+}
+
+def _table_and_engine(name):
+    # Archive tables may live in their own database (the archive bind)
+    for bind_key, metadata in db.metadatas.items():
+        if name in metadata.tables:
+            return metadata.tables[name], db.engines[bind_key]
+    raise KeyError(name)
+
+def upgrade_schema():
+    """Add missing SCHEMA_UPGRADES columns; returns the (table, column) pairs added"""
+    added = []
+    for table, columns in SCHEMA_UPGRADES.items():
+        _, engine = _table_and_engine(table)
+        existing = {column['name'] for column in inspect(engine).get_columns(table)}
+        with engine.begin() as connection:
+            for name, ddl in columns:
+                if name not in existing:
+                    connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}'))
+                    log.info('Added column %s.%s', table, name)
+                    added.append((table, name))
+    return added
+
+# Foreign keys given an ON DELETE action after their table shipped.
+# create_all() leaves existing constraints alone, so upgrade_foreign_keys()
+# replaces the ones that differ from the model.
+FOREIGN_KEY_UPGRADES = {
+    'bill_share': ('bill_id', 'friend_id'),
+}
+
+def _rebuild_sqlite_table(table, connection):
+    # SQLite cannot alter a constraint: copy the rows into a table created
+    # from the model, then swap it in. Renaming the old table away would
+    # repoint other tables' foreign keys at it, so the new one is renamed
+    # instead. Its indexes go with the old table; create_indexes() puts
+    # them back.
+    new = f'{table.name}_new'
+    columns = ', '.join(f'"{column["name"]}"' for column in inspect(connection).get_columns(table.name)
+                        if column['name'] in table.c)
+    create = str(CreateTable(table).compile(connection)).replace(
+        f'CREATE TABLE {connection.dialect.identifier_preparer.format_table(table)} (',
+        f'CREATE TABLE "{new}" (', 1)
+    # The pragma is a no-op inside a transaction, so it is set between them
+    connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+    connection.commit()
+    try:
+        with connection.begin():
+            # pysqlite only opens a transaction before DML; include the DDL
+            connection.exec_driver_sql('BEGIN')
+            connection.exec_driver_sql(create)
+            connection.exec_driver_sql(f'INSERT INTO "{new}" ({columns}) SELECT {columns} FROM "{table.name}"')
+            connection.exec_driver_sql(f'DROP TABLE "{table.name}"')
+            connection.exec_driver_sql(f'ALTER TABLE "{new}" RENAME TO "{table.name}"')
+    finally:
+        connection.rollback()
+        connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+        connection.commit()
+
+def upgrade_foreign_keys():
+    """Give FOREIGN_KEY_UPGRADES constraints their model's ON DELETE; returns the tables changed"""
+    changed = []
+    for name, columns in FOREIGN_KEY_UPGRADES.items():
+        table, engine = _table_and_engine(name)
+        existing = {tuple(fk['constrained_columns']): fk for fk in inspect(engine).get_foreign_keys(name)}
+        stale = []
+        for constraint in table.foreign_key_constraints:
+            if not set(constraint.column_keys) & set(columns):
+                continue
+            current = existing.get(tuple(constraint.column_keys))
+            ondelete = (current or {}).get('options', {}).get('ondelete') or ''
+            if ondelete.upper() != (constraint.ondelete or '').upper():
+                stale.append((constraint, current))
+        if not stale:
+            continue
+        with engine.connect() as connection:
+            if engine.dialect.name == 'sqlite':
+                _rebuild_sqlite_table(table, connection)
+            else:
+                with connection.begin():
+                    for constraint, current in stale:
+                        if current and current['name']:
+                            connection.exec_driver_sql(
+                                f'ALTER TABLE "{name}" DROP CONSTRAINT "{current["name"]}"')
+                        connection.execute(AddConstraint(constraint))
+        log.info('Upgraded foreign keys of %s', name)
+        changed.append(name)
+    return changed
+
+# Tables whose SQLite ids were made AUTOINCREMENT after they shipped.
+# Without it SQLite hands out the highest id again once that row is
+# archived, and the archive keeps the old row under the same id.
+AUTOINCREMENT_UPGRADES = {
+    'bill': 'bill_archive',
+    'bill_share': 'bill_share_archive',
+}
+
+def upgrade_autoincrement():
+    """Rebuild AUTOINCREMENT_UPGRADES tables on SQLite; returns the tables changed"""
+    changed = []
+    for name, archive_name in AUTOINCREMENT_UPGRADES.items():
+        table, engine = _table_and_engine(name)
+        if engine.dialect.name != 'sqlite':
+            continue
+        with engine.connect() as connection:
+            ddl = connection.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).scalar()
+            if 'AUTOINCREMENT' in (ddl or '').upper():
+                continue
+            _rebuild_sqlite_table(table, connection)
+        # Start past ids already archived, not just the ones still here
+        archive, archive_engine = _table_and_engine(archive_name)
+        with archive_engine.connect() as connection:
+            archived = connection.execute(db.select(db.func.max(archive.c.id))).scalar() or 0
+        with engine.begin() as connection:
+            current = connection.exec_driver_sql(
+                'SELECT seq FROM sqlite_sequence WHERE name = ?', (name,)).scalar()
+            connection.exec_driver_sql('DELETE FROM sqlite_sequence WHERE name = ?', (name,))
+            connection.exec_driver_sql('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)',
+                                       (name, max(current or 0, archived)))
+        log.info('Made %s ids AUTOINCREMENT', name)
+        changed.append(name)
+    return changed
+
+def upgrade_rollups():
+    """Recreate spend_rollup if it predates per-currency buckets; returns True if it did
+
+    The bucket key changed, and rollups are derived data, so the table is
+    dropped and rebuilt from the bills rather than altered.
+    """
+    if 'currency' in {column['name'] for column in inspect(db.engine).get_columns(SpendRollup.__tablename__)}:
+        return False
+    SpendRollup.__table__.drop(db.engine)
+    SpendRollup.__table__.create(db.engine)
+    rollups.rebuild()
+    log.info('Rebuilt spend_rollup with per-currency buckets')
+    return True
+
+def create_indexes():
+    """Indexes declared on models after their tables already existed"""
+    for name in {**SCHEMA_UPGRADES, **FOREIGN_KEY_UPGRADES, **AUTOINCREMENT_UPGRADES}:
+        table, engine = _table_and_engine(name)
+        for index in table.indexes:
+            # The unique share index waits for duplicates to be folded (see share_writes.py)
+            if index.name != share_writes.UNIQUE_INDEX:
+                index.create(engine, checkfirst=True)
 
 def initialize_database():
     try:
         with app.app_context():
             db.create_all()
+            added = upgrade_schema()
+            upgrade_foreign_keys()
+            upgrade_autoincrement()
+            upgrade_rollups()
+            if ('bill', 'unassigned_amount') in added:
+                share_status.rebuild()
+            else:
+                share_status.correct_discounted()
+            # Unique phone index needs the column filled (duplicates stay NULL)
+            contacts.backfill_phones()
+            # Unique share index needs earlier duplicate submissions folded
+            blocking = share_writes.ensure_unique_index()
+            if blocking:
+                log.error('%d duplicate bill shares block the unique share index; '
+                          'share writes will fail until `flask dedupe-bill-shares` is run', blocking)
+            create_indexes()
             # Remove admin user creation - all users are equal
-            print("Database initialized successfully")
-    except Exception as e:
-        print(f"Database initialization error: {e}")
+            log.info('Database initialized')
+    except Exception:
+        log.exception('Database initialization failed')
 
 # Initialize database
 initialize_database()
@@ -269,14 +799,26 @@ def dashboard():
     user_id = session['user_id']
     total_friends = Friend.query.filter_by(user_id=user_id).count()
     total_bills = Bill.query.filter_by(user_id=user_id).count()
-    total_spending_result = db.session.query(db.func.sum(Bill.total_amount)).filter_by(user_id=user_id).scalar()
-    total_spending = total_spending_result if total_spending_result else 0
+    # Summed per day and currency, then converted one group at a time
+    total_spending, unconverted = fx.convert_sums(db.session.query(
+        Bill.visit_date, Bill.currency, db.func.sum(Bill.total_amount)
+    ).filter(Bill.user_id == user_id).group_by(Bill.visit_date, Bill.currency))
     recent_bills = Bill.query.filter_by(user_id=user_id).order_by(Bill.created_at.desc()).limit(5).all()
+    unsettled = db.session.query(
+        Bill.visit_date, Bill.currency, db.func.count(Bill.id), db.func.sum(Bill.unassigned_amount)
+    ).filter(Bill.user_id == user_id, share_status.status_filter('unsettled')).group_by(
+        Bill.visit_date, Bill.currency).all()
+    unsettled_bills = sum(count for _, _, count, _ in unsettled)
+    unassigned_total, _ = fx.convert_sums((day, currency, amount) for day, currency, _, amount in unsettled)
     return render_template('dashboard.html',
                          total_friends=total_friends,
                          total_bills=total_bills,
                          total_spending=total_spending,
-                         recent_bills=recent_bills)
+                         unconverted_currencies=unconverted,
+                         reporting_currency=fx.reporting_currency(),
+                         recent_bills=recent_bills,
+                         unsettled_bills=unsettled_bills,
+                         unassigned_total=unassigned_total)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -339,100 +881,157 @@ def friends():
         if not whatsapp_number.isdigit() or len(whatsapp_number) < 8:
             flash('Please enter a valid WhatsApp number (8-12 digits)', 'error')
             return redirect(url_for('friends'))
+        try:
+            phone_e164 = contacts.normalize_e164(country_code, whatsapp_number)
+        except contacts.PhoneNumberError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('friends'))
+        
+        existing = Friend.query.filter_by(user_id=session['user_id'], phone_e164=phone_e164).first()
+        if existing:
+            flash(f'{phone_e164} is already in your friends as {existing.name}', 'error')
+            return redirect(url_for('friends'))
         
         friend = Friend(
             user_id=session['user_id'], 
             name=name, 
             country_code=country_code,
             whatsapp_number=whatsapp_number,
+            phone_e164=phone_e164,
             avatar=avatar
         )
         db.session.add(friend)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request added this number since the check above
+            db.session.rollback()
+            existing = Friend.query.filter_by(user_id=session['user_id'], phone_e164=phone_e164).first()
+            flash(f'{phone_e164} is already in your friends as {existing.name if existing else name}', 'error')
+            return redirect(url_for('friends'))
         flash('Friend added successfully!', 'success')
         return redirect(url_for('friends'))
     
     user_friends = Friend.query.filter_by(user_id=session['user_id']).order_by(Friend.created_at.desc()).all()
     return render_template('friends.html', friends=user_friends)
 
-@app.route('/friends/delete/<int:friend_id>')
+def form_ids(name):
+    """Integer ids posted as a repeated form field; non-numbers are dropped"""
+    return [int(value) for value in request.form.getlist(name) if value.isdigit()]
+
+@app.route('/friends/delete/<int:friend_id>', methods=['POST'])
 @login_required
 def delete_friend(friend_id):
-    friend = Friend.query.filter_by(id=friend_id, user_id=session['user_id']).first()
-    if friend:
-        BillShare.query.filter_by(friend_id=friend_id).delete()
-        db.session.delete(friend)
-        db.session.commit()
+    if bulk_delete.delete_friends(session['user_id'], [friend_id]):
         flash('Friend deleted successfully!', 'success')
     else:
         flash('Friend not found', 'error')
     return redirect(url_for('friends'))
 
+@app.route('/friends/delete', methods=['POST'])
+@login_required
+def delete_friends():
+    friend_ids = form_ids('friend_ids')
+    if not friend_ids:
+        flash('Select the friends to delete', 'error')
+        return redirect(url_for('friends'))
+    deleted = bulk_delete.delete_friends(session['user_id'], friend_ids)
+    flash(f'Deleted {deleted} friends and their bill shares.', 'success')
+    return redirect(url_for('friends'))
+
+@app.route('/friends/import', methods=['POST'])
+@login_required
+def import_friends():
+    file = request.files.get('contacts_file')
+    if not file or file.filename == '':
+        flash('No file selected', 'error')
+        return redirect(url_for('friends'))
+    if not file.filename.lower().endswith(('.csv', '.vcf', '.vcard')):
+        flash('Invalid file type. Please upload a CSV or vCard (.vcf) file.', 'error')
+        return redirect(url_for('friends'))
+
+    try:
+        result = contacts.import_contacts(session['user_id'], file.stream, file.filename,
+                                          request.form.get('country_code') or contacts.DEFAULT_COUNTRY_CODE)
+    except (UnicodeDecodeError, ValueError) as e:
+        db.session.rollback()
+        flash(f'Could not read contacts: {e}', 'error')
+        return redirect(url_for('friends'))
+
+    flash(f'Imported {result.added} friends ({result.skipped_existing} already in your list).', 'success')
+    if result.error_count:
+        details = '; '.join(f'line {line}: {message}' for line, message in result.errors[:5])
+        flash(f'{result.error_count} contacts skipped - {details}', 'error')
+    return redirect(url_for('friends'))
+
+@app.route('/friends/duplicates')
+@login_required
+def friend_duplicates():
+    groups = contacts.find_duplicates(session['user_id'])
+    share_counts = dict(
+        db.session.query(BillShare.friend_id, db.func.count(BillShare.id))
+        .join(Friend, Friend.id == BillShare.friend_id)
+        .filter(Friend.user_id == session['user_id'])
+        .group_by(BillShare.friend_id)
+    )
+    return render_template('friend_duplicates.html', groups=groups, share_counts=share_counts)
+
+@app.route('/friends/merge', methods=['POST'])
+@login_required
+def merge_friends():
+    try:
+        keep_id = int(request.form['keep_id'])
+        merge_ids = [int(friend_id) for friend_id in request.form.getlist('merge_ids')]
+    except (KeyError, ValueError):
+        flash('Choose which friend to keep', 'error')
+        return redirect(url_for('friend_duplicates'))
+
+    if not [friend_id for friend_id in merge_ids if friend_id != keep_id]:
+        flash('Select at least one duplicate to merge into the friend you keep', 'error')
+        return redirect(url_for('friend_duplicates'))
+
+    moved = contacts.merge_friends(session['user_id'], keep_id, merge_ids)
+    flash(f'Merged friends and moved {moved} bill shares.', 'success')
+    return redirect(url_for('friend_duplicates'))
+
 @app.route('/bills')
 @login_required
 def bills():
-    user_bills = Bill.query.filter_by(user_id=session['user_id']).order_by(Bill.visit_date.desc()).all()
-    return render_template('bills.html', bills=user_bills)
+    query = Bill.query.filter_by(user_id=session['user_id'])
+    status = request.args.get('status', '')
+    condition = share_status.status_filter(status)
+    if condition is not None:
+        query = query.filter(condition)
+    else:
+        status = ''
+    user_bills = query.order_by(Bill.visit_date.desc()).all()
+    return render_template('bills.html', bills=user_bills, status=status)
 
 # NEW: Download all bills as CSV
 @app.route('/bills/download_all')
 @login_required
 def download_all_bills():
     """Download all bills as CSV"""
-    user_id = session['user_id']
-    bills = Bill.query.filter_by(user_id=user_id).order_by(Bill.visit_date.desc()).all()
-    
-    # Create CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(['Bill ID', 'Restaurant Name', 'Visit Date', 'Base Amount', 'Discount', 'Service Charge', 'Tax', 'Total Amount', 'Created Date'])
-    
-    # Write bill data
-    total_base = 0
-    total_discount = 0
-    total_service = 0
-    total_tax = 0
-    total_overall = 0
-    
-    for bill in bills:
-        writer.writerow([
-            bill.id,
-            bill.restaurant_name,
-            bill.visit_date.strftime('%Y-%m-%d'),
-            f"${bill.base_amount:.2f}",
-            f"${bill.discount_amount:.2f}",
-            f"${bill.service_charge:.2f}",
-            f"${bill.tax_amount:.2f}",
-            f"${bill.total_amount:.2f}",
-            bill.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        ])
-        total_base += bill.base_amount
-        total_discount += bill.discount_amount
-        total_service += bill.service_charge
-        total_tax += bill.tax_amount
-        total_overall += bill.total_amount
-    
-    # Write totals
-    writer.writerow([])
-    writer.writerow(['TOTALS', '', '', 
-                    f"${total_base:.2f}", 
-                    f"${total_discount:.2f}", 
-                    f"${total_service:.2f}", 
-                    f"${total_tax:.2f}", 
-                    f"${total_overall:.2f}"])
-
-    # Prepare response
-    output.seek(0)
-    filename = f"all_bills_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=filename
-    )
+    bills = bills_range_query(session['user_id'], None, None).all()
+    return csv_download(all_bills_csv_rows(bills),
+                        f"all_bills_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+
+# Typed columnar export (Parquet / Arrow IPC) for analytics tools
+@app.route('/bills/export/<dataset>.<fmt>')
+@login_required
+def export_columnar(dataset, fmt):
+    """Download bills or shares with typed numeric and date columns"""
+    if dataset not in columnar_export.DATASETS or fmt not in columnar_export.FORMATS:
+        flash('Unknown export format', 'error')
+        return redirect(url_for('bills'))
+    if not columnar_export.available():
+        flash('Parquet/Arrow export is not available on this server (pyarrow is not installed)', 'error')
+        return redirect(url_for('bills'))
+
+    extension, mimetype = columnar_export.FORMATS[fmt]
+    sink = columnar_export.export_file(dataset, fmt, session['user_id'])
+    filename = f"{dataset}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return send_file(sink, mimetype=mimetype, as_attachment=True, download_name=filename)
 
 # NEW: Download bills by date range
 @app.route('/bills/download_range', methods=['GET', 'POST'])
@@ -448,97 +1047,71 @@ def download_bills_range():
             return redirect(url_for('bills'))
         
         try:
-            start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-            end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-            
-            if start_date_obj > end_date_obj:
-                flash('Start date cannot be after end date', 'error')
-                return redirect(url_for('bills'))
-                
-        except ValueError:
-            flash('Invalid date format', 'error')
+            start_date_obj, end_date_obj = parse_date_range(start_date, end_date)
+        except ValueError as e:
+            flash(str(e), 'error')
             return redirect(url_for('bills'))
         
         user_id = session['user_id']
-        bills = Bill.query.filter(
-            Bill.user_id == user_id,
-            Bill.visit_date >= start_date_obj,
-            Bill.visit_date <= end_date_obj
-        ).order_by(Bill.visit_date.desc()).all()
+        query = bills_range_query(user_id, start_date_obj, end_date_obj)
+        bill_count = query.count()
         
-        if not bills:
+        if not bill_count:
             flash('No bills found in the selected date range', 'error')
             return redirect(url_for('bills'))
         
-        # Create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow(['Date Range', f'{start_date} to {end_date}'])
-        writer.writerow([])
-        writer.writerow(['Bill ID', 'Restaurant Name', 'Visit Date', 'Base Amount', 'Discount', 'Service Charge', 'Tax', 'Total Amount'])
-        
-        # Write bill data
-        total_base = 0
-        total_discount = 0
-        total_service = 0
-        total_tax = 0
-        total_overall = 0
-        
-        for bill in bills:
-            writer.writerow([
-                bill.id,
-                bill.restaurant_name,
-                bill.visit_date.strftime('%Y-%m-%d'),
-                f"${bill.base_amount:.2f}",
-                f"${bill.discount_amount:.2f}",
-                f"${bill.service_charge:.2f}",
-                f"${bill.tax_amount:.2f}",
-                f"${bill.total_amount:.2f}"
-            ])
-            total_base += bill.base_amount
-            total_discount += bill.discount_amount
-            total_service += bill.service_charge
-            total_tax += bill.tax_amount
-            total_overall += bill.total_amount
-        
-        # Write totals
-        writer.writerow([])
-        writer.writerow(['TOTALS', '', '', 
-                        f"${total_base:.2f}", 
-                        f"${total_discount:.2f}", 
-                        f"${total_service:.2f}", 
-                        f"${total_tax:.2f}", 
-                        f"${total_overall:.2f}"])
-
-        # Prepare response
-        output.seek(0)
         filename = f"bills_{start_date}_to_{end_date}.csv"
         
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
-        )
+        # Large ranges are built in the background instead of inside the request
+        if bill_count > app.config['EXPORT_SYNC_ROW_LIMIT']:
+            job = export_jobs.start_export(user_id, 'bills_range',
+                                           {'start_date': start_date, 'end_date': end_date}, filename)
+            return redirect(url_for('export_job', job_id=job.id))
+        
+        return csv_download(bills_range_csv_rows(query.all(), start_date, end_date), filename)
     
     # GET request - show date range form
     return render_template('download_range.html')
 
-@app.route('/bills/delete/<int:bill_id>')
+@app.route('/bills/delete/<int:bill_id>', methods=['POST'])
 @login_required
 def delete_bill(bill_id):
-    bill = Bill.query.filter_by(id=bill_id, user_id=session['user_id']).first()
-    if bill:
-        BillShare.query.filter_by(bill_id=bill_id).delete()
-        db.session.delete(bill)
-        db.session.commit()
+    deleted, _ = bulk_delete.delete_bills(session['user_id'], ids=[bill_id])
+    if deleted:
         flash('Bill deleted successfully!', 'success')
     else:
         flash('Bill not found', 'error')
     return redirect(url_for('bills'))
 
+@app.route('/bills/delete', methods=['POST'])
+@login_required
+def delete_bills():
+    """Delete the selected bills, or every bill visited in a date range"""
+    bill_ids = form_ids('bill_ids')
+    start_date = request.form.get('start_date')
+    end_date = request.form.get('end_date')
+    if bill_ids:
+        deleted, deferred = bulk_delete.delete_bills(session['user_id'], ids=bill_ids)
+    elif start_date and end_date:
+        try:
+            start_date_obj, end_date_obj = parse_date_range(start_date, end_date)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('bills'))
+        deleted, deferred = bulk_delete.delete_bills(session['user_id'], start_date=start_date_obj.date(),
+                                                     end_date=end_date_obj.date())
+    else:
+        flash('Select bills or both dates of a range to delete', 'error')
+        return redirect(url_for('bills'))
+
+    if not deleted:
+        flash('No bills to delete', 'error')
+    elif deferred:
+        flash(f'Deleted {deleted} bills. Their records are being cleared in the background.', 'success')
+    else:
+        flash(f'Deleted {deleted} bills and their shares.', 'success')
+    return redirect(url_for('bills'))
+
 @app.route('/add_bill', methods=['GET', 'POST'])
 @login_required
 def add_bill():
@@ -550,6 +1123,7 @@ def add_bill():
         service_charge = float(request.form.get('service_charge', 0))
         tax_amount = float(request.form.get('tax_amount', 0))  # Made optional with default 0
         total_amount = base_amount - discount_amount + service_charge + tax_amount
+        currency = fx.normalize(request.form.get('currency')) or app.config['DEFAULT_CURRENCY']
         
         bill = Bill(
             user_id=session['user_id'],
@@ -559,13 +1133,45 @@ def add_bill():
             discount_amount=discount_amount,
             service_charge=service_charge,
             tax_amount=tax_amount,  # Now accepts 0
-            total_amount=total_amount
+            total_amount=total_amount,
+            currency=currency
         )
         db.session.add(bill)
+        rollups.record_bill(bill)
         db.session.commit()
         flash('Bill added successfully!', 'success')
         return redirect(url_for('bills'))
-    return render_template('add_bill.html')
+    return render_template('add_bill.html', currencies=fx.currencies(),
+                           default_currency=app.config['DEFAULT_CURRENCY'])
+
+# Bulk import of bills and shares from our own CSV exports
+@app.route('/bills/import', methods=['GET', 'POST'])
+@login_required
+def import_bills():
+    if request.method == 'POST':
+        file = request.files.get('csv_file')
+        if not file or file.filename == '':
+            flash('No file selected', 'error')
+            return redirect(url_for('import_bills'))
+        if not file.filename.lower().endswith('.csv'):
+            flash('Invalid file type. Please upload a CSV file.', 'error')
+            return redirect(url_for('import_bills'))
+        
+        dry_run = bool(request.form.get('dry_run'))
+        try:
+            result = bill_import.import_csv(session['user_id'], file.stream, dry_run=dry_run)
+        except UnicodeDecodeError:
+            flash('The file is not valid UTF-8 CSV', 'error')
+            return redirect(url_for('import_bills'))
+        
+        if not dry_run and (result.bills_created or result.shares_created or result.shares_updated):
+            flash(f'Imported {result.bills_created} bills and {result.shares_created} shares'
+                  + (f', updated {result.shares_updated} shares.' if result.shares_updated else '.'), 'success')
+        if result.error_count:
+            flash(f'{result.error_count} rows could not be imported.', 'error')
+        return render_template('import_bills.html', result=result)
+    
+    return render_template('import_bills.html', result=None)
 
 @app.route('/share_bill', methods=['GET', 'POST'])
 @login_required
@@ -581,47 +1187,71 @@ def share_bill():
             flash('Bill not found', 'error')
             return redirect(url_for('share_bill'))
         
+        # A resubmitted form or a retried request answers from the first one
+        key = idempotency.request_key()
+        replay = key and idempotency.previous(user_id, 'share_bill', key)
+        if replay:
+            return replay_share_bill(replay)
+
         # Calculate per-person shares (tax and service charge are optional)
-        tax_per_person = bill.tax_amount / len(friend_ids) if friend_ids and bill.tax_amount > 0 else 0
-        service_charge_per_person = bill.service_charge / len(friend_ids) if friend_ids and bill.service_charge > 0 else 0
-        
-        bill_shares_data = []
-        for i, friend_id in enumerate(friend_ids):
-            if i < len(food_items) and i < len(food_amounts):
-                food_amount = float(food_amounts[i])
-                total_share = food_amount + tax_per_person + service_charge_per_person
-                friend = Friend.query.get(friend_id)
-                bill_share = BillShare(
-                    bill_id=bill.id,
-                    friend_id=friend_id,
-                    food_item=food_items[i],
-                    food_amount=food_amount,
-                    tax_share=tax_per_person,
-                    service_charge_share=service_charge_per_person,
-                    total_share=total_share
-                )
-                db.session.add(bill_share)
-                bill_shares_data.append({
-                    'friend_name': friend.name,
-                    'whatsapp_number': friend.whatsapp_number,
-                    'food_item': food_items[i],
-                    'food_amount': food_amount,
-                    'tax_share': tax_per_person,
-                    'service_charge_share': service_charge_per_person,
-                    'total_share': total_share
-                })
+        rows = min(len(friend_ids), len(food_items), len(food_amounts))
+        splits = share_status.split(bill.tax_amount, bill.service_charge,
+                                    [float(amount) for amount in food_amounts[:rows]], people=len(friend_ids))
+        shares = share_writes.merge(dict(friend_id=friend_id, food_item=food_item, **share._asdict())
+                                    for friend_id, food_item, share in zip(friend_ids, food_items, splits))
+        friends = {friend.id: friend for friend in Friend.query.filter(
+            Friend.user_id == user_id, Friend.id.in_([share['friend_id'] for share in shares]))}
+        if len(friends) < len({share['friend_id'] for share in shares}):
+            flash('Friend not found', 'error')
+            return redirect(url_for('share_bill'))
+        bill_shares_data = [dict(friend_name=friends[share['friend_id']].name,
+                                 whatsapp_number=friends[share['friend_id']].whatsapp_number, **share)
+                            for share in shares]
+
+        record = None
+        if key:
+            record = idempotency.claim(user_id, 'share_bill', key)
+            if record is None:
+                # Another request with this key got there first
+                replay = idempotency.previous(user_id, 'share_bill', key)
+                if not replay:
+                    flash('This form was already submitted.', 'error')
+                    return redirect(url_for('share_bill'))
+                return replay_share_bill(replay)
+        inserted, updated = share_writes.upsert(
+            bill, shares, {friend_id: friend.name for friend_id, friend in friends.items()})
+        if record is not None:
+            idempotency.complete(record, {'bill_id': bill.id, 'shares': bill_shares_data})
         db.session.commit()
-        csv_data = generate_bill_shares_csv(bill, bill_shares_data)
-        filename = f"bill_share_{bill.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        flash('Bill shared successfully! CSV file has been generated.', 'success')
-        return render_template('share_bill_success.html',
-                             bill=bill,
-                             bill_shares_data=bill_shares_data,
-                             csv_data=csv_data,
-                             filename=filename)
+        if inserted or updated:
+            flash('Bill shared successfully! CSV file has been generated.', 'success')
+        else:
+            flash('These shares were already saved.', 'info')
+        return render_share_success(bill, bill_shares_data)
     friends = Friend.query.filter_by(user_id=user_id).all()
     bills = Bill.query.filter_by(user_id=user_id).order_by(Bill.visit_date.desc()).all()
-    return render_template('share_bill.html', friends=friends, bills=bills)
+    return render_template('share_bill.html', friends=friends, bills=bills,
+                           idempotency_key=idempotency.new_key())
+
+
+def replay_share_bill(result):
+    """The success page of an earlier submission with the same idempotency key"""
+    bill = Bill.query.filter_by(id=result['bill_id'], user_id=session['user_id']).first()
+    if not bill:
+        flash('Bill not found', 'error')
+        return redirect(url_for('share_bill'))
+    flash('These shares were already saved.', 'info')
+    return render_share_success(bill, result['shares'])
+
+
+def render_share_success(bill, bill_shares_data):
+    csv_data = generate_bill_shares_csv(bill, bill_shares_data)
+    filename = f"bill_share_{bill.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return render_template('share_bill_success.html',
+                         bill=bill,
+                         bill_shares_data=bill_shares_data,
+                         csv_data=csv_data,
+                         filename=filename)
 
 
 def generate_bill_shares_csv(bill, bill_shares_data):
@@ -631,11 +1261,12 @@ def generate_bill_shares_csv(bill, bill_shares_data):
     writer.writerow([])
     writer.writerow(['Restaurant:', bill.restaurant_name])
     writer.writerow(['Visit Date:', bill.visit_date.strftime('%Y-%m-%d')])
-    writer.writerow(['Base Amount:', f"${bill.base_amount:.2f}"])
-    writer.writerow(['Discount Amount:', f"${bill.discount_amount:.2f}"])
-    writer.writerow(['Service Charge:', f"${bill.service_charge:.2f}"])
-    writer.writerow(['Tax Amount:', f"${bill.tax_amount:.2f}"])
-    writer.writerow(['Total Amount:', f"${bill.total_amount:.2f}"])
+    writer.writerow(['Currency:', bill.currency])
+    writer.writerow(['Base Amount:', fx.format_money(bill.base_amount, bill.currency)])
+    writer.writerow(['Discount Amount:', fx.format_money(bill.discount_amount, bill.currency)])
+    writer.writerow(['Service Charge:', fx.format_money(bill.service_charge, bill.currency)])
+    writer.writerow(['Tax Amount:', fx.format_money(bill.tax_amount, bill.currency)])
+    writer.writerow(['Total Amount:', fx.format_money(bill.total_amount, bill.currency)])
     writer.writerow(['Generated On:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
     writer.writerow([])
     writer.writerow(['Friend Name', 'WhatsApp Number', 'Food Item', 'Food Amount', 'Tax Share', 'Service Charge Share', 'Total Share'])
@@ -648,19 +1279,244 @@ def generate_bill_shares_csv(bill, bill_shares_data):
             share['friend_name'],
             share['whatsapp_number'],
             share['food_item'],
-            f"${share['food_amount']:.2f}",
-            f"${share['tax_share']:.2f}",
-            f"${share['service_charge_share']:.2f}",
-            f"${share['total_share']:.2f}"
+            fx.format_money(share['food_amount'], bill.currency),
+            fx.format_money(share['tax_share'], bill.currency),
+            fx.format_money(share['service_charge_share'], bill.currency),
+            fx.format_money(share['total_share'], bill.currency)
         ])
         total_food += share['food_amount']
         total_tax += share['tax_share']
         total_service_charge += share['service_charge_share']
         total_share += share['total_share']
     writer.writerow([])
-    writer.writerow(['TOTAL', '', '', f"${total_food:.2f}", f"${total_tax:.2f}", f"${total_service_charge:.2f}", f"${total_share:.2f}"])
+    writer.writerow(['TOTAL', '', '', *(fx.format_money(amount, bill.currency)
+                                        for amount in (total_food, total_tax, total_service_charge, total_share))])
     return output.getvalue()
 
+def parse_date_range(start_date, end_date):
+    """Report form dates as datetimes; ValueError says what is wrong with them"""
+    try:
+        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
+        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError('Invalid date format')
+    if start_date_obj > end_date_obj:
+        raise ValueError('Start date cannot be after end date')
+    return start_date_obj, end_date_obj
+
+def csv_download(rows, filename):
+    """Build a CSV in memory and send it as an attachment"""
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return send_file(
+        io.BytesIO(output.getvalue().encode('utf-8')),
+        mimetype='text/csv',
+        as_attachment=True,
+        download_name=filename
+    )
+
+def all_bills_csv_rows(bills):
+    """CSV rows of every bill; bills is a list, converted column by column"""
+    converter = fx.Converter()
+    target = converter.target
+    
+    # Write header
+    yield ['Bill ID', 'Restaurant Name', 'Visit Date', 'Base Amount', 'Discount', 'Service Charge', 'Tax', 'Total Amount', 'Created Date', 'Currency', f'Total ({target})']
+    
+    # Every amount column converted in one go: a rate lookup per (currency, date), not per bill
+    currencies = [bill.currency for bill in bills]
+    dates = [bill.visit_date for bill in bills]
+    columns = ('base_amount', 'discount_amount', 'service_charge', 'tax_amount', 'total_amount')
+    converted = {name: converter.column([getattr(bill, name) for bill in bills], currencies, dates)
+                 for name in columns}
+    
+    # Write bill data
+    for bill, total in zip(bills, converted['total_amount']):
+        yield [
+            bill.id,
+            bill.restaurant_name,
+            bill.visit_date.strftime('%Y-%m-%d'),
+            fx.format_money(bill.base_amount, bill.currency),
+            fx.format_money(bill.discount_amount, bill.currency),
+            fx.format_money(bill.service_charge, bill.currency),
+            fx.format_money(bill.tax_amount, bill.currency),
+            fx.format_money(bill.total_amount, bill.currency),
+            bill.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            bill.currency,
+            '' if total is None else fx.format_money(total, target)
+        ]
+    
+    # Write totals, in the reporting currency
+    yield []
+    yield ['TOTALS', '', '',
+           *(fx.format_money(sum(value for value in converted[name] if value is not None), target)
+             for name in columns),
+           '', fx.unconverted_note(converter.missing)]
+
+def bills_range_query(user_id, start_date, end_date, with_archive=None):
+    """Bills newest first; also reads the archive if the range reaches back into it
+
+    with_archive=None looks up the archive cutoff; the async handlers in
+    asgi.py look it up themselves and pass the answer in.
+    """
+    def scoped(model):
+        query = model.query.filter(model.user_id == user_id)
+        if start_date is not None:
+            query = query.filter(model.visit_date >= start_date)
+        if end_date is not None:
+            query = query.filter(model.visit_date <= end_date)
+        return query.order_by(model.visit_date.desc())
+
+    if with_archive is None:
+        with_archive = archive.needs_archive(start_date)
+    if not with_archive:
+        return scoped(Bill)
+    return archive.SpanningQuery([scoped(Bill), scoped(ArchivedBill)], key=lambda bill: bill.visit_date)
+
+def bills_range_csv_rows(bills, start_date, end_date):
+    """CSV rows of the date range report, streamed bill by bill"""
+    yield ['Date Range', f'{start_date} to {end_date}']
+    yield []
+    converter = fx.Converter()
+    target = converter.target
+    yield ['Bill ID', 'Restaurant Name', 'Visit Date', 'Base Amount', 'Discount', 'Service Charge', 'Tax', 'Total Amount', 'Currency', f'Total ({target})']
+    total_base = 0
+    total_discount = 0
+    total_service = 0
+    total_tax = 0
+    total_overall = 0
+    for bill in bills:
+        # Cached per (currency, date); bills that can't be converted stay out of the totals
+        factor = converter.factor(bill.currency, bill.visit_date)
+        yield [
+            bill.id,
+            bill.restaurant_name,
+            bill.visit_date.strftime('%Y-%m-%d'),
+            fx.format_money(bill.base_amount, bill.currency),
+            fx.format_money(bill.discount_amount, bill.currency),
+            fx.format_money(bill.service_charge, bill.currency),
+            fx.format_money(bill.tax_amount, bill.currency),
+            fx.format_money(bill.total_amount, bill.currency),
+            bill.currency,
+            '' if factor is None else fx.format_money(bill.total_amount * factor, target)
+        ]
+        if factor is None:
+            continue
+        total_base += bill.base_amount * factor
+        total_discount += bill.discount_amount * factor
+        total_service += bill.service_charge * factor
+        total_tax += bill.tax_amount * factor
+        total_overall += bill.total_amount * factor
+    yield []
+    yield ['TOTALS', '', '',
+           fx.format_money(total_base, target),
+           fx.format_money(total_discount, target),
+           fx.format_money(total_service, target),
+           fx.format_money(total_tax, target),
+           fx.format_money(total_overall, target),
+           fx.unconverted_note(converter.missing)]
+
+def friend_shares_query(user_id, friend_id, start_date, end_date, with_archive=None):
+    """A friend's shares newest first, spanning the archive when needed"""
+    hot = BillShare.query.join(Bill).options(db.contains_eager(BillShare.bill)).filter(
+        BillShare.friend_id == friend_id,
+        Bill.user_id == user_id,
+        Bill.visit_date >= start_date,
+        Bill.visit_date <= end_date
+    ).order_by(Bill.visit_date.desc())
+    if with_archive is None:
+        with_archive = archive.needs_archive(start_date)
+    if not with_archive:
+        return hot
+
+    cold = ArchivedBillShare.query.join(ArchivedBillShare.bill).options(
+        db.contains_eager(ArchivedBillShare.bill)
+    ).filter(
+        ArchivedBillShare.friend_id == friend_id,
+        ArchivedBillShare.user_id == user_id,
+        ArchivedBillShare.visit_date >= start_date,
+        ArchivedBillShare.visit_date <= end_date
+    ).order_by(ArchivedBillShare.visit_date.desc())
+    return archive.SpanningQuery([hot, cold], key=lambda share: share.bill.visit_date)
+
+def friend_bills_csv_rows(friend, bill_shares, start_date, end_date):
+    """CSV rows of a friend's statement, streamed share by share"""
+    yield ['Friend Bills Report']
+    yield ['Friend:', friend.name]
+    yield ['WhatsApp:', f"{friend.country_code}{friend.whatsapp_number}"]
+    yield ['Date Range:', f'{start_date} to {end_date}']
+    yield ['Generated On:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')]
+    yield []
+    converter = fx.Converter()
+    target = converter.target
+    yield ['Visit Date', 'Restaurant', 'Food Item', 'Food Amount', 'Tax Share', 'Service Charge', 'Total Share', 'Currency', f'Total Share ({target})']
+    total_food = 0
+    total_tax = 0
+    total_service = 0
+    total_overall = 0
+    for share in bill_shares:
+        bill = share.bill
+        factor = converter.factor(bill.currency, bill.visit_date)
+        yield [
+            bill.visit_date.strftime('%Y-%m-%d'),
+            bill.restaurant_name,
+            share.food_item,
+            fx.format_money(share.food_amount, bill.currency),
+            fx.format_money(share.tax_share, bill.currency),
+            fx.format_money(share.service_charge_share, bill.currency),
+            fx.format_money(share.total_share, bill.currency),
+            bill.currency,
+            '' if factor is None else fx.format_money(share.total_share * factor, target)
+        ]
+        if factor is None:
+            continue
+        total_food += share.food_amount * factor
+        total_tax += share.tax_share * factor
+        total_service += share.service_charge_share * factor
+        total_overall += share.total_share * factor
+    yield []
+    yield ['TOTALS', '', '',
+           fx.format_money(total_food, target),
+           fx.format_money(total_tax, target),
+           fx.format_money(total_service, target),
+           fx.format_money(total_overall, target),
+           fx.unconverted_note(converter.missing)]
+
+# Background export builders: return (row count, rows(on_progress))
+BILL_PAGE_COLUMNS = {Bill: (Bill.visit_date, Bill.id), ArchivedBill: (ArchivedBill.visit_date, ArchivedBill.id)}
+SHARE_PAGE_COLUMNS = {BillShare: (Bill.visit_date, BillShare.id),
+                      ArchivedBillShare: (ArchivedBillShare.visit_date, ArchivedBillShare.id)}
+
+def build_bills_range_export(user_id, params):
+    query = bills_range_query(user_id,
+                              datetime.strptime(params['start_date'], '%Y-%m-%d'),
+                              datetime.strptime(params['end_date'], '%Y-%m-%d'))
+
+    def rows(on_progress):
+        bills = export_jobs.tracked(export_jobs.keyset_pages(
+            query, BILL_PAGE_COLUMNS, lambda bill: (bill.visit_date, bill.id)), on_progress)
+        return bills_range_csv_rows(bills, params['start_date'], params['end_date'])
+    return query.count(), rows
+
+def build_friend_bills_export(user_id, params):
+    friend = Friend.query.filter_by(id=params['friend_id'], user_id=user_id).first()
+    if not friend:
+        raise ValueError('Friend not found')
+    query = friend_shares_query(user_id, friend.id,
+                                datetime.strptime(params['start_date'], '%Y-%m-%d'),
+                                datetime.strptime(params['end_date'], '%Y-%m-%d'))
+
+    def rows(on_progress):
+        shares = export_jobs.tracked(export_jobs.keyset_pages(
+            query, SHARE_PAGE_COLUMNS, lambda share: (share.bill.visit_date, share.id)), on_progress)
+        return friend_bills_csv_rows(friend, shares, params['start_date'], params['end_date'])
+    return query.count(), rows
+
+EXPORT_REPORTS = {
+    'bills_range': build_bills_range_export,
+    'friend_bills': build_friend_bills_export,
+}
+
 # NEW: Friend's bill download by date range
 @app.route('/friend_bills/download', methods=['GET', 'POST'])
 @login_required
@@ -678,15 +1534,9 @@ def download_friend_bills():
             return redirect(url_for('download_friend_bills'))
         
         try:
-            start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-            end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-            
-            if start_date_obj > end_date_obj:
-                flash('Start date cannot be after end date', 'error')
-                return redirect(url_for('download_friend_bills'))
-                
-        except ValueError:
-            flash('Invalid date format', 'error')
+            start_date_obj, end_date_obj = parse_date_range(start_date, end_date)
+        except ValueError as e:
+            flash(str(e), 'error')
             return redirect(url_for('download_friend_bills'))
         
         # Get friend details
@@ -696,89 +1546,125 @@ def download_friend_bills():
             return redirect(url_for('download_friend_bills'))
         
         # Get bills shared with this friend in the date range
-        bill_shares = BillShare.query.join(Bill).filter(
-            BillShare.friend_id == friend_id,
-            Bill.user_id == user_id,
-            Bill.visit_date >= start_date_obj,
-            Bill.visit_date <= end_date_obj
-        ).order_by(Bill.visit_date.desc()).all()
+        query = friend_shares_query(user_id, friend.id, start_date_obj, end_date_obj)
+        share_count = query.count()
         
-        if not bill_shares:
+        if not share_count:
             flash(f'No bills found for {friend.name} in the selected date range', 'error')
             return redirect(url_for('download_friend_bills'))
         
-        # Create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow(['Friend Bills Report'])
-        writer.writerow(['Friend:', friend.name])
-        writer.writerow(['WhatsApp:', f"{friend.country_code}{friend.whatsapp_number}"])
-        writer.writerow(['Date Range:', f'{start_date} to {end_date}'])
-        writer.writerow(['Generated On:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
-        writer.writerow([])
-        writer.writerow(['Visit Date', 'Restaurant', 'Food Item', 'Food Amount', 'Tax Share', 'Service Charge', 'Total Share'])
-        
-        # Write bill share data
-        total_food = 0
-        total_tax = 0
-        total_service = 0
-        total_overall = 0
-        
-        for share in bill_shares:
-            writer.writerow([
-                share.bill.visit_date.strftime('%Y-%m-%d'),
-                share.bill.restaurant_name,
-                share.food_item,
-                f"${share.food_amount:.2f}",
-                f"${share.tax_share:.2f}",
-                f"${share.service_charge_share:.2f}",
-                f"${share.total_share:.2f}"
-            ])
-            total_food += share.food_amount
-            total_tax += share.tax_share
-            total_service += share.service_charge_share
-            total_overall += share.total_share
-        
-        # Write totals
-        writer.writerow([])
-        writer.writerow(['TOTALS', '', '', 
-                        f"${total_food:.2f}", 
-                        f"${total_tax:.2f}", 
-                        f"${total_service:.2f}", 
-                        f"${total_overall:.2f}"])
-
-        # Prepare response
-        output.seek(0)
         filename = f"{friend.name}_bills_{start_date}_to_{end_date}.csv"
         
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
-        )
+        # Large ranges are built in the background instead of inside the request
+        if share_count > app.config['EXPORT_SYNC_ROW_LIMIT']:
+            job = export_jobs.start_export(user_id, 'friend_bills',
+                                           {'friend_id': friend.id, 'start_date': start_date, 'end_date': end_date},
+                                           filename)
+            return redirect(url_for('export_job', job_id=job.id))
+        
+        return csv_download(friend_bills_csv_rows(friend, query.all(), start_date, end_date), filename)
     
     # GET request - show form with friends list
     friends = Friend.query.filter_by(user_id=user_id).order_by(Friend.name).all()
     return render_template('download_friend_bills.html', friends=friends)
 
+# EXPORT JOB ROUTES
+@app.route('/exports/<job_id>')
+@login_required
+def export_job(job_id):
+    """Progress page for a background export"""
+    job = ExportJob.query.filter_by(id=job_id, user_id=session['user_id']).first()
+    if not job:
+        flash('Export not found or expired', 'error')
+        return redirect(url_for('bills'))
+    return render_template('export_job.html', job=job, status=export_jobs.job_status(job))
+
+@app.route('/exports/<job_id>/status')
+@login_required
+def export_job_status(job_id):
+    job = ExportJob.query.filter_by(id=job_id, user_id=session['user_id']).first()
+    if not job:
+        return jsonify({'error': 'Export not found or expired'}), 404
+    return jsonify(export_jobs.job_status(job))
+
+@app.route('/exports/<job_id>/download')
+@login_required
+@compression.exempt
+def download_export(job_id):
+    """Serve a finished export; conditional=True enables Range/resume"""
+    job = ExportJob.query.filter_by(id=job_id, user_id=session['user_id']).first()
+    if not job or job.expires_at <= datetime.utcnow() or not job.file_path or not os.path.exists(job.file_path):
+        flash('Export not found or expired', 'error')
+        return redirect(url_for('bills'))
+    if job.status != 'done':
+        return redirect(url_for('export_job', job_id=job.id))
+    return send_file(
+        os.path.abspath(job.file_path),
+        mimetype='text/csv',
+        as_attachment=True,
+        download_name=job.download_name,
+        conditional=True,
+        max_age=0
+    )
+
 @app.route('/get_bill_details/<int:bill_id>')
 @login_required
 def get_bill_details(bill_id):
     bill = Bill.query.filter_by(id=bill_id, user_id=session['user_id']).first()
     if bill:
-        return jsonify({
-            'restaurant_name': bill.restaurant_name,
-            'base_amount': bill.base_amount,
-            'discount_amount': bill.discount_amount,
-            'service_charge': bill.service_charge,
-            'tax_amount': bill.tax_amount,
-            'total_amount': bill.total_amount
-        })
+        return jsonify(bill_details(bill))
     return jsonify({'error': 'Bill not found'})
 
+def bill_details(bill):
+    return {
+        'restaurant_name': bill.restaurant_name,
+        'base_amount': bill.base_amount,
+        'discount_amount': bill.discount_amount,
+        'service_charge': bill.service_charge,
+        'tax_amount': bill.tax_amount,
+        'total_amount': bill.total_amount,
+        'currency': bill.currency,
+        'currency_symbol': fx.symbol(bill.currency),
+        'items': json.loads(bill.line_items) if bill.line_items else []
+    }
+
+# SYNC API - bills, shares and friends changed since the client's cursor
+@app.route('/api/sync')
+@login_required
+def api_sync():
+    """Delta of the user's data as JSON; no cursor (or 0) returns a full snapshot"""
+    try:
+        cursor = int(request.args.get('cursor') or 0)
+        limit = min(int(request.args.get('limit', sync.PAGE_SIZE)), sync.MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'cursor and limit must be integers'}), 400
+    if cursor < 0 or limit < 1:
+        return jsonify({'error': 'cursor must be >= 0 and limit >= 1'}), 400
+
+    if not cursor:
+        return jsonify(sync.snapshot(session['user_id']))
+    return jsonify(sync.changes_since(session['user_id'], cursor, limit,
+                                      app.config['SYNC_SETTLE_SECONDS']))
+
+# ANALYTICS ROUTES - read only from the spend_rollup table
+@app.route('/analytics/spending')
+@login_required
+def spending_analytics():
+    """Spend over time per restaurant, friend or charge category as JSON"""
+    try:
+        top = min(int(request.args.get('top', 8)), 50)
+        data = rollups.spending_series(
+            session['user_id'],
+            dimension=request.args.get('dimension', 'restaurant'),
+            grain=request.args.get('grain', 'month'),
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            top=top,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(data)
+
 # IMAGE UPLOAD & OCR ROUTES
 @app.route('/upload_bill_image', methods=['GET', 'POST'])
 @login_required
@@ -795,46 +1681,18 @@ def upload_bill_image():
             return redirect(request.url)
 
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            # Read the upload once: OCR gets the bytes directly, the disk copy is only kept for the bill
+            image_bytes = file.read()
+            filename = save_upload(file.filename, image_bytes)
 
             try:
-                # Process with OCR - try with different settings
-                ocr_result = ocr_space_file(filepath, overlay=False, language='eng')
-
-                if ocr_result.get('IsErroredOnProcessing'):
-                    # Try with different language setting
-                    ocr_result = ocr_space_file(filepath, overlay=False, language='eng')
-
-                if ocr_result.get('IsErroredOnProcessing'):
-                    flash('OCR processing failed. Please try another image or enter amounts manually.', 'error')
-                    return redirect(request.url)
-
-                # Extract text from OCR result
-                parsed_results = ocr_result.get('ParsedResults', [])
-                if not parsed_results:
-                    flash('No text could be extracted from the image.', 'error')
-                    return redirect(request.url)
-
-                parsed_text = parsed_results[0].get('ParsedText', '')
-
-                if not parsed_text or len(parsed_text.strip()) < 10:
-                    flash('Very little text extracted. Please try a clearer image.', 'error')
-                    return redirect(request.url)
-
-                # Extract amounts from text
-                amounts = extract_amounts_from_text(parsed_text)
-
-                # If no amounts found, provide guidance
-                if amounts['total'] == 0 and amounts['subtotal'] == 0:
-                    flash('No amounts detected automatically. Please enter the amounts manually below.', 'warning')
-
-                flash('Bill image processed successfully! Review the extracted amounts below.', 'success')
-                return render_template('process_bill_image.html',
-                                     extracted_text=parsed_text,
-                                     amounts=amounts,
-                                     image_filename=filename)
+                # Process with OCR - the client retries failed processing on the other engine
+                try:
+                    # Word boxes let line_items rebuild the receipt's item rows
+                    ocr_result = ocr_space_bytes(image_bytes, filename, overlay=True, language='eng')
+                except ocr_client.OCRError as e:
+                    return ocr_failure_response(e)
+                return ocr_upload_response(ocr_result, filename)
 
             except Exception as e:
                 flash(f'Error processing image: {str(e)}', 'error')
@@ -845,69 +1703,211 @@ def upload_bill_image():
 
     return render_template('upload_bill_image.html')
 
-@app.route('/create_bill_from_ocr', methods=['POST'])
+def save_upload(original_filename, content):
+    """Keep an uploaded bill image; returns the name it was saved under"""
+    filename = secure_filename(original_filename)
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], filename), 'wb') as f:
+        f.write(content)
+    return filename
+
+def ocr_failure_response(error):
+    """Send the user to manual entry when the OCR service can't be used"""
+    if isinstance(error, ocr_client.CircuitOpenError):
+        flash('Bill scanning is temporarily unavailable. Please enter the amounts manually.', 'error')
+    else:
+        flash('The OCR service is not responding. Please enter the amounts manually.', 'error')
+    return redirect(url_for('add_bill'))
+
+def ocr_upload_response(ocr_result, filename):
+    """Review page for a scanned bill, or back to the upload form saying what went wrong"""
+    if ocr_result.get('IsErroredOnProcessing'):
+        flash('OCR processing failed. Please try another image or enter amounts manually.', 'error')
+        return redirect(request.url)
+
+    # Extract text from OCR result
+    parsed_results = ocr_result.get('ParsedResults', [])
+    if not parsed_results:
+        flash('No text could be extracted from the image.', 'error')
+        return redirect(request.url)
+
+    parsed_text = parsed_results[0].get('ParsedText', '')
+
+    if not parsed_text or len(parsed_text.strip()) < 10:
+        flash('Very little text extracted. Please try a clearer image.', 'error')
+        return redirect(request.url)
+
+    # Extract amounts from text, and the dishes from the word layout
+    amounts = extract_amounts_from_text(parsed_text)
+    items = line_items.extract_line_items(ocr_result)
+
+    # If no amounts found, provide guidance
+    if amounts['total'] == 0 and amounts['subtotal'] == 0:
+        flash('No amounts detected automatically. Please enter the amounts manually below.', 'warning')
+
+    flash('Bill image processed successfully! Review the extracted amounts below.', 'success')
+    return render_template('process_bill_image.html',
+                         extracted_text=parsed_text,
+                         amounts=amounts,
+                         items=items,
+                         items_json=json.dumps(line_items.to_json(items)),
+                         image_filename=filename,
+                         currencies=fx.currencies(),
+                         default_currency=app.config['DEFAULT_CURRENCY'])
+
+@app.route('/ocr/metrics')
 @login_required
-def create_bill_from_ocr():
+def ocr_metrics():
+    """Circuit breaker state, retry/hedge counters and latency percentiles"""
+    return jsonify(ocr_client.get_client().metrics())
+
+def build_ocr_bill(user_id, form):
+    """Validated Bill from a reviewed OCR form; raises ValueError with a message for the user"""
+    restaurant_name = form.get('restaurant_name') or ''
     try:
-        # Get form data
-        restaurant_name = request.form['restaurant_name']
-        visit_date = request.form['visit_date']
-        base_amount = float(request.form.get('base_amount', 0))
-        discount_amount = float(request.form.get('discount_amount', 0))
-        service_charge = float(request.form.get('service_charge', 0))
-        tax_amount = float(request.form.get('tax_amount', 0))  # Made optional
-        total_amount = float(request.form.get('total_amount', 0))
-        image_filename = request.form.get('image_filename', '')
+        base_amount = float(form.get('base_amount') or 0)
+        discount_amount = float(form.get('discount_amount') or 0)
+        service_charge = float(form.get('service_charge') or 0)
+        tax_amount = float(form.get('tax_amount') or 0)  # Made optional
+        total_amount = float(form.get('total_amount') or 0)
+    except ValueError:
+        raise ValueError('Please enter valid numeric amounts')
+    try:
+        visit_date = datetime.strptime(form.get('visit_date') or '', '%Y-%m-%d')
+    except ValueError:
+        raise ValueError('Please enter a valid visit date')
 
-        print(f"Received data: {restaurant_name}, {visit_date}, base: {base_amount}, discount: {discount_amount}, service: {service_charge}, tax: {tax_amount}, total: {total_amount}")  # Debug
+    # Validate required fields
+    if not restaurant_name.strip():
+        raise ValueError('Restaurant name is required')
 
-        # Validate required fields
-        if not restaurant_name or not restaurant_name.strip():
-            flash('Restaurant name is required', 'error')
-            return redirect(url_for('upload_bill_image'))
+    currency = app.config['DEFAULT_CURRENCY']
+    if form.get('currency'):
+        currency = fx.normalize(form.get('currency'))
+        if currency is None:
+            raise ValueError('Please choose a supported currency')
 
-        if base_amount <= 0:
-            flash('Base amount must be greater than 0', 'error')
-            return redirect(url_for('upload_bill_image'))
+    if base_amount <= 0:
+        raise ValueError('Base amount must be greater than 0')
 
-        # Calculate total if it's zero or invalid
-        calculated_total = base_amount - discount_amount + service_charge + tax_amount
-        if total_amount <= 0:
-            total_amount = calculated_total
+    # Calculate total if it's zero or invalid
+    calculated_total = base_amount - discount_amount + service_charge + tax_amount
+    if total_amount <= 0:
+        total_amount = calculated_total
 
-        # Ensure total makes sense
-        if total_amount <= 0:
-            flash('Total amount must be greater than 0', 'error')
-            return redirect(url_for('upload_bill_image'))
+    # Ensure total makes sense
+    if total_amount <= 0:
+        raise ValueError('Total amount must be greater than 0')
 
-        # Create the bill
-        bill = Bill(
-            user_id=session['user_id'],
-            restaurant_name=restaurant_name.strip(),
-            visit_date=datetime.strptime(visit_date, '%Y-%m-%d'),
-            base_amount=base_amount,
-            discount_amount=discount_amount,
-            service_charge=service_charge,
-            tax_amount=tax_amount,  # Now accepts 0
-            total_amount=total_amount,
-            bill_image=image_filename
-        )
+    try:
+        items = line_items.from_json(json.loads(form.get('line_items') or '[]'))
+    except ValueError:
+        items = []
+
+    return Bill(
+        user_id=user_id,
+        restaurant_name=restaurant_name.strip(),
+        visit_date=visit_date,
+        base_amount=base_amount,
+        discount_amount=discount_amount,
+        service_charge=service_charge,
+        tax_amount=tax_amount,  # Now accepts 0
+        total_amount=total_amount,
+        currency=currency,
+        bill_image=form.get('image_filename', ''),
+        line_items=json.dumps(line_items.to_json(items)) if items else None
+    )
 
+@app.route('/create_bill_from_ocr', methods=['POST'])
+@login_required
+def create_bill_from_ocr():
+    try:
+        bill = build_ocr_bill(session['user_id'], request.form)
         db.session.add(bill)
+        rollups.record_bill(bill)
         db.session.commit()
+        log.info('Bill created from OCR', extra={'bill_id': bill.id, 'total_amount': bill.total_amount})
 
         flash('Bill created successfully from image!', 'success')
         return redirect(url_for('bills'))
 
     except ValueError as e:
-        flash('Please enter valid numeric amounts', 'error')
-        print(f"ValueError: {e}")  # Debug
+        flash(str(e), 'error')
+        log.warning('OCR bill form rejected: %s', e)
         return redirect(url_for('upload_bill_image'))
     except Exception as e:
         flash(f'Error creating bill: {str(e)}', 'error')
-        print(f"Exception: {e}")  # Debug
+        log.exception('Error creating bill from OCR')
         return redirect(url_for('upload_bill_image'))
 
+# Batch upload: many receipts scanned concurrently, then reviewed together
+@app.route('/receipts', methods=['GET', 'POST'])
+@login_required
+def receipt_review():
+    user_id = session['user_id']
+    if request.method == 'POST':
+        files = [file for file in request.files.getlist('bill_images') if file and file.filename]
+        if not files:
+            flash('No files selected', 'error')
+            return redirect(url_for('receipt_review'))
+        if len(files) > app.config['OCR_BATCH_MAX_FILES']:
+            flash(f"Please upload at most {app.config['OCR_BATCH_MAX_FILES']} receipts at a time", 'error')
+            return redirect(url_for('receipt_review'))
+
+        batch_id, queued = receipts.start_batch(user_id, files)
+        if not queued:
+            flash('Invalid file type. Please upload PNG, JPG, or JPEG.', 'error')
+            return redirect(url_for('receipt_review'))
+        skipped = len(files) - queued
+        flash(f'Scanning {queued} receipts.' + (f' {skipped} files were not images.' if skipped else ''), 'success')
+        return redirect(url_for('receipt_review', batch=batch_id))
+
+    batch_id = request.args.get('batch')
+    queue = receipts.review_queue(user_id, batch_id)
+    return render_template('receipt_review.html', reviews=queue, batch_id=batch_id,
+                           scanning=any(review.status == 'scanning' for review in queue),
+                           max_files=app.config['OCR_BATCH_MAX_FILES'],
+                           currencies=fx.currencies(),
+                           default_currency=app.config['DEFAULT_CURRENCY'])
+
+@app.route('/receipts/confirm', methods=['POST'])
+@login_required
+def confirm_receipts():
+    user_id = session['user_id']
+    batch_id = request.form.get('batch_id') or None
+    try:
+        review_ids = [int(review_id) for review_id in request.form.getlist('review_ids')]
+    except ValueError:
+        review_ids = []
+    if not review_ids:
+        flash('Select the receipts to confirm or discard', 'error')
+        return redirect(url_for('receipt_review', batch=batch_id))
+
+    if request.form.get('action') == 'discard':
+        count = receipts.discard(user_id, review_ids)
+        flash(f'Discarded {count} receipts.', 'success')
+        return redirect(url_for('receipt_review', batch=batch_id))
+
+    # One currency for the whole batch: receipts from a trip share it
+    currency = request.form.get('currency', '')
+    forms = {
+        review_id: dict({name: request.form.get(f'{name}-{review_id}', '') for name in receipts.FIELDS},
+                        currency=currency)
+        for review_id in review_ids
+    }
+    try:
+        created, errors = receipts.confirm(user_id, forms)
+    except Exception as e:
+        flash(f'Error creating bills: {str(e)}', 'error')
+        log.exception('Error confirming receipts')
+        return redirect(url_for('receipt_review', batch=batch_id))
+
+    log.info('Bills created from receipt batch', extra={'bills': created, 'rejected': len(errors)})
+    if created:
+        flash(f'Created {created} bills from receipts.', 'success')
+    if errors:
+        flash(f'{len(errors)} receipts need fixing before they can be confirmed.', 'error')
+    return redirect(url_for('receipt_review', batch=batch_id))
+
 # WHATSAPP ROUTES
 @app.route('/share_bill_whatsapp/<int:bill_id>')
 @login_required
@@ -921,6 +1921,7 @@ def share_bill_whatsapp(bill_id):
     for share in bill_shares:
         friend = Friend.query.get(share.friend_id)
         bill_shares_data.append({
+            'friend_id': friend.id,
             'friend_name': friend.name,
             'whatsapp_number': friend.whatsapp_number,
             'food_item': share.food_item,
@@ -936,18 +1937,7 @@ def share_bill_whatsapp(bill_id):
                          whatsapp_message=message)
 
 def create_whatsapp_message(bill, bill_shares_data):
-    message = f"🍽️ *Bill Sharing - {bill.restaurant_name}*\n"
-    message += f"Date: {bill.visit_date.strftime('%Y-%m-%d')}\n"
-    message += f"Total Amount: ${bill.total_amount:.2f}\n\n"
-    message += "*Individual Shares:*\n"
-    for share in bill_shares_data:
-        message += f"👤 {share['friend_name']}:\n"
-        message += f"   Food: ${share['food_amount']:.2f} ({share['food_item']})\n"
-        message += f"   Tax: ${share['tax_share']:.2f}\n"
-        message += f"   Service: ${share['service_charge_share']:.2f}\n"
-        message += f"   *Total: ${share['total_share']:.2f}*\n\n"
-    message += "Please transfer your share. Thank you! 🙏"
-    return message
+    return notifications.bill_message(bill, bill_shares_data)
 
 @app.route('/send_whatsapp_individual/<int:bill_id>/<int:friend_id>')
 @login_required
@@ -964,17 +1954,55 @@ def send_whatsapp_individual(bill_id, friend_id):
         flash('Share not found', 'error')
         return redirect(url_for('bills'))
     
-    message = f"Hi {friend.name}! 👋\n\n"
-    message += f"Here's your share for {bill.restaurant_name}:\n"
-    message += f"🍽️ Food: ${share.food_amount:.2f} ({share.food_item})\n"
-    message += f"📊 Tax: ${share.tax_share:.2f}\n"
-    message += f"🔔 Service: ${share.service_charge_share:.2f}\n"
-    message += f"💰 *Total Amount: ${share.total_share:.2f}*\n\n"
-    message += "Please transfer this amount. Thank you! 😊"
+    message = notifications.individual_message(friend.name, bill.restaurant_name, share, bill.currency)
     
     # Use the friend's country code in the WhatsApp URL
-    whatsapp_url = f"https://wa.me/{friend.country_code}{friend.whatsapp_number}?text={message.replace(' ', '%20').replace('\n', '%0A')}"
-    return redirect(whatsapp_url)
+    phone = notifications.whatsapp_phone(friend.country_code, friend.whatsapp_number)
+    return redirect(notifications.whatsapp_url(phone, message))
+
+# Bulk WhatsApp reminders: one message per friend for many bills at once
+@app.route('/notifications/whatsapp', methods=['GET', 'POST'])
+@login_required
+def whatsapp_reminders():
+    user_id = session['user_id']
+    if request.method == 'POST':
+        bill_ids = [int(bill_id) for bill_id in request.form.getlist('bill_ids') if bill_id.isdigit()]
+        month = request.form.get('month', '')
+        start_date = end_date = None
+        period_label = ''
+        
+        if month:
+            try:
+                start_date = datetime.strptime(month, '%Y-%m').date()
+            except ValueError:
+                flash('Invalid month', 'error')
+                return redirect(url_for('whatsapp_reminders'))
+            end_date = (start_date + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            period_label = start_date.strftime('%B %Y')
+        elif not bill_ids:
+            flash('Please select a month or at least one bill', 'error')
+            return redirect(url_for('whatsapp_reminders'))
+        
+        pack = notifications.build_pack(user_id, bill_ids=bill_ids, start_date=start_date,
+                                        end_date=end_date, period_label=period_label)
+        if not pack:
+            flash('No shares found for the selected bills', 'error')
+            return redirect(url_for('whatsapp_reminders'))
+        
+        if request.form.get('export') == 'csv':
+            output = io.StringIO()
+            csv.writer(output).writerows(notifications.pack_csv_rows(pack))
+            return send_file(
+                io.BytesIO(output.getvalue().encode('utf-8')),
+                mimetype='text/csv',
+                as_attachment=True,
+                download_name=f"whatsapp_reminders_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            )
+        return render_template('whatsapp_pack.html', pack=pack, period_label=period_label,
+                               grand_total=sum(entry.total for entry in pack))
+    
+    bills = Bill.query.filter_by(user_id=user_id).order_by(Bill.visit_date.desc()).all()
+    return render_template('whatsapp_pack.html', bills=bills, pack=None)
 
 @app.route('/logout')
 def logout():
@@ -994,6 +2022,201 @@ def logout_confirmation():
     """Logout confirmation page"""
     return render_template('logout.html')
 
+# ADMIN ROUTES
+def admin_user_filter(values):
+    """(condition, filters) from the search/status fields of a request"""
+    search = values.get('q', '').strip()
+    status = values.get('status', '')
+    if status not in admin_console.STATUSES:
+        status = ''
+    filters = {key: value for key, value in (('q', search), ('status', status)) if value}
+    return admin_console.user_filter(search, status), filters
+
+@app.route('/admin/users')
+@admin_required
+def admin_users():
+    """Users with their friend and bill counts and spend, a keyset page at a time"""
+    condition, filters = admin_user_filter(request.args)
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    rows, has_previous, has_next = admin_console.user_page(condition, after=after, before=before)
+    return render_template('admin_users.html', rows=rows, filters=filters,
+                           counts=admin_console.status_counts(),
+                           previous_before=rows[0][0].id if rows and has_previous else None,
+                           next_after=rows[-1][0].id if rows and has_next else None,
+                           roles=admin_console.ROLES, reporting_currency=fx.reporting_currency(),
+                           super_admin=get_current_user().is_super_admin)
+
+@app.route('/admin/users/update', methods=['POST'])
+@admin_required
+def admin_update_users():
+    """Approve, reject, revoke or change the role of the selected or all matching users"""
+    condition, filters = admin_user_filter(request.form)
+    action = request.form.get('action', '')
+    super_admin = get_current_user().is_super_admin
+    if action in admin_console.SUPER_ADMIN_ACTIONS and not super_admin:
+        flash('Super admin access required', 'error')
+        return redirect(url_for('admin_users', **filters))
+    if request.form.get('scope') != 'matching':
+        user_ids = form_ids('user_ids')
+        if not user_ids:
+            flash('Select users, or apply to all matching users', 'error')
+            return redirect(url_for('admin_users', **filters))
+        condition = db.and_(condition, User.id.in_(user_ids))
+    try:
+        count = admin_console.bulk_update(action, session['user_id'], condition,
+                                          role=request.form.get('role'), super_admin=super_admin)
+    except ValueError:
+        flash('Choose an action', 'error')
+        return redirect(url_for('admin_users', **filters))
+    flash(f'Updated {count} users', 'success')
+    return redirect(url_for('admin_users', **filters))
+
+@app.route('/admin/slow-queries', methods=['GET', 'POST'])
+@admin_required
+def slow_queries():
+    """Worst statements from this worker's slow-query log"""
+    if request.method == 'POST':
+        query_log.reset()
+        flash('Slow-query log cleared', 'success')
+        return redirect(url_for('slow_queries'))
+
+    order = request.args.get('order', 'total_ms')
+    if order not in ('total_ms', 'max_ms', 'mean_ms', 'count'):
+        order = 'total_ms'
+    entries = query_log.worst(limit=50, order=order)
+    if request.args.get('format') == 'json':
+        return jsonify(entries)
+    return render_template('slow_queries.html', entries=entries, order=order,
+                           enabled=query_log.enabled(), threshold=app.config['SLOW_QUERY_MS'])
+
+@app.route('/admin/compression', methods=['GET', 'POST'])
+@admin_required
+def compression_report():
+    """Bytes sent before and after compression on this worker"""
+    if request.method == 'POST':
+        compression.reset()
+        flash('Compression counters cleared', 'success')
+        return redirect(url_for('compression_report'))
+
+    report = compression.report()
+    if request.args.get('format') == 'json':
+        return jsonify(report)
+    return render_template('compression_report.html', report=report)
+
+# STATIC ASSETS
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Fingerprinted static files from `flask build-assets`"""
+    return compression.send_asset(filename)
+
+# CLI COMMANDS
+@app.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """Rebuild the spend_rollup table from all bills and shares"""
+    count = rollups.rebuild()
+    print(f"Rebuilt {count} rollup buckets")
+
+@app.cli.command('backfill-share-status')
+def backfill_share_status_command():
+    """Recompute every bill's share count and assigned/unassigned amounts"""
+    count = share_status.rebuild()
+    print(f"Corrected split totals on {count} bills")
+
+@app.cli.command('archive-bills')
+@click.option('--before', help='Archive bills visited before this date (YYYY-MM-DD); '
+                              'default ARCHIVE_AFTER_DAYS ago')
+@click.option('--batch-size', default=archive.BATCH_SIZE, show_default=True)
+def archive_bills_command(before, batch_size):
+    """Move old bills and their shares to archive storage"""
+    cutoff = datetime.strptime(before, '%Y-%m-%d').date() if before else None
+    archive_run = archive.run(cutoff, batch_size)
+    print(f"Archived {archive_run.bills_moved} bills and {archive_run.shares_moved} shares "
+          f"visited before {archive_run.cutoff}")
+
+@app.cli.command('generate-statements')
+@click.option('--month', help='Statement month (YYYY-MM); default last month')
+@click.option('--workers', type=int, help='Worker processes; default STATEMENT_WORKERS')
+@click.option('--output', type=click.Path(dir_okay=False), help='Zip to write; default in STATEMENT_FOLDER')
+def generate_statements_command(month, workers, output):
+    """Build every friend's CSV and PDF statement for a month into one zip"""
+    if month:
+        start_date = datetime.strptime(month, '%Y-%m').date()
+    else:
+        start_date = (datetime.now().date().replace(day=1) - timedelta(days=1)).replace(day=1)
+    end_date = (start_date + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+    output = output or os.path.join(app.config['STATEMENT_FOLDER'], f"statements_{start_date:%Y-%m}.zip")
+    manifest = statements.generate(start_date, end_date, output, workers)
+    print(f"Wrote {len(manifest['statements'])} statements for {manifest['users']} users "
+          f"({start_date} to {end_date}) to {output}")
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files into ASSET_FOLDER"""
+    manifest = compression.build(app)
+    original = sum(entry['bytes'] for entry in manifest.values())
+    gzipped = sum(entry.get('gz', entry['bytes']) for entry in manifest.values())
+    print(f"Built {len(manifest)} assets into {app.config['ASSET_FOLDER']}: "
+          f"{original} bytes, {gzipped} gzipped" + ('' if compression.brotli else ' (brotli not installed)'))
+
+@app.cli.command('purge-deleted-bills')
+def purge_deleted_bills_command():
+    """Remove bills left soft-deleted by a large bulk delete"""
+    purged = bulk_delete.purge_deleted()
+    print(f"Purged {purged} deleted bills")
+
+@app.cli.command('compact-change-log')
+def compact_change_log_command():
+    """Drop sync log entries superseded by a later change to the same row"""
+    count = sync.compact()
+    print(f"Removed {count} superseded change log entries")
+
+@app.cli.command('dedupe-bill-shares')
+def dedupe_bill_shares_command():
+    """Fold duplicate shares of a bill item into one, amounts summed, then add the unique index"""
+    removed = share_writes.dedupe()
+    share_writes.ensure_unique_index()
+    print(f"Folded {removed} duplicate bill shares")
+
+@app.cli.command('import-bills')
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='Validate only, write nothing')
+def import_bills_command(username, path, dry_run):
+    """Import a bills / bill share / friend bills CSV for a user"""
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f'No user named {username}')
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        result = bill_import.import_csv(user.id, f, dry_run=dry_run)
+    print(f"{'Would import' if dry_run else 'Imported'} {result.bills_created} bills and "
+          f"{result.shares_created} shares from {result.rows_read} rows ({result.layout})"
+          + (f", updated {result.shares_updated} shares" if result.shares_updated else ''))
+    for line, message in result.errors:
+        print(f"  line {line}: {message}")
+    if result.error_count > len(result.errors):
+        print(f"  ... and {result.error_count - len(result.errors)} more errors")
+
+@app.cli.command('purge-exports')
+def purge_exports_command():
+    """Delete export files past their retention period"""
+    count = export_jobs.purge_expired()
+    print(f"Purged {count} expired exports")
+
+@app.cli.command('make-admin')
+@click.argument('username')
+@click.option('--super', 'super_admin', is_flag=True, help='Make a super admin, who can revoke access and set roles')
+def make_admin_command(username, super_admin):
+    """Grant a user approved admin access"""
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f'No user named {username}')
+    user.is_admin = user.admin_requested = user.admin_approved = True
+    user.role = 'super_admin' if super_admin else 'admin'
+    user.approved_at = datetime.utcnow()
+    db.session.commit()
+    print(f"{username} is now {'a super admin' if super_admin else 'an admin'}")
+
 # ERROR HANDLERS
 @app.errorhandler(404)
 def not_found_error(error):
@@ -0,0 +1,153 @@
+# app_logging.py - Structured, non-blocking logging
+#
+# Request threads never write to stdout themselves: a QueueHandler on the
+# root logger puts records on a bounded in-memory queue, and a
+# QueueListener thread formats them as one JSON object per line and writes
+# them out. When the queue is full, records are dropped and counted instead
+# of stalling the request.
+#
+# LOG_LEVEL sets the root level (default INFO). Calls below that level
+# return straight after a level check, so debug logging costs nothing
+# while it is off. LOG_SAMPLE thins out chatty loggers, e.g. "app=0.1,ocr_client=0.5".
+# Only DEBUG and INFO records are sampled; warnings and errors always go
+# through. Any extra field whose name is in REDACTED_FIELDS is masked, and
+# so is any long run of digits in a message (phone or card numbers), so
+# receipt text and form payloads do not reach the logs.
+import atexit
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+REDACTED = '[redacted]'
+REDACTED_FIELDS = {
+    'password', 'text', 'ocr_text', 'form', 'phone', 'whatsapp_number',
+    'restaurant_name', 'food_item', 'apikey', 'api_key',
+}
+DIGIT_RUN = re.compile(r'\+?\d[\d\s-]{8,}\d')
+
+# Attributes every LogRecord has; anything else was passed via extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_lock = threading.Lock()
+
+
+def redact(value):
+    if isinstance(value, str):
+        return DIGIT_RUN.sub(REDACTED, value)
+    return value
+
+
+def record_fields(record):
+    """The extra= fields of a record, with sensitive ones masked"""
+    attrs = vars(record)
+    return {
+        key: REDACTED if key in REDACTED_FIELDS else redact(attrs[key])
+        for key in attrs.keys() - _RECORD_ATTRS
+        if not key.startswith('_')
+    }
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': redact(record.getMessage()),
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of DEBUG/INFO records per logger (prefix match)"""
+
+    def __init__(self, rates, rng=random.random):
+        super().__init__()
+        # Longest prefix first so "app.ocr" wins over "app"
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+        self.rng = rng
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not self.rates:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + '.'):
+                return rate >= 1 or self.rng() < rate
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: a full queue drops the record"""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Merge args here (they may be mutated after the call returns) but
+        # leave JSON formatting and redaction to the listener thread. This is
+        # the root's only handler, so the record can be changed in place.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def parse_sample_rates(spec):
+    """"app=0.1, ocr_client=0.5" -> {'app': 0.1, 'ocr_client': 0.5}"""
+    rates = {}
+    for part in (spec or '').split(','):
+        name, sep, rate = part.partition('=')
+        if sep and name.strip():
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+def setup_logging(level='INFO', sample='', stream=None, queue_size=10000):
+    """Route the root logger through a background writer thread (idempotent)"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return _listener
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JSONFormatter())
+
+        records = queue.Queue(maxsize=queue_size)
+        handler = DroppingQueueHandler(records)
+        handler.addFilter(SamplingFilter(parse_sample_rates(sample)))
+
+        root = logging.getLogger()
+        root.handlers[:] = [handler]
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+
+        _listener = QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
@@ -0,0 +1,206 @@
+# archive.py - Moving old bills and their shares out of the hot tables
+#
+# Bills with a visit_date older than ARCHIVE_AFTER_DAYS are moved in
+# batches, together with their shares, into bill_archive and
+# bill_share_archive. On SQLite those tables live in a separate database
+# file (the 'archive' bind). On Postgres they are range-partitioned by
+# visit_date in the main database, one partition per year, and partitions
+# are created as the archive reaches new years. The archived share rows
+# carry user_id and visit_date, so friend reports on them need no join to
+# find their partition.
+#
+# Each run first records its cutoff in archive_run. Reports compare the
+# requested start date with the newest cutoff and read the archive only
+# when the range reaches back before it. SpanningQuery then merges the hot
+# and archived results, which are both sorted newest first.
+#
+# On Postgres a batch moves in one transaction. On SQLite it spans two
+# database files, so the archive copy is committed before the hot rows are
+# deleted. Re-running the batch replaces any copy left by an interrupted
+# run, matched by id and visit_date. Bill and share ids are AUTOINCREMENT
+# on SQLite, so a new row never takes the id of an archived one. Spending
+# rollups are not touched: archived spend still counts in the analytics
+# views.
+import heapq
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import tuple_
+
+BATCH_SIZE = 1000
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def is_partitioned():
+    from app import db
+    return db.engine.dialect.name == 'postgresql'
+
+
+def archived_before():
+    """Newest cutoff of any archive run: older bills may be in the archive"""
+    from app import db, ArchiveRun
+    return db.session.query(db.func.max(ArchiveRun.cutoff)).scalar()
+
+
+def needs_archive(start_date):
+    """Does a report starting at start_date (None: no lower bound) reach archived dates?"""
+    return reaches_cutoff(start_date, archived_before())
+
+
+def reaches_cutoff(start_date, cutoff):
+    if cutoff is None:
+        return False
+    return start_date is None or _as_date(start_date) < cutoff
+
+
+class SpanningQuery:
+    """Hot and archive queries read as one, newest first
+
+    Supports the parts of the Query interface the reports use: count(),
+    all(), yield_per() and iteration.
+    """
+
+    def __init__(self, queries, key):
+        self.queries = queries
+        self.key = key
+
+    def count(self):
+        return sum(query.count() for query in self.queries)
+
+    def yield_per(self, count):
+        return heapq.merge(*(query.yield_per(count) for query in self.queries), key=self.key, reverse=True)
+
+    def __iter__(self):
+        return heapq.merge(*self.queries, key=self.key, reverse=True)
+
+    def all(self):
+        return list(self)
+
+
+def ensure_partitions(years):
+    """Yearly range partitions of both archive tables (Postgres only)"""
+    from app import db
+
+    for year in sorted(years):
+        for table in ('bill_archive', 'bill_share_archive'):
+            db.session.execute(db.text(
+                f'CREATE TABLE IF NOT EXISTS {table}_y{year} PARTITION OF {table} '
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+            ))
+
+
+def _copy_rows(rows, columns, archived_at):
+    return [
+        dict({key: value for key, value in row._mapping.items() if key in columns}, archived_at=archived_at)
+        for row in rows
+    ]
+
+
+def archive_batch(cutoff, batch_size=BATCH_SIZE):
+    """Move up to batch_size bills older than cutoff; returns (bills, shares) moved"""
+    from app import db, Bill, BillShare, ArchivedBill, ArchivedBillShare, ARCHIVE_BIND
+
+    bill_ids = [bill_id for (bill_id,) in db.session.query(Bill.id).filter(
+        Bill.visit_date < cutoff
+    ).order_by(Bill.visit_date, Bill.id).limit(batch_size)]
+    if not bill_ids:
+        return 0, 0
+
+    now = datetime.utcnow()
+    bill_table, share_table = Bill.__table__, BillShare.__table__
+    archive_bills, archive_shares = ArchivedBill.__table__, ArchivedBillShare.__table__
+
+    bills = _copy_rows(
+        db.session.execute(bill_table.select().where(bill_table.c.id.in_(bill_ids))),
+        set(archive_bills.c.keys()), now)
+    shares = _copy_rows(
+        db.session.execute(
+            db.select(share_table, bill_table.c.user_id, bill_table.c.visit_date)
+            .join(bill_table, bill_table.c.id == share_table.c.bill_id)
+            .where(share_table.c.bill_id.in_(bill_ids))
+        ),
+        set(archive_shares.c.keys()), now)
+
+    if is_partitioned():
+        ensure_partitions({bill['visit_date'].year for bill in bills})
+
+    # Replace whatever an interrupted run of this batch copied already:
+    # rows with these bills' ids and visit dates. An older archived bill
+    # that had the same id is left alone. The statements name the models,
+    # so they are routed to the archive bind.
+    copied = [(bill['id'], bill['visit_date']) for bill in bills]
+    unsynced = {'synchronize_session': False}
+    db.session.execute(db.delete(ArchivedBillShare).where(
+        tuple_(ArchivedBillShare.bill_id, ArchivedBillShare.visit_date).in_(copied)),
+        execution_options=unsynced)
+    db.session.execute(db.delete(ArchivedBill).where(
+        tuple_(ArchivedBill.id, ArchivedBill.visit_date).in_(copied)),
+        execution_options=unsynced)
+    db.session.execute(db.insert(ArchivedBill), bills)
+    if shares:
+        db.session.execute(db.insert(ArchivedBillShare), shares)
+    if ARCHIVE_BIND:
+        db.session.commit()
+
+    db.session.execute(share_table.delete().where(share_table.c.bill_id.in_(bill_ids)))
+    db.session.execute(bill_table.delete().where(bill_table.c.id.in_(bill_ids)))
+    db.session.commit()
+    return len(bills), len(shares)
+
+
+def run(cutoff=None, batch_size=BATCH_SIZE):
+    """Archive every bill older than cutoff (default: ARCHIVE_AFTER_DAYS ago)"""
+    from app import app, db, ArchiveRun
+
+    if cutoff is None:
+        cutoff = date.today() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])
+    archive_run = ArchiveRun(cutoff=cutoff, bills_moved=0, shares_moved=0)
+    db.session.add(archive_run)
+    db.session.commit()  # reports start looking in the archive from here on
+
+    while True:
+        bills, shares = archive_batch(cutoff, batch_size)
+        if not bills:
+            break
+        archive_run.bills_moved += bills
+        archive_run.shares_moved += shares
+        db.session.commit()
+    archive_run.finished_at = datetime.utcnow()
+    db.session.commit()
+    return archive_run
+
+
+def share_totals(*criteria):
+    """Archived (user_id, visit_date, currency, friend_id, amount, count) per day"""
+    from app import db, ArchivedBill, ArchivedBillShare
+
+    return db.session.query(
+        ArchivedBillShare.user_id, ArchivedBillShare.visit_date, ArchivedBill.currency, ArchivedBillShare.friend_id,
+        db.func.sum(ArchivedBillShare.total_share), db.func.count(ArchivedBillShare.id),
+    ).join(ArchivedBill, db.and_(ArchivedBill.id == ArchivedBillShare.bill_id,
+                                 ArchivedBill.visit_date == ArchivedBillShare.visit_date)).filter(*criteria).group_by(
+        ArchivedBillShare.user_id, ArchivedBillShare.visit_date, ArchivedBill.currency, ArchivedBillShare.friend_id)
+
+
+def friend_share_totals(friend_ids):
+    from app import ArchivedBillShare
+
+    return share_totals(ArchivedBillShare.friend_id.in_(friend_ids)).all()
+
+
+def move_friend_shares(from_ids, to_id):
+    from app import db, ArchivedBillShare
+
+    return db.session.query(ArchivedBillShare).filter(ArchivedBillShare.friend_id.in_(from_ids)).update(
+        {ArchivedBillShare.friend_id: to_id}, synchronize_session=False)
+
+
+def delete_friend_shares(friend_ids):
+    from app import db, ArchivedBillShare
+
+    return db.session.query(ArchivedBillShare).filter(ArchivedBillShare.friend_id.in_(friend_ids)).delete(
+        synchronize_session=False)
@@ -0,0 +1,299 @@
+# asgi.py - Async serving mode for the I/O-bound routes
+#
+#   uvicorn asgi:app --workers 4
+#   gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+#
+# The Flask app is mounted unchanged, so every page works as under
+# `gunicorn app:app`. A few routes that spend most of their time waiting
+# are answered by async handlers instead, so one process can hold many of
+# them open at once rather than one per worker thread:
+#   POST /upload_bill_image        - OCR.space through AsyncOCRClient (httpx)
+#   GET  /get_bill_details/<id>    - AsyncSession (aiosqlite / asyncpg)
+#   GET  /bills/download_all       - AsyncSession, then the shared CSV rows
+#   POST /bills/download_range     -   "
+#   POST /friend_bills/download    -   "
+# Other methods on those paths (the GET forms) fall through to Flask.
+#
+# The handlers share everything but the waiting with the sync views: the
+# models and query builders, the CSV row builders, amount and line-item
+# extraction, templates, flash messages and the signed session cookie.
+# Each runs inside a Flask request context built from the ASGI request,
+# and its Flask response (session cookie included) is copied back out.
+# Rate limits apply as in the sync app, with the queueing wait awaited.
+# The async handlers only read from the database; reports over
+# EXPORT_SYNC_ROW_LIMIT are queued as background exports, as before.
+import asyncio
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+
+from a2wsgi import WSGIMiddleware
+from flask import flash, jsonify, redirect, request as flask_request, session, url_for
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.test import EnvironBuilder
+
+import archive
+import export_jobs
+import ocr_client
+import rate_limit
+from app import (app as flask_app, db, ArchiveRun, Bill, Friend, all_bills_csv_rows, allowed_file,
+                 bill_details, bills_range_csv_rows, bills_range_query, csv_download,
+                 friend_bills_csv_rows, friend_shares_query, login_redirect, ocr_failure_response,
+                 ocr_upload_response, parse_date_range, save_upload)
+
+ASYNC_DRIVERS = {'sqlite': 'aiosqlite', 'postgresql': 'asyncpg'}
+
+# httpx logs every request at INFO; the OCR client keeps its own counters
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+async_session = None
+
+
+def async_url(url):
+    """The same database through its asyncio driver"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == 'postgresql' and 'sslmode' in url.query:
+        # asyncpg takes libpq's sslmode values under the name ssl
+        url = url.difference_update_query(['sslmode']).update_query_dict({'ssl': url.query['sslmode']})
+    return url.set(drivername=f'{backend}+{ASYNC_DRIVERS[backend]}')
+
+
+@asynccontextmanager
+async def lifespan(_):
+    global async_session
+    with flask_app.app_context():
+        engines = {key: create_async_engine(async_url(engine.url)) for key, engine in db.engines.items()}
+        # Archive tables may live in their own database (the archive bind)
+        binds = {table: engines[key] for key, metadata in db.metadatas.items()
+                 for table in metadata.tables.values()}
+    async_session = async_sessionmaker(binds=binds, expire_on_commit=False)
+    try:
+        yield
+    finally:
+        await ocr_client.close_async_client()
+        for engine in engines.values():
+            await engine.dispose()
+
+
+@contextmanager
+def flask_context(request):
+    """Flask request context for an ASGI request: session, url_for, flash, templates"""
+    headers = [(name, value) for name, value in request.headers.items()
+               if name not in ('content-type', 'content-length')]
+    builder = EnvironBuilder(
+        path=request.url.path,
+        base_url=str(request.base_url),
+        query_string=request.url.query,
+        method=request.method,
+        headers=headers,
+        environ_base={'REMOTE_ADDR': request.client.host if request.client else ''},
+    )
+    environ = builder.get_environ()
+    hops = flask_app.config['TRUSTED_PROXY_HOPS']
+    if hops:
+        # The client address flask_app.wsgi_app's ProxyFix gives the sync views
+        ProxyFix(lambda environ, start_response: None, x_for=hops, x_proto=hops)(environ, None)
+    with flask_app.request_context(environ):
+        yield
+
+
+def asgi_response(rv):
+    """Finish a Flask view result (after_request, session cookie) as a Starlette response"""
+    response = flask_app.process_response(flask_app.make_response(rv))
+    response.direct_passthrough = False
+    body = response.get_data()
+    out = Response(body, status_code=response.status_code)
+    out.raw_headers = [(b'content-length', str(len(body)).encode('latin-1'))] + [
+        (name.lower().encode('latin-1'), value.encode('latin-1'))
+        for name, value in response.headers.items() if name.lower() != 'content-length'
+    ]
+    return out
+
+
+def handler(view):
+    """Starlette endpoint for view(request, form, user_id), with rate limits and login_required"""
+    async def endpoint(request):
+        with flask_context(request):
+            length = request.headers.get('content-length', '')
+            if length.isdigit() and int(length) > flask_app.config['MAX_CONTENT_LENGTH']:
+                return asgi_response(RequestEntityTooLarge().get_response())
+            form = await request.form() if request.method == 'POST' else {}
+            # admit() writes the bucket store (SQLite, up to its busy timeout)
+            rejected, wait = await run_in_threadpool(rate_limit.admit)
+            if rejected is not None:
+                return asgi_response(rejected)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if 'user_id' not in session:
+                return asgi_response(login_redirect())
+            return asgi_response(await view(request, form, session['user_id']))
+    return endpoint
+
+
+# Reading the sync app's queries through an AsyncSession
+
+async def reaches_archive(db_session, start_date):
+    cutoff = await db_session.scalar(select(func.max(ArchiveRun.cutoff)))
+    return archive.reaches_cutoff(start_date, cutoff)
+
+
+def _parts(query):
+    return query.queries if isinstance(query, archive.SpanningQuery) else [query]
+
+
+async def count(db_session, query):
+    total = 0
+    for part in _parts(query):
+        total += await db_session.scalar(
+            select(func.count()).select_from(part.order_by(None).enable_eagerloads(False).subquery()))
+    return total
+
+
+async def fetch_all(db_session, query):
+    results = [(await db_session.scalars(part.statement)).all() for part in _parts(query)]
+    if len(results) == 1:
+        return results[0]
+    return list(archive.SpanningQuery(results, key=query.key))
+
+
+def in_app_context(fn, *args):
+    """Run sync code that writes through db.session, off the event loop"""
+    def run():
+        with flask_app.app_context():
+            return fn(*args)
+    return run_in_threadpool(run)
+
+
+# Handlers
+
+@handler
+async def upload_bill_image(request, form, user_id):
+    file = form.get('bill_image')
+    if file is None or not getattr(file, 'filename', ''):
+        flash('No file selected', 'error')
+        return redirect(flask_request.url)
+    if not allowed_file(file.filename):
+        flash('Invalid file type. Please upload PNG, JPG, or JPEG.', 'error')
+        return redirect(flask_request.url)
+
+    image_bytes = await file.read()
+    filename = await run_in_threadpool(save_upload, file.filename, image_bytes)
+    try:
+        try:
+            ocr_result = await ocr_client.get_async_client().parse(
+                image_bytes, filename, overlay=True, language='eng')
+        except ocr_client.OCRError as e:
+            return ocr_failure_response(e)
+        return ocr_upload_response(ocr_result, filename)
+    except Exception as e:
+        flash(f'Error processing image: {str(e)}', 'error')
+        return redirect(flask_request.url)
+
+
+@handler
+async def get_bill_details(request, form, user_id):
+    async with async_session() as db_session:
+        bill = await db_session.scalar(
+            select(Bill).filter_by(id=request.path_params['bill_id'], user_id=user_id))
+    if bill:
+        return jsonify(bill_details(bill))
+    return jsonify({'error': 'Bill not found'})
+
+
+@handler
+async def download_all_bills(request, form, user_id):
+    async with async_session() as db_session:
+        query = bills_range_query(user_id, None, None, with_archive=await reaches_archive(db_session, None))
+        bills = await fetch_all(db_session, query)
+    return csv_download(all_bills_csv_rows(bills),
+                        f"all_bills_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+
+
+@handler
+async def download_bills_range(request, form, user_id):
+    start_date = form.get('start_date')
+    end_date = form.get('end_date')
+    if not start_date or not end_date:
+        flash('Please select both start and end dates', 'error')
+        return redirect(url_for('bills'))
+    try:
+        start_date_obj, end_date_obj = parse_date_range(start_date, end_date)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('bills'))
+
+    async with async_session() as db_session:
+        query = bills_range_query(user_id, start_date_obj, end_date_obj,
+                                  with_archive=await reaches_archive(db_session, start_date_obj))
+        bill_count = await count(db_session, query)
+        if not bill_count:
+            flash('No bills found in the selected date range', 'error')
+            return redirect(url_for('bills'))
+
+        filename = f"bills_{start_date}_to_{end_date}.csv"
+        if bill_count > flask_app.config['EXPORT_SYNC_ROW_LIMIT']:
+            job_id = await in_app_context(lambda: export_jobs.start_export(
+                user_id, 'bills_range', {'start_date': start_date, 'end_date': end_date}, filename).id)
+            return redirect(url_for('export_job', job_id=job_id))
+        bills = await fetch_all(db_session, query)
+    return csv_download(bills_range_csv_rows(bills, start_date, end_date), filename)
+
+
+@handler
+async def download_friend_bills(request, form, user_id):
+    friend_id = form.get('friend_id')
+    start_date = form.get('start_date')
+    end_date = form.get('end_date')
+    if not friend_id or not start_date or not end_date:
+        flash('Please select friend and both date ranges', 'error')
+        return redirect(url_for('download_friend_bills'))
+    try:
+        start_date_obj, end_date_obj = parse_date_range(start_date, end_date)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('download_friend_bills'))
+
+    async with async_session() as db_session:
+        friend = await db_session.scalar(select(Friend).filter_by(
+            id=int(friend_id) if friend_id.isdigit() else None, user_id=user_id))
+        if not friend:
+            flash('Friend not found', 'error')
+            return redirect(url_for('download_friend_bills'))
+
+        query = friend_shares_query(user_id, friend.id, start_date_obj, end_date_obj,
+                                    with_archive=await reaches_archive(db_session, start_date_obj))
+        share_count = await count(db_session, query)
+        if not share_count:
+            flash(f'No bills found for {friend.name} in the selected date range', 'error')
+            return redirect(url_for('download_friend_bills'))
+
+        filename = f"{friend.name}_bills_{start_date}_to_{end_date}.csv"
+        if share_count > flask_app.config['EXPORT_SYNC_ROW_LIMIT']:
+            params = {'friend_id': friend.id, 'start_date': start_date, 'end_date': end_date}
+            job_id = await in_app_context(lambda: export_jobs.start_export(
+                user_id, 'friend_bills', params, filename).id)
+            return redirect(url_for('export_job', job_id=job_id))
+        shares = await fetch_all(db_session, query)
+    return csv_download(friend_bills_csv_rows(friend, shares, start_date, end_date), filename)
+
+
+app = Starlette(
+    routes=[
+        Route('/upload_bill_image', upload_bill_image, methods=['POST']),
+        Route('/get_bill_details/{bill_id:int}', get_bill_details, methods=['GET']),
+        Route('/bills/download_all', download_all_bills, methods=['GET']),
+        Route('/bills/download_range', download_bills_range, methods=['POST']),
+        Route('/friend_bills/download', download_friend_bills, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
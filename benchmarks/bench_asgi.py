@@ -0,0 +1,190 @@
+# bench_asgi.py - Concurrent requests one process can serve: WSGI vs ASGI mode
+#
+# Usage: python benchmarks/bench_asgi.py [--threads 8] [--delay 0.5] [--seconds 5]
+#
+# Starts a local stub of the OCR.space endpoint that takes --delay seconds
+# to answer, then runs the app as a single process in each mode:
+#   wsgi - gunicorn app:app, one gthread worker with --threads threads
+#   asgi - uvicorn asgi:app, one worker
+# and keeps N requests in flight (N = 1, 8, 32, 128) for --seconds each:
+#   upload - POST /upload_bill_image, waits on the OCR stub
+#   bill   - GET /get_bill_details/1, a database read
+# The sync worker serves at most --threads uploads at a time, so its
+# throughput flattens at threads / delay while latency grows with N. The
+# async worker keeps them all in flight until the OCR pool
+# (OCR_POOL_SIZE, set to the largest N here) or the CPU runs out. The
+# load generator runs on the same host, so on a small box it competes
+# for the CPU. The bill read is there for contrast: against SQLite it
+# does not wait on anything, and aiosqlite adds a thread hop per query,
+# so the sync worker is as fast or faster. The async mode pays off on
+# routes that wait on the network: OCR, or a remote Postgres.
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONCURRENCY = (1, 8, 32, 128)
+SECRET_KEY = 'bench-asgi'
+RESPONSE = json.dumps({
+    'IsErroredOnProcessing': False,
+    'ParsedResults': [{'ParsedText': 'CAFE\nPaneer Tikka 2 300.00\nSUBTOTAL 300.00\nTAX 15.00\nTOTAL 315.00'}],
+}).encode()
+
+
+def start_ocr_stub(delay):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(RESPONSE)))
+            self.end_headers()
+            self.wfile.write(RESPONSE)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def prepare(env):
+    """One user with one bill; returns that user's session cookie"""
+    os.environ.update(env)
+    sys.path.insert(0, ROOT)
+    from datetime import date
+    from app import app, db, Bill, User
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', password='x')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Bill(user_id=user.id, restaurant_name='Cafe', visit_date=date.today(),
+                            base_amount=300, discount_amount=0, service_charge=0, tax_amount=15, total_amount=315))
+        db.session.commit()
+        user_id = user.id
+    return app.session_interface.get_signing_serializer(app).dumps({'user_id': user_id})
+
+
+def start_server(mode, port, threads, env, workdir):
+    if mode == 'wsgi':
+        command = ['gunicorn', 'app:app', '--workers', '1', '--worker-class', 'gthread',
+                   '--threads', str(threads), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    else:
+        command = ['uvicorn', 'asgi:app', '--workers', '1', '--host', '127.0.0.1', '--port', str(port),
+                   '--log-level', 'warning', '--no-access-log']
+    process = subprocess.Popen(command, cwd=workdir, env=dict(os.environ, PYTHONPATH=ROOT, **env),
+                               stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/login', timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+async def load(base_url, cookie, route, concurrency, seconds):
+    """Keep `concurrency` requests in flight; returns (requests/s, p50, p95, errors)"""
+    latencies, errors = [], 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, cookies={'session': cookie}, limits=limits,
+                                 timeout=60) as client:
+        deadline = time.monotonic() + seconds
+
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    if route == 'upload':
+                        response = await client.post('/upload_bill_image',
+                                                     files={'bill_image': ('bill.png', b'\x89PNG' + b'0' * 4096)})
+                    else:
+                        response = await client.get('/get_bill_details/1')
+                except httpx.TransportError:
+                    errors += 1
+                    continue
+                if response.status_code == 200:
+                    latencies.append(time.monotonic() - started)
+                else:
+                    errors += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    if not latencies:
+        return 0.0, None, None, errors
+    latencies.sort()
+    return (len(latencies) / elapsed, statistics.median(latencies),
+            latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], errors)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8, help='gthread threads in the WSGI worker')
+    parser.add_argument('--delay', type=float, default=0.5, help='seconds the OCR stub takes')
+    parser.add_argument('--seconds', type=float, default=5, help='duration of each run')
+    args = parser.parse_args()
+
+    ocr = start_ocr_stub(args.delay)
+    with tempfile.TemporaryDirectory() as workdir:
+        env = {
+            'DATABASE_URL': f'sqlite:///{os.path.join(workdir, "bench.db")}',
+            'SECRET_KEY': SECRET_KEY,
+            'OCR_API_URL': f'http://127.0.0.1:{ocr.server_port}/parse/image',
+            'OCR_POOL_SIZE': str(max(CONCURRENCY)),
+            'FX_RATES_FILE': os.path.join(ROOT, 'fx_rates.csv'),
+            'RATE_LIMIT_ENABLED': '0',
+        }
+        os.chdir(workdir)
+        cookie = prepare(env)
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+
+        print(f'OCR stub delay {args.delay}s, WSGI worker threads {args.threads}, {args.seconds}s per run')
+        print(f"{'mode':<5} {'route':<7} {'in flight':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+        for mode in ('wsgi', 'asgi'):
+            port = free_port()
+            server = start_server(mode, port, args.threads, env, workdir)
+            try:
+                for route in ('upload', 'bill'):
+                    for concurrency in CONCURRENCY:
+                        rate, p50, p95, errors = asyncio.run(
+                            load(f'http://127.0.0.1:{port}', cookie, route, concurrency, args.seconds))
+                        p50 = f'{p50 * 1000:8.0f}' if p50 is not None else '       -'
+                        p95 = f'{p95 * 1000:8.0f}' if p95 is not None else '       -'
+                        print(f'{mode:<5} {route:<7} {concurrency:>9} {rate:>8.1f} {p50} {p95} {errors:>7}')
+            finally:
+                server.terminate()
+                server.wait()
+    ocr.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# bench_columnar_export.py - Size and speed of CSV vs Parquet vs Arrow exports
+#
+# Usage: python benchmarks/bench_columnar_export.py [bills] [shares_per_bill]
+#
+# Seeds a throwaway SQLite database with synthetic bills and shares, then
+# downloads every export through the Flask test client (so the full request
+# path is measured) and reports bytes, wall time and rows/second. The CSV
+# numbers also include the cost a consumer pays to turn "$12.34" strings
+# back into floats, which the typed formats avoid.
+import csv
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+DB_DIR = tempfile.mkdtemp(prefix='bench_export_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from app import app, db, User, Friend, Bill, BillShare  # noqa: E402
+
+
+def seed(n_bills, shares_per_bill, seed_value=42):
+    rng = random.Random(seed_value)
+    with app.app_context():
+        user = User(username='bench', password=generate_password_hash('benchmark'))
+        db.session.add(user)
+        db.session.flush()
+        friends = [Friend(user_id=user.id, name=f'Friend {i}', country_code='+91',
+                          whatsapp_number=f'98765{i:05d}') for i in range(20)]
+        db.session.add_all(friends)
+        db.session.flush()
+
+        start = date(2023, 1, 1)
+        bills, shares = [], []
+        for i in range(n_bills):
+            base = round(rng.uniform(10, 500), 2)
+            tax = round(base * 0.08, 2)
+            bills.append(dict(id=i + 1, user_id=user.id, restaurant_name=f'Restaurant {rng.randint(1, 200)}',
+                              visit_date=start + timedelta(days=rng.randint(0, 700)),
+                              base_amount=base, discount_amount=0.0, service_charge=0.0,
+                              tax_amount=tax, total_amount=base + tax))
+            for j in range(shares_per_bill):
+                amount = round(base / shares_per_bill, 2)
+                shares.append(dict(bill_id=i + 1, friend_id=friends[rng.randrange(20)].id,
+                                   food_item=f'Item {j}', food_amount=amount,
+                                   tax_share=tax / shares_per_bill, service_charge_share=0.0,
+                                   total_share=amount + tax / shares_per_bill))
+        db.session.execute(Bill.__table__.insert(), bills)
+        if shares:
+            db.session.execute(BillShare.__table__.insert(), shares)
+        db.session.commit()
+
+
+def login():
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'benchmark'})
+    return client
+
+
+def timed_get(client, url):
+    start = time.perf_counter()
+    response = client.get(url)
+    body = response.get_data()
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, (url, response.status_code)
+    return body, elapsed
+
+
+def parse_csv_amounts(body):
+    """What a consumer has to do with the CSV before it is usable"""
+    rows = 0
+    for row in csv.reader(io.StringIO(body.decode('utf-8'))):
+        if len(row) >= 8 and row[3].startswith('$') and row[0] != 'TOTALS':
+            [float(value.lstrip('$')) for value in row[3:8]]
+            rows += 1
+    return rows
+
+
+def main():
+    n_bills = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    shares_per_bill = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    seed(n_bills, shares_per_bill)
+    client = login()
+
+    print(f'{n_bills} bills, {n_bills * shares_per_bill} shares')
+    print(f"{'export':<22}{'bytes':>14}{'seconds':>10}{'rows/s':>12}")
+
+    body, elapsed = timed_get(client, '/bills/download_all')
+    start = time.perf_counter()
+    parse_csv_amounts(body)
+    parse_time = time.perf_counter() - start
+    print(f"{'bills csv':<22}{len(body):>14,}{elapsed:>10.3f}{n_bills / elapsed:>12,.0f}")
+    print(f"{'  + parse $ strings':<22}{'':>14}{parse_time:>10.3f}")
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print('pyarrow is not installed - skipping Parquet/Arrow')
+        return
+
+    for dataset, rows in (('bills', n_bills), ('shares', n_bills * shares_per_bill)):
+        for fmt in ('parquet', 'arrow'):
+            body, elapsed = timed_get(client, f'/bills/export/{dataset}.{fmt}')
+            print(f"{dataset + ' ' + fmt:<22}{len(body):>14,}{elapsed:>10.3f}{rows / elapsed:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
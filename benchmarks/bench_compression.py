@@ -0,0 +1,105 @@
+# bench_compression.py - Bytes on the wire before and after compression
+#
+# Usage: python benchmarks/bench_compression.py [bills] [friends]
+#
+# Seeds a throwaway SQLite database, then requests the heaviest pages and
+# downloads through the Flask test client twice: without Accept-Encoding
+# (what every response cost before compression.py) and with gzip. Reports
+# bytes both ways and the time each request took. Then builds the static
+# assets and lists each text asset's size as-is, .gz and .br.
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+DB_DIR = tempfile.mkdtemp(prefix='bench_compression_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+os.environ['ASSET_FOLDER'] = os.path.join(DB_DIR, 'assets')
+os.environ['RATE_LIMIT_ENABLED'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import compression  # noqa: E402
+from app import app, db, User, Friend, Bill, BillShare  # noqa: E402
+
+PAGES = [
+    ('GET', '/dashboard', None),
+    ('GET', '/friends', None),
+    ('GET', '/bills', None),
+    ('GET', '/share_bill', None),
+    ('GET', '/bills/download_all', None),
+    ('POST', '/bills/download_range', {'start_date': '2024-01-01', 'end_date': '2024-12-31'}),
+]
+
+
+def seed(n_bills, n_friends, seed_value=46):
+    rng = random.Random(seed_value)
+    with app.app_context():
+        user = User(username='bench', password=generate_password_hash('benchmark'))
+        db.session.add(user)
+        db.session.flush()
+        friends = [Friend(user_id=user.id, name=f'Friend {i}', country_code='+91',
+                          whatsapp_number=f'98765{i:05d}', avatar=f'avatar{i % 10 + 1}.png')
+                   for i in range(n_friends)]
+        db.session.add_all(friends)
+        db.session.flush()
+        bills, shares = [], []
+        for i in range(n_bills):
+            base = round(rng.uniform(10, 500), 2)
+            tax = round(base * 0.05, 2)
+            bills.append(dict(id=i + 1, user_id=user.id, restaurant_name=f'Restaurant {rng.randint(1, 200)}',
+                              visit_date=date(2024, 1, 1) + timedelta(days=rng.randint(0, 365)),
+                              base_amount=base, discount_amount=0.0, service_charge=0.0,
+                              tax_amount=tax, total_amount=base + tax))
+            shares.append(dict(bill_id=i + 1, friend_id=rng.choice(friends).id, food_item='Thali',
+                               food_amount=base, tax_share=tax, service_charge_share=0.0, total_share=base + tax))
+        db.session.execute(Bill.__table__.insert(), bills)
+        db.session.execute(BillShare.__table__.insert(), shares)
+        db.session.commit()
+
+
+def fetch(client, method, url, data, encoding):
+    headers = {'Accept-Encoding': encoding} if encoding else {}
+    start = time.perf_counter()
+    response = client.open(url, method=method, data=data, headers=headers)
+    body = response.get_data()
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, (url, response.status_code)
+    return len(body), elapsed, response.headers.get('Content-Encoding') or '-'
+
+
+def main():
+    n_bills = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_friends = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    seed(n_bills, n_friends)
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'benchmark'})
+
+    print(f'{n_bills} bills, {n_friends} friends; gzip level {app.config["COMPRESS_LEVEL"]}')
+    print(f"{'response':<24}{'before':>12}{'after':>12}{'saved':>8}{'ms before':>11}{'ms after':>10}")
+    total_before = total_after = 0
+    for method, url, data in PAGES:
+        fetch(client, method, url, data, None)  # warm templates and caches
+        before, before_time, _ = fetch(client, method, url, data, None)
+        after, after_time, encoding = fetch(client, method, url, data, 'gzip')
+        total_before += before
+        total_after += after
+        print(f"{url:<24}{before:>12,}{after:>12,}{1 - after / before:>8.0%}"
+              f"{before_time * 1000:>11.1f}{after_time * 1000:>10.1f}  {encoding}")
+    print(f"{'total':<24}{total_before:>12,}{total_after:>12,}{1 - total_after / total_before:>8.0%}")
+
+    manifest = compression.build(app)
+    print()
+    print(f"{'asset':<24}{'bytes':>12}{'.gz':>12}{'.br':>12}")
+    for name, entry in sorted(manifest.items()):
+        if 'gz' in entry or 'br' in entry:
+            print(f"{name:<24}{entry['bytes']:>12,}{entry.get('gz', '-'):>12}{entry.get('br', '-'):>12}")
+    if compression.brotli is None:
+        print('brotli is not installed - no .br variants')
+
+
+if __name__ == '__main__':
+    main()
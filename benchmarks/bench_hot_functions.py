@@ -0,0 +1,218 @@
+# bench_hot_functions.py - Microbenchmarks of the pure CPU-bound helpers, with a baseline
+#
+# Usage: python benchmarks/bench_hot_functions.py [--save] [--only NAME] [--threshold 0.25]
+#
+# Times, and measures the peak allocation of, the functions every bill goes
+# through on seeded synthetic inputs:
+#   extract_amounts  - extract_amounts_from_text() on a short receipt and on
+#                      a long one (a few thousand OCR lines)
+#   split            - share_status.split(), the per-person share arithmetic
+#   shares_csv       - generate_bill_shares_csv()
+#   whatsapp_message - create_whatsapp_message()
+# with 1, 100 and 10k shares per bill for the last three.
+#
+# Each case is timed over --repeat repeats with the garbage collector off,
+# as timeit does, and reported as the median and the best repeat. Without
+# --save, the run is compared against hot_functions_baseline.json and exits
+# 1 when a case's best time got slower than its baseline's by more than
+# --threshold (25% by default; the best repeat is the least noisy figure)
+# or its peak allocation grew by more than --alloc-threshold (10%). --save
+# records the run as the new baseline.
+#
+# Peak allocation is deterministic for a given Python, so that check holds
+# anywhere. Timings only compare on the machine that recorded them, and on
+# a shared or throttled CPU a single SLOWER deserves a rerun before it is
+# believed. To judge a change on your own machine: check out the commit
+# before it, --save, then run the comparison on the change.
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+DB_DIR = tempfile.mkdtemp(prefix='bench_hot_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import share_status  # noqa: E402
+from app import Bill, create_whatsapp_message, extract_amounts_from_text, generate_bill_shares_csv  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hot_functions_baseline.json')
+SHARE_COUNTS = (1, 100, 10000)
+SEED = 44
+MIN_REPEAT_SECONDS = 0.2  # calls per repeat grow until one repeat takes this long
+
+DISHES = ['Paneer Tikka', 'Dal Makhani', 'Butter Naan', 'Veg Biryani', 'Masala Dosa', 'Filter Coffee',
+          'Chole Bhature', 'Gulab Jamun', 'Mango Lassi', 'Hakka Noodles', 'Chilli Paneer', 'Jeera Rice']
+NAMES = ['Asha', 'Rahul', 'Priya', 'Vikram', 'Meera', 'Arjun', 'Kavya', 'Rohan', 'Sneha', 'Dev']
+
+
+def receipt_text(rng, items):
+    """OCR-like text of a receipt with `items` item lines and the usual totals"""
+    lines = ['SPICE GARDEN RESTAURANT', '12 MG Road, Bengaluru', 'GSTIN 29ABCDE1234F1Z5',
+             f'Date: {rng.randint(1, 28):02d}/0{rng.randint(1, 9)}/2025  Table {rng.randint(1, 30)}',
+             'Item                 Qty   Amount']
+    subtotal = 0.0
+    for _ in range(items):
+        quantity = rng.randint(1, 4)
+        amount = round(quantity * rng.uniform(40, 450), 2)
+        subtotal += amount
+        lines.append(f'{rng.choice(DISHES):<20} {quantity:>3} {amount:>9.2f}')
+    tax = round(subtotal * 0.05, 2)
+    service = round(subtotal * 0.1, 2)
+    lines += [f'Sub Total: {subtotal:.2f}', f'Service Charge: {service:.2f}', f'CGST 2.5%: {tax / 2:.2f}',
+              f'SGST 2.5%: {tax / 2:.2f}', f'GST: {tax:.2f}', f'Grand Total: {subtotal + tax + service:.2f}',
+              'Thank you! Visit again']
+    return '\n'.join(lines)
+
+
+def synthetic_bill(rng, shares):
+    food = [round(rng.uniform(50, 900), 2) for _ in range(shares)]
+    base = round(sum(food), 2)
+    tax, service = round(base * 0.05, 2), round(base * 0.1, 2)
+    bill = Bill(id=1, user_id=1, restaurant_name='Spice Garden', visit_date=date(2025, 3, 14), currency='INR',
+                base_amount=base, discount_amount=0.0, service_charge=service, tax_amount=tax,
+                total_amount=base + tax + service)
+    return bill, food
+
+
+def shares_data(rng, bill, food):
+    return [dict(friend_name=f'{rng.choice(NAMES)} {i}', whatsapp_number=f'98{rng.randrange(10 ** 8):08d}',
+                 food_item=rng.choice(DISHES), **split._asdict())
+            for i, split in enumerate(share_status.split(bill.tax_amount, bill.service_charge, food))]
+
+
+def cases():
+    """{name: zero-argument callable}, built from SEED so every run sees the same inputs"""
+    rng = random.Random(SEED)
+    built = {
+        'extract_amounts/short': (extract_amounts_from_text, receipt_text(rng, 12)),
+        'extract_amounts/long': (extract_amounts_from_text, receipt_text(rng, 3000)),
+    }
+    for count in SHARE_COUNTS:
+        bill, food = synthetic_bill(rng, count)
+        data = shares_data(rng, bill, food)
+        built[f'split/{count}'] = (share_status.split, bill.tax_amount, bill.service_charge, food)
+        built[f'shares_csv/{count}'] = (generate_bill_shares_csv, bill, data)
+        built[f'whatsapp_message/{count}'] = (create_whatsapp_message, bill, data)
+    return {name: (lambda fn=fn, args=args: fn(*args)) for name, (fn, *args) in built.items()}
+
+
+def measure(fn, repeat):
+    """Median and best seconds per call over `repeat` timed repeats, and peak bytes of one call"""
+    fn()  # warm caches (compiled regexes, templates)
+    gc.collect()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        number = 1
+        while True:
+            started = time.perf_counter()
+            for _ in range(number):
+                fn()
+            elapsed = time.perf_counter() - started
+            if elapsed >= MIN_REPEAT_SECONDS:
+                break
+            number *= 2 if elapsed * 4 >= MIN_REPEAT_SECONDS else 10
+
+        per_call = [elapsed / number]
+        for _ in range(repeat - 1):
+            started = time.perf_counter()
+            for _ in range(number):
+                fn()
+            per_call.append((time.perf_counter() - started) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return {'median_us': round(statistics.median(per_call) * 1e6, 2), 'best_us': round(min(per_call) * 1e6, 2),
+            'calls': number * repeat, 'peak_bytes': peak}
+
+
+def environment():
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'machine': platform.machine(), 'system': platform.system()}
+
+
+def compare(results, baseline, threshold, alloc_threshold):
+    """Print each case against the baseline; returns the names that regressed"""
+    if baseline['environment'] != environment():
+        print(f"note: baseline recorded on {baseline['environment']}, this is {environment()}")
+    regressed = []
+    print(f"{'case':<26} {'base us':>10} {'now us':>10} {'time':>7} {'base KiB':>9} {'now KiB':>9} {'alloc':>7}"
+          "   (best of each run)")
+    for name, now in results.items():
+        base = baseline['cases'].get(name)
+        if base is None:
+            print(f"{name:<26} {'-':>10} {now['best_us']:>10.1f} {'new':>7} {'-':>9} "
+                  f"{now['peak_bytes'] / 1024:>9.1f}")
+            continue
+        time_change = now['best_us'] / base['best_us'] - 1
+        alloc_change = now['peak_bytes'] / base['peak_bytes'] - 1 if base['peak_bytes'] else 0.0
+        flags = []
+        if time_change > threshold:
+            flags.append('SLOWER')
+        if alloc_change > alloc_threshold:
+            flags.append('MORE MEMORY')
+        if flags:
+            regressed.append(name)
+        print(f"{name:<26} {base['best_us']:>10.1f} {now['best_us']:>10.1f} {time_change:>+7.0%} "
+              f"{base['peak_bytes'] / 1024:>9.1f} {now['peak_bytes'] / 1024:>9.1f} {alloc_change:>+7.0%}"
+              f"  {' '.join(flags)}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--save', action='store_true', help='record this run as the baseline')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--only', default='', help='run only cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=7, help='timed repeats per case')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown of the best time')
+    parser.add_argument('--alloc-threshold', type=float, default=0.10, help='allowed growth of peak bytes')
+    args = parser.parse_args()
+
+    results = {}
+    for name, fn in cases().items():
+        if args.only in name:
+            results[name] = measure(fn, args.repeat)
+            print(f"{name:<26} median {results[name]['median_us']:>10.1f} us  best {results[name]['best_us']:>10.1f} us  "
+                  f"{results[name]['peak_bytes'] / 1024:>9.1f} KiB", file=sys.stderr)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'environment': environment(), 'seed': SEED, 'cases': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Saved {len(results)} cases to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}; record one with --save')
+        return 1
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressed = compare(results, baseline, args.threshold, args.alloc_threshold)
+    if regressed:
+        print(f"{len(regressed)} regressed: {', '.join(regressed)}")
+        return 1
+    print('No regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
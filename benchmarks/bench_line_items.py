@@ -0,0 +1,114 @@
+# bench_line_items.py - Accuracy and scaling of receipt line-item extraction
+#
+# Usage: python benchmarks/bench_line_items.py [--corpus PATH]
+#
+# Accuracy: every receipt in line_items_corpus.json (OCR.space overlay
+# responses with the items a person would enter) is parsed two ways:
+#   text lines - the plain ParsedText, one OCR line at a time (no overlay)
+#   overlay    - words regrouped into rows by their boxes (line_items.py)
+# An item counts as found when name, quantity and price all match.
+#
+# Scaling: a synthetic receipt of N rows is grouped with group_rows() and
+# with a naive grouper that compares each word against every open row. The
+# time per word should stay flat for group_rows() as N grows.
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import line_items  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'line_items_corpus.json')
+
+
+def text_lines_items(ocr_result):
+    """The baseline: no overlay, so each OCR line is parsed on its own"""
+    items = []
+    for parsed in ocr_result.get('ParsedResults') or []:
+        for line in (parsed.get('ParsedText') or '').splitlines():
+            item = line_items.parse_row(line.split())
+            if item:
+                items.append(item)
+    return items
+
+
+def score(cases, extract):
+    expected_total = found_total = correct = 0
+    for case in cases:
+        expected = {(name.lower(), quantity, price) for name, quantity, price in case['expected']}
+        found = {(item.name.lower(), item.quantity, item.price) for item in extract(case['ocr'])}
+        expected_total += len(expected)
+        found_total += len(found)
+        correct += len(expected & found)
+    precision = correct / found_total if found_total else 0.0
+    recall = correct / expected_total if expected_total else 0.0
+    return precision, recall
+
+
+def synthetic_words(rows, seed=1):
+    rng = random.Random(seed)
+    words = []
+    for row in range(rows):
+        top = 40 + row * 30 + rng.uniform(-1.5, 1.5)
+        for left, text in ((40, f'Dish{row}'), (150, 'Special'), (420, '2'), (520, f'{rng.randint(1, 999)}.00')):
+            words.append((text, left, top + rng.uniform(-1.5, 1.5), 11 * len(text), 22))
+    rng.shuffle(words)
+    return words
+
+
+def naive_rows(words):
+    """Each word is compared with every row found so far: O(words x rows)"""
+    rows = []
+    tolerance = sum(word[4] for word in words) / len(words) * line_items.ROW_TOLERANCE
+    for word in words:
+        centre = word[2] + word[4] / 2
+        for row in rows:
+            if abs(row[0] - centre) <= tolerance:
+                row[1].append(word)
+                break
+        else:
+            rows.append((centre, [word]))
+    rows.sort(key=lambda row: row[0])
+    return [[word[0] for word in sorted(row[1], key=lambda word: word[1])] for row in rows]
+
+
+def timed(fn, words, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(words)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default=CORPUS)
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding='utf-8') as f:
+        cases = json.load(f)['cases']
+    print(f'Accuracy on {len(cases)} receipts')
+    print(f"{'method':<12} {'precision':>10} {'recall':>8}")
+    for label, extract in (('text lines', text_lines_items), ('overlay', line_items.extract_line_items)):
+        precision, recall = score(cases, extract)
+        print(f'{label:<12} {precision:>10.1%} {recall:>8.1%}')
+
+    print()
+    print('Row grouping time per word')
+    print(f"{'rows':>7} {'words':>7} {'group_rows':>12} {'naive':>12}")
+    for rows in (50, 500, 5000, 50000):
+        words = synthetic_words(rows)
+        repeat = 5 if rows <= 5000 else 1
+        grouped = timed(line_items.group_rows, words, repeat)
+        naive = f'{timed(naive_rows, words, 1) / len(words) * 1e6:9.2f} us' if rows <= 5000 else '        -'
+        print(f'{rows:>7} {len(words):>7} {grouped / len(words) * 1e6:9.2f} us {naive:>12}')
+        assert len(line_items.group_rows(words)) == rows
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# bench_logging.py - Per-request logging overhead: print() vs queued structured logging
+#
+# Usage: python benchmarks/bench_logging.py [requests]
+#
+# Runs extract_amounts_from_text() on a typical receipt plus the one
+# "bill created" line an OCR upload emits, three ways:
+#   before      - the old synchronous print() debug lines, flushed to a file
+#                 (stdout is unbuffered under PYTHONUNBUFFERED / gunicorn)
+#   after/INFO  - app_logging with debug disabled (the production default)
+#   after/DEBUG - app_logging with debug enabled, written by the listener thread
+# The difference in the mean is the logging cost paid inside the request.
+# Requests run back to back here, so the listener thread's JSON formatting
+# competes for the GIL and is partly charged to them (the p99 column); with
+# idle time between real requests it runs in the gaps. Unlike print(), the
+# queued path never waits on a slow stdout pipe.
+import logging
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+DB_DIR = tempfile.mkdtemp(prefix='bench_logging_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as bill_app  # noqa: E402
+import app_logging  # noqa: E402
+
+RECEIPT = """THE CURRY HOUSE
+12 Market Street  Tel +91 98765 43210
+Paneer Tikka            320.00
+Garlic Naan x2          120.00
+Dal Makhani             260.00
+Sub Total               700.00
+Service Charge           35.00
+GST 5%                   35.00
+TOTAL                   770.00
+Thank you! Visit again
+""" * 3
+
+
+def old_request(stream):
+    """The old code path: the same parsing plus its synchronous print() lines"""
+    amounts = bill_app.extract_amounts_from_text(RECEIPT)
+    text_clean = re.sub(r'\s+', ' ', re.sub(r'[^\w\s\.\$:]', ' ', RECEIPT.lower()))
+    print(f"Cleaned OCR Text: {text_clean}", file=stream, flush=True)
+    for amount_type, amount in amounts.items():
+        if amount:
+            print(f"Found {amount_type}: {amount}", file=stream, flush=True)
+    print(f"Final amounts: {amounts}", file=stream, flush=True)
+    print(f"Received data: The Curry House, 2024-05-01, base: {amounts['subtotal']}, discount: 0.0, "
+          f"service: {amounts['service_charge']}, tax: {amounts['tax']}, total: {amounts['total']}",
+          file=stream, flush=True)
+
+
+def new_request():
+    amounts = bill_app.extract_amounts_from_text(RECEIPT)
+    bill_app.log.info('Bill created from OCR', extra={'bill_id': 1, 'total_amount': amounts['total']})
+
+
+def measure(fn, requests):
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1e6)
+    return timings
+
+
+def report(label, timings):
+    ordered = sorted(timings)
+    p99 = ordered[int(0.99 * (len(ordered) - 1))]
+    print(f"{label:<16}{statistics.mean(timings):>10.1f}{statistics.median(timings):>10.1f}{p99:>10.1f}")
+    return statistics.mean(timings)
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    # Like a container's stdout: a pipe drained by another process
+    sink = subprocess.Popen(['cat'], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+    out = sink.stdin
+    logging.disable(logging.CRITICAL)
+    measure(lambda: old_request(out), 200)  # warm up the regex cache
+    logging.disable(logging.NOTSET)
+
+    print(f'{requests} OCR requests')
+    print(f"{'path':<16}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}")
+    logging.disable(logging.CRITICAL)
+    before = report('before: print()', measure(lambda: old_request(out), requests))
+    logging.disable(logging.NOTSET)
+
+    results = {}
+    for level in ('INFO', 'DEBUG'):
+        app_logging.shutdown_logging()
+        app_logging.setup_logging(level, stream=out)
+        results[level] = report(f'after: {level}', measure(new_request, requests))
+    app_logging.shutdown_logging()
+    out.close()
+    sink.wait()
+
+    print(f"saved per request: {before - results['INFO']:.1f} us with debug off, "
+          f"{before - results['DEBUG']:.1f} us with debug on")
+
+
+if __name__ == '__main__':
+    main()
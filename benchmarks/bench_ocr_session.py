@@ -0,0 +1,117 @@
+# bench_ocr_session.py - Per-upload latency: fresh TLS connection vs pooled session
+#
+# Usage: python benchmarks/bench_ocr_session.py [uploads] [image_kb]
+#
+# Starts a local HTTPS stub of the OCR.space endpoint (self-signed cert made
+# with the openssl CLI) and uploads the same image repeatedly:
+#   before - the old path: save to disk, reopen, bare requests.post()
+#   after  - OCRClient with a keep-alive session and in-memory bytes
+# The stub answers instantly, so the difference is connection setup plus
+# the disk round trip.
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ocr_client  # noqa: E402
+
+RESPONSE = json.dumps({
+    'IsErroredOnProcessing': False,
+    'ParsedResults': [{'ParsedText': 'SUBTOTAL 100.00\nTAX 8.00\nTOTAL 108.00'}],
+}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+
+def start_tls_stub(workdir):
+    cert = os.path.join(workdir, 'cert.pem')
+    key = os.path.join(workdir, 'key.pem')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+        '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1',
+        '-keyout', key, '-out', cert,
+    ], check=True, capture_output=True)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'https://127.0.0.1:{server.server_port}/parse/image', cert
+
+
+def old_path(url, cert, workdir, image):
+    """Baseline: write upload to disk, reopen it, new connection per call"""
+    path = os.path.join(workdir, 'upload.png')
+    with open(path, 'wb') as f:
+        f.write(image)
+    with open(path, 'rb') as f:
+        r = requests.post(url, files={path: f}, data={'apikey': 'helloworld', 'language': 'eng'}, verify=cert)
+    return r.json()
+
+
+def measure(fn, uploads):
+    timings = []
+    for _ in range(uploads):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    ordered = sorted(timings)
+    p95 = ordered[int(0.95 * (len(ordered) - 1))]
+    print(f"{label:<28}{statistics.mean(timings):>10.2f}{statistics.median(timings):>10.2f}{p95:>10.2f}")
+    return statistics.mean(timings)
+
+
+def main():
+    uploads = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    image_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+    image = os.urandom(image_kb * 1024)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server, url, cert = start_tls_stub(workdir)
+        session = ocr_client.pooled_session(verify=cert)
+        session.trust_env = False  # don't let REQUESTS_CA_BUNDLE override the stub's cert
+        client = ocr_client.OCRClient(url=url, session=session)
+
+        # Warm up both paths once (imports, first handshake)
+        old_path(url, cert, workdir, image)
+        client.parse(image, filename='upload.png')
+
+        print(f'{uploads} uploads of {image_kb} KB against a local TLS stub')
+        print(f"{'path':<28}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        before = report('before: disk + new TLS', measure(lambda: old_path(url, cert, workdir, image), uploads))
+        after = report('after: pooled + in-memory',
+                       measure(lambda: client.parse(image, filename='upload.png'), uploads))
+        print(f'saved per upload: {before - after:.2f} ms ({100 * (before - after) / before:.0f}%)')
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
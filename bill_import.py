@@ -0,0 +1,398 @@
+# bill_import.py - Streaming CSV import of bills and shares
+#
+# Accepts the same layouts our CSV downloads produce:
+#   bills        - "All bills" / "Date range" exports (header row "Bill ID, ...")
+#   bill_share   - the share CSV from share_bill ("Bill Sharing Details")
+#   friend_bills - a friend's statement ("Friend Bills Report"); its rows
+#                  are attached to existing bills matched by date+restaurant
+#
+# The file is read row by row with csv.reader and valid rows are inserted
+# in BATCH_SIZE transactions, so memory is bounded by one batch plus the
+# user's friend list. With dry_run=True nothing is written and the result
+# only reports what would be imported and which rows are invalid. Shares
+# are upserted (see share_writes.py), so importing the same statement again
+# leaves the shares it already added as they are.
+import csv
+import io
+import re
+from collections import OrderedDict, defaultdict, namedtuple
+from datetime import datetime
+
+import fx
+import rollups
+import share_status
+import share_writes
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 200
+BILL_CACHE_SIZE = 10000
+TOTAL_TOLERANCE = 0.05
+
+BILLS_HEADER = 'Bill ID'
+BILL_SHARE_TITLE = 'Bill Sharing Details'
+FRIEND_BILLS_TITLE = 'Friend Bills Report'
+SHARES_HEADER = 'Friend Name'
+FRIEND_SHARES_HEADER = 'Visit Date'
+
+
+# Plain values rather than ORM objects, so they survive the per-batch
+# commit/expunge without reloading
+MatchedFriend = namedtuple('MatchedFriend', 'id name')
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def parse_amount(value, field):
+    cleaned = re.sub(r'[^\d.\-]', '', value or '')
+    if cleaned in ('', '-', '.'):
+        return 0.0
+    try:
+        amount = float(cleaned)
+    except ValueError:
+        raise ImportRowError(f'{field}: "{value}" is not a number')
+    if amount < 0:
+        raise ImportRowError(f'{field} cannot be negative')
+    return amount
+
+
+def parse_date(value, field='Visit Date'):
+    try:
+        return datetime.strptime((value or '').strip(), '%Y-%m-%d').date()
+    except ValueError:
+        raise ImportRowError(f'{field}: "{value}" is not a YYYY-MM-DD date')
+
+
+def phone_digits(value):
+    return re.sub(r'\D', '', value or '')
+
+
+class FriendMatcher:
+    """Match share rows to the user's friends by WhatsApp number, then name"""
+
+    def __init__(self, user_id):
+        from app import Friend
+
+        self.by_phone = {}
+        self.by_name = {}
+        rows = Friend.query.with_entities(
+            Friend.id, Friend.name, Friend.country_code, Friend.whatsapp_number
+        ).filter_by(user_id=user_id)
+        for friend_id, name, country_code, whatsapp_number in rows:
+            friend = MatchedFriend(friend_id, name)
+            number = phone_digits(whatsapp_number)
+            self.by_phone.setdefault(number, friend)
+            self.by_phone.setdefault(phone_digits(country_code) + number, friend)
+            self.by_name.setdefault(name.strip().lower(), friend)
+
+    def match(self, name, whatsapp=''):
+        digits = phone_digits(whatsapp)
+        if digits and digits in self.by_phone:
+            return self.by_phone[digits]
+        friend = self.by_name.get((name or '').strip().lower())
+        if friend is None:
+            raise ImportRowError(f'No friend matches "{name}" {whatsapp}'.strip())
+        return friend
+
+
+class BillMatcher:
+    """Find existing bills by (visit date, restaurant) with a bounded LRU cache"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.cache = OrderedDict()
+
+    def match(self, visit_date, restaurant_name):
+        from app import db, Bill
+
+        key = (visit_date, rollups.restaurant_key(restaurant_name))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        bill_id = Bill.query.with_entities(Bill.id).filter(
+            Bill.user_id == self.user_id,
+            Bill.visit_date == visit_date,
+            db.func.lower(Bill.restaurant_name) == restaurant_name.strip().lower(),
+        ).order_by(Bill.id).limit(1).scalar()
+        if bill_id is None:
+            raise ImportRowError(f'No bill at "{restaurant_name}" on {visit_date}')
+
+        self.cache[key] = bill_id
+        if len(self.cache) > BILL_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return self.cache[key]
+
+
+class ImportResult:
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.layout = None
+        self.rows_read = 0
+        self.bills_created = 0
+        self.shares_created = 0
+        self.shares_updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def to_dict(self):
+        return {
+            'layout': self.layout,
+            'dry_run': self.dry_run,
+            'rows_read': self.rows_read,
+            'bills_created': self.bills_created,
+            'shares_created': self.shares_created,
+            'shares_updated': self.shares_updated,
+            'error_count': self.error_count,
+            'errors': [{'line': line, 'message': message} for line, message in self.errors],
+        }
+
+
+def _columns(header):
+    return {name.strip(): index for index, name in enumerate(header)}
+
+
+def _cell(row, columns, name):
+    index = columns.get(name)
+    if index is None or index >= len(row):
+        return ''
+    return row[index].strip()
+
+
+def _is_skippable(row):
+    return not any(cell.strip() for cell in row) or row[0].strip().upper() in ('TOTAL', 'TOTALS')
+
+
+def _bill_from_row(user_id, row, columns):
+    restaurant_name = _cell(row, columns, 'Restaurant Name')
+    if not restaurant_name:
+        raise ImportRowError('Restaurant name is required')
+    base_amount = parse_amount(_cell(row, columns, 'Base Amount'), 'Base Amount')
+    discount_amount = parse_amount(_cell(row, columns, 'Discount'), 'Discount')
+    service_charge = parse_amount(_cell(row, columns, 'Service Charge'), 'Service Charge')
+    tax_amount = parse_amount(_cell(row, columns, 'Tax'), 'Tax')
+    return _build_bill(user_id, restaurant_name, parse_date(_cell(row, columns, 'Visit Date')),
+                       base_amount, discount_amount, service_charge, tax_amount,
+                       _cell(row, columns, 'Total Amount'), _cell(row, columns, 'Currency'))
+
+
+def parse_currency(value):
+    """Currency code of an exported bill; files from before currencies are in the default"""
+    from app import app
+
+    if not value:
+        return app.config['DEFAULT_CURRENCY']
+    currency = fx.normalize(value)
+    if currency is None:
+        raise ImportRowError(f'Currency: "{value}" has no exchange rate')
+    return currency
+
+
+def _build_bill(user_id, restaurant_name, visit_date, base_amount, discount_amount,
+                service_charge, tax_amount, total_value, currency_value=''):
+    from app import Bill
+
+    currency = parse_currency(currency_value)
+    if base_amount <= 0:
+        raise ImportRowError('Base amount must be greater than 0')
+    calculated_total = base_amount - discount_amount + service_charge + tax_amount
+    total_amount = parse_amount(total_value, 'Total Amount') if total_value else calculated_total
+    if abs(total_amount - calculated_total) > TOTAL_TOLERANCE:
+        raise ImportRowError(f'Total {total_amount:.2f} does not match base - discount + service + tax '
+                             f'({calculated_total:.2f})')
+    return Bill(
+        user_id=user_id,
+        restaurant_name=restaurant_name,
+        visit_date=visit_date,
+        base_amount=base_amount,
+        discount_amount=discount_amount,
+        service_charge=service_charge,
+        tax_amount=tax_amount,
+        total_amount=total_amount,
+        currency=currency,
+    )
+
+
+def _share_amounts(row, columns, service_column):
+    food_amount = parse_amount(_cell(row, columns, 'Food Amount'), 'Food Amount')
+    tax_share = parse_amount(_cell(row, columns, 'Tax Share'), 'Tax Share')
+    service_share = parse_amount(_cell(row, columns, service_column), service_column)
+    total_value = _cell(row, columns, 'Total Share')
+    total_share = parse_amount(total_value, 'Total Share') if total_value else food_amount + tax_share + service_share
+    food_item = _cell(row, columns, 'Food Item')
+    if not food_item:
+        raise ImportRowError('Food item is required')
+    return food_item, food_amount, tax_share, service_share, total_share
+
+
+class _Writer:
+    """Buffers new rows and writes them in BATCH_SIZE transactions"""
+
+    def __init__(self, result):
+        self.result = result
+        self.pending = []
+        self.shares = []
+
+    def add_bill(self, bill, shares=()):
+        self.pending.append((bill, list(shares)))
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+
+    def add_share(self, row, friend_name, bill_ref):
+        self.shares.append((row, friend_name, bill_ref))
+        if len(self.shares) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        from app import db, Bill
+
+        if self.result.dry_run:
+            self.result.bills_created += len(self.pending)
+            self.result.shares_created += sum(len(shares) for _, shares in self.pending) + len(self.shares)
+            self.pending, self.shares = [], []
+            return
+        if not self.pending and not self.shares:
+            return
+
+        batch = rollups.RollupBatch()
+        deltas = {}
+        try:
+            for bill, _ in self.pending:
+                share_status.initial(bill)
+            db.session.add_all(bill for bill, _ in self.pending)
+            db.session.flush()
+            for bill, shares in self.pending:
+                batch.add_bill(bill)
+                self._upsert(bill, shares, batch, deltas)
+
+            by_bill = defaultdict(list)
+            for row, friend_name, bill_ref in self.shares:
+                by_bill[bill_ref].append((row, friend_name))
+            for bill_ref, shares in by_bill.items():
+                self._upsert(db.session.get(Bill, bill_ref), shares, batch, deltas)
+            self.result.bills_created += len(self.pending)
+
+            batch.flush()
+            share_status.apply(deltas)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            self.pending, self.shares = [], []
+        # Keep the identity map from growing across batches
+        db.session.expunge_all()
+
+    def _upsert(self, bill, shares, batch, deltas):
+        inserted, updated = share_writes.upsert(
+            bill, [row for row, _ in shares], {row['friend_id']: name for row, name in shares}, batch, deltas)
+        self.result.shares_created += inserted
+        self.result.shares_updated += updated
+
+
+def import_csv(user_id, stream, dry_run=False):
+    """Import one CSV export from a binary or text stream"""
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(stream)
+    result = ImportResult(dry_run)
+    writer = _Writer(result)
+
+    layout = None
+    meta = {}
+    columns = None
+    friend_matcher = None
+    bill_matcher = None
+    bill_share_bill = None
+    bill_share_rows = []
+    statement_friend = None
+
+    for row in reader:
+        line = reader.line_num
+        first = row[0].strip() if row else ''
+
+        if columns is None:
+            # Preamble: detect the layout and collect "Key:" metadata rows
+            if first == BILLS_HEADER:
+                layout, columns = 'bills', _columns(row)
+            elif first == BILL_SHARE_TITLE:
+                layout = 'bill_share'
+            elif first == FRIEND_BILLS_TITLE:
+                layout = 'friend_bills'
+            elif layout == 'bill_share' and first == SHARES_HEADER:
+                columns = _columns(row)
+                friend_matcher = FriendMatcher(user_id)
+                try:
+                    bill_share_bill = _build_bill(
+                        user_id, meta.get('Restaurant', ''), parse_date(meta.get('Visit Date')),
+                        parse_amount(meta.get('Base Amount'), 'Base Amount'),
+                        parse_amount(meta.get('Discount Amount'), 'Discount Amount'),
+                        parse_amount(meta.get('Service Charge'), 'Service Charge'),
+                        parse_amount(meta.get('Tax Amount'), 'Tax Amount'),
+                        meta.get('Total Amount', ''), meta.get('Currency', ''))
+                    if not bill_share_bill.restaurant_name:
+                        raise ImportRowError('Restaurant name is required')
+                except ImportRowError as e:
+                    result.error(line, f'Bill header: {e}')
+                    break
+            elif layout == 'friend_bills' and first == FRIEND_SHARES_HEADER:
+                columns = _columns(row)
+                bill_matcher = BillMatcher(user_id)
+                try:
+                    statement_friend = FriendMatcher(user_id).match(meta.get('Friend', ''), meta.get('WhatsApp', ''))
+                except ImportRowError as e:
+                    result.error(line, f'Statement header: {e}')
+                    break
+            elif first.endswith(':') and len(row) > 1:
+                meta[first[:-1]] = row[1].strip()
+            continue
+
+        if _is_skippable(row):
+            continue
+        result.rows_read += 1
+
+        try:
+            if layout == 'bills':
+                writer.add_bill(_bill_from_row(user_id, row, columns))
+            elif layout == 'bill_share':
+                friend = friend_matcher.match(_cell(row, columns, 'Friend Name'),
+                                              _cell(row, columns, 'WhatsApp Number'))
+                bill_share_rows.append((friend, _share_amounts(row, columns, 'Service Charge Share')))
+            else:
+                visit_date = parse_date(_cell(row, columns, 'Visit Date'))
+                restaurant_name = _cell(row, columns, 'Restaurant')
+                bill_id = bill_matcher.match(visit_date, restaurant_name)
+                writer.add_share(_share_row(statement_friend, _share_amounts(row, columns, 'Service Charge')),
+                                 statement_friend.name, bill_id)
+        except ImportRowError as e:
+            result.error(line, str(e))
+
+    if layout is None or (columns is None and not result.error_count):
+        result.error(0, 'Unrecognised file: expected a BillShare bills, bill share or friend bills CSV')
+
+    if bill_share_bill is not None and (bill_share_rows or not result.error_count):
+        writer.add_bill(bill_share_bill, [(_share_row(friend, amounts), friend.name)
+                                          for friend, amounts in bill_share_rows])
+
+    writer.flush()
+    result.layout = layout
+    return result
+
+
+def _share_row(friend, amounts):
+    """A share as share_writes.upsert() takes it"""
+    food_item, food_amount, tax_share, service_share, total_share = amounts
+    return {
+        'friend_id': friend.id,
+        'food_item': food_item,
+        'food_amount': food_amount,
+        'tax_share': tax_share,
+        'service_charge_share': service_share,
+        'total_share': total_share,
+    }
@@ -6,4 +6,7 @@ pip install -r requirements.txt
 echo "Creating necessary directories..."
 mkdir -p static/css static/js static/images templates uploads
 
+echo "Fingerprinting and compressing static assets..."
+flask --app app build-assets
+
 echo "Build completed successfully!"
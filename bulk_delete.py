@@ -0,0 +1,167 @@
+# bulk_delete.py - Set-based deletion of bills and friends, with background purge
+#
+# Bills are deleted by id list or visit-date range, friends by id list, each
+# with one DELETE statement. Their shares go with them through ON DELETE
+# CASCADE on bill_share.bill_id / friend_id (on SQLite, install() turns on
+# foreign key enforcement for every connection). Rollups, split totals and
+# the sync change log are updated with the same grouped, set-based
+# statements before the rows go.
+#
+# A bill delete matching more than BULK_DELETE_SYNC_LIMIT bills only sets
+# Bill.deleted_at, which is one indexed UPDATE, and leaves the rest to
+# purge_deleted() in a background thread. The purge removes the rows
+# PURGE_CHUNK_SIZE bills per transaction with a pause in between, so no
+# single statement holds the tables for long. `flask purge-deleted-bills`
+# finishes anything a restart interrupted.
+#
+# Until they are purged, soft-deleted bills and their shares are hidden from
+# every ORM select by a do_orm_execute hook on all sessions (the async ones
+# in asgi.py included). Statements that need them pass the execution option
+# include_deleted=True; Core statements on the tables are not filtered.
+#
+# Archived bills (see archive.py) are not touched: a date range reaching
+# past the archive cutoff deletes only the bills still in the live tables.
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, with_loader_criteria
+
+import archive
+import rollups
+import share_status
+import sync
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='purge')
+    return _executor
+
+
+def _hide_deleted(execute_state):
+    from app import Bill, BillShare
+
+    if not execute_state.is_select or execute_state.execution_options.get('include_deleted', False):
+        return
+    deleted = select(Bill.__table__.c.id).where(Bill.__table__.c.deleted_at.is_not(None))
+    execute_state.statement = execute_state.statement.options(
+        with_loader_criteria(Bill, Bill.deleted_at.is_(None), include_aliases=True),
+        with_loader_criteria(BillShare, lambda cls: cls.bill_id.not_in(deleted),
+                             include_aliases=True, track_closure_variables=False),
+    )
+
+
+def _enforce_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+def install(app, db):
+    """Hide soft-deleted bills from ORM selects; enforce SQLite foreign keys (idempotent)"""
+    if not event.contains(Session, 'do_orm_execute', _hide_deleted):
+        event.listen(Session, 'do_orm_execute', _hide_deleted)
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite' and not event.contains(engine, 'connect', _enforce_foreign_keys):
+                event.listen(engine, 'connect', _enforce_foreign_keys)
+
+
+def bill_condition(user_id, ids=None, start_date=None, end_date=None):
+    """The user's live bills with one of ids, or visited within [start_date, end_date]"""
+    from app import db, Bill
+
+    criteria = [Bill.user_id == user_id, Bill.deleted_at.is_(None)]
+    if ids is not None:
+        criteria.append(Bill.id.in_(ids))
+    if start_date is not None:
+        criteria.append(Bill.visit_date >= start_date)
+    if end_date is not None:
+        criteria.append(Bill.visit_date <= end_date)
+    return db.and_(*criteria)
+
+
+def delete_bills(user_id, ids=None, start_date=None, end_date=None):
+    """Delete the user's bills by ids or visit-date range; returns (bills deleted, purge queued)
+
+    Commits. Over BULK_DELETE_SYNC_LIMIT bills are soft-deleted now and
+    purged in the background.
+    """
+    from app import app, db, Bill, BillShare
+
+    if ids is None and start_date is None and end_date is None:
+        raise ValueError('Choose bills or a date range to delete')
+    condition = bill_condition(user_id, ids, start_date, end_date)
+    count = Bill.query.filter(condition).count()
+    if not count:
+        return 0, False
+
+    rollups.remove_bills(condition)
+    sync.log_where(BillShare, condition, sync.DELETE)
+    sync.log_where(Bill, condition, sync.DELETE)
+
+    deferred = count > app.config['BULK_DELETE_SYNC_LIMIT']
+    if deferred:
+        Bill.query.filter(condition).update({Bill.deleted_at: datetime.utcnow()}, synchronize_session=False)
+    else:
+        Bill.query.filter(condition).delete(synchronize_session=False)
+    db.session.commit()
+    if deferred:
+        _get_executor().submit(_purge_job)
+    return count, deferred
+
+
+def delete_friends(user_id, ids):
+    """Delete the user's friends and every share they have; returns friends deleted (commits)"""
+    from app import db, BillShare, Friend
+
+    friends = Friend.query.filter(Friend.user_id == user_id, Friend.id.in_(ids)).all()
+    if not friends:
+        return 0
+    friend_ids = [friend.id for friend in friends]
+
+    rollups.remove_friend_shares(friends)
+    share_status.remove_friends(friend_ids)
+    archive.delete_friend_shares(friend_ids)
+    sync.log_where(BillShare, BillShare.friend_id.in_(friend_ids), sync.DELETE)
+    sync.log_where(Friend, Friend.id.in_(friend_ids), sync.DELETE)
+    Friend.query.filter(Friend.id.in_(friend_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    return len(friends)
+
+
+def purge_deleted(chunk_size=None, pause=None):
+    """Remove soft-deleted bills for good, chunk_size per transaction; returns bills purged"""
+    from app import app, db, Bill
+
+    chunk_size = chunk_size or app.config['PURGE_CHUNK_SIZE']
+    pause = app.config['PURGE_PAUSE'] if pause is None else pause
+    table = Bill.__table__
+    purged = 0
+    while True:
+        ids = db.session.execute(
+            select(table.c.id).where(table.c.deleted_at.is_not(None)).limit(chunk_size)).scalars().all()
+        if not ids:
+            return purged
+        # Their shares go by ON DELETE CASCADE
+        db.session.execute(table.delete().where(table.c.id.in_(ids)))
+        db.session.commit()
+        purged += len(ids)
+        time.sleep(pause)
+
+
+def _purge_job():
+    from app import app, db, log
+
+    with app.app_context():
+        try:
+            purged = purge_deleted()
+            log.info('Purged deleted bills', extra={'bills': purged})
+        except Exception:
+            db.session.rollback()
+            log.exception('Purging deleted bills failed; `flask purge-deleted-bills` will finish it')
@@ -0,0 +1,134 @@
+# columnar_export.py - Parquet / Arrow IPC export of bills and shares
+#
+# Unlike the CSV downloads, amounts are written as float64 and dates as
+# date32/timestamp columns, so analytics tools can load the files without
+# re-parsing "$12.34" strings. Amounts stay in each bill's currency, which
+# is a column of its own. Rows are pulled from the database in
+# BATCH_SIZE chunks and written as one record batch each, so memory stays
+# bounded by the batch size rather than the table size.
+import tempfile
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, see requirements.txt
+    pa = None
+    pq = None
+
+BATCH_SIZE = 10000
+FORMATS = {
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrow', 'application/vnd.apache.arrow.file'),
+}
+DATASETS = ('bills', 'shares')
+
+
+def available():
+    return pa is not None
+
+
+def bill_schema():
+    return pa.schema([
+        ('bill_id', pa.int64()),
+        ('restaurant_name', pa.string()),
+        ('visit_date', pa.date32()),
+        ('base_amount', pa.float64()),
+        ('discount_amount', pa.float64()),
+        ('service_charge', pa.float64()),
+        ('tax_amount', pa.float64()),
+        ('total_amount', pa.float64()),
+        ('currency', pa.string()),
+        ('created_at', pa.timestamp('us')),
+    ])
+
+
+def share_schema():
+    return pa.schema([
+        ('share_id', pa.int64()),
+        ('bill_id', pa.int64()),
+        ('visit_date', pa.date32()),
+        ('restaurant_name', pa.string()),
+        ('friend_id', pa.int64()),
+        ('friend_name', pa.string()),
+        ('whatsapp_number', pa.string()),
+        ('food_item', pa.string()),
+        ('food_amount', pa.float64()),
+        ('tax_share', pa.float64()),
+        ('service_charge_share', pa.float64()),
+        ('total_share', pa.float64()),
+        ('currency', pa.string()),
+        ('shared_at', pa.timestamp('us')),
+    ])
+
+
+def _bill_select(user_id):
+    from app import db, Bill
+
+    return db.select(
+        Bill.id, Bill.restaurant_name, Bill.visit_date, Bill.base_amount,
+        Bill.discount_amount, Bill.service_charge, Bill.tax_amount,
+        Bill.total_amount, Bill.currency, Bill.created_at,
+    ).where(Bill.user_id == user_id).order_by(Bill.visit_date.desc(), Bill.id.desc())
+
+
+def _share_select(user_id):
+    from app import db, Bill, BillShare, Friend
+
+    return db.select(
+        BillShare.id, BillShare.bill_id, Bill.visit_date, Bill.restaurant_name,
+        BillShare.friend_id, Friend.name, Friend.whatsapp_number, BillShare.food_item,
+        BillShare.food_amount, BillShare.tax_share, BillShare.service_charge_share,
+        BillShare.total_share, Bill.currency, BillShare.shared_at,
+    ).join(Bill, Bill.id == BillShare.bill_id).join(
+        Friend, Friend.id == BillShare.friend_id
+    ).where(Bill.user_id == user_id).order_by(Bill.visit_date.desc(), BillShare.id)
+
+
+def record_batches(dataset, user_id, batch_size=BATCH_SIZE):
+    """Yield (schema, RecordBatch) pairs streamed from the database"""
+    from app import db
+
+    if dataset == 'bills':
+        schema, stmt = bill_schema(), _bill_select(user_id)
+    elif dataset == 'shares':
+        schema, stmt = share_schema(), _share_select(user_id)
+    else:
+        raise ValueError(f'Unknown dataset: {dataset}')
+
+    result = db.session.execute(stmt.execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        columns = list(zip(*rows))
+        arrays = [pa.array(values, type=field.type) for values, field in zip(columns, schema)]
+        yield schema, pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_export(dataset, fmt, user_id, sink, batch_size=BATCH_SIZE):
+    """Write one dataset to a binary file object as Parquet or Arrow IPC"""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format: {fmt}')
+
+    schema = bill_schema() if dataset == 'bills' else share_schema()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+
+    rows = 0
+    try:
+        for _, batch in record_batches(dataset, user_id, batch_size):
+            if fmt == 'parquet':
+                writer.write_batch(batch)
+            else:
+                writer.write(batch)
+            rows += batch.num_rows
+    finally:
+        writer.close()
+    return rows
+
+
+def export_file(dataset, fmt, user_id):
+    """Export into a temp file (on disk past 8 MB) positioned at the start"""
+    sink = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    write_export(dataset, fmt, user_id, sink)
+    sink.seek(0)
+    return sink
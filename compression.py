@@ -0,0 +1,230 @@
+# compression.py - Fingerprinted, precompressed static assets and gzip responses
+#
+# Static assets: `flask build-assets` copies every file under static/ to
+# ASSET_FOLDER under a name carrying a hash of its content
+# (css/style.css -> css/style.3f2a9c1b7d04.css), writes a .gz and, when the
+# optional brotli package is installed, a .br next to each text file, and
+# records the names in manifest.json. Templates link assets with
+# {{ asset_url('css/style.css') }}, which gives the fingerprinted /assets/
+# URL once built and the plain /static/ one before. A fingerprinted URL never
+# changes content, so /assets/ serves it with a one-year immutable
+# Cache-Control, choosing the .br or .gz copy the browser accepts.
+#
+# Responses: install() adds an after_request hook that gzips HTML, JSON, CSV
+# and other text bodies for clients sending Accept-Encoding: gzip. Bodies
+# already in memory are compressed at once (if over COMPRESS_MIN_SIZE);
+# send_file and streamed bodies, such as the CSV downloads, are compressed
+# chunk by chunk as they go out. Views that must keep byte ranges of the
+# original file, like resumable export downloads, are marked @exempt.
+#
+# Bytes before and after compression are counted per content type in each
+# worker; report() returns them for /admin/compression.
+import functools
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import threading
+import zlib
+
+from flask import abort, current_app, g, request, send_file, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional dependency, see requirements.txt
+    brotli = None
+
+ASSET_MAX_AGE = 365 * 24 * 3600
+PRECOMPRESS_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.csv'}
+COMPRESSIBLE_TYPES = {'text/html', 'text/css', 'text/csv', 'text/plain', 'text/javascript',
+                      'application/javascript', 'application/json', 'image/svg+xml'}
+MANIFEST = 'manifest.json'
+
+_lock = threading.Lock()
+_totals = {}  # mimetype: {'responses', 'bytes_in', 'bytes_out'}
+_manifest = None
+
+
+def asset_folder(app):
+    return os.path.join(app.root_path, app.config['ASSET_FOLDER'])
+
+
+def fingerprinted(path, content):
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.{hashlib.sha256(content).hexdigest()[:12]}{ext}'
+
+
+def build(app):
+    """Fingerprint and precompress everything under static/; returns the manifest"""
+    global _manifest
+    out = asset_folder(app)
+    shutil.rmtree(out, ignore_errors=True)
+    manifest = {}
+    for root, _, files in os.walk(app.static_folder):
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, app.static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                content = f.read()
+            target = fingerprinted(logical, content)
+            path = os.path.join(out, target)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+            entry = {'path': target, 'bytes': len(content)}
+            if os.path.splitext(name)[1].lower() in PRECOMPRESS_EXTENSIONS:
+                variants = {'gz': gzip.compress(content, 9, mtime=0)}
+                if brotli is not None:
+                    variants['br'] = brotli.compress(content, quality=11)
+                for suffix, compressed in variants.items():
+                    # Not worth a variant (or an extra stat) unless it is smaller
+                    if len(compressed) < len(content):
+                        with open(f'{path}.{suffix}', 'wb') as f:
+                            f.write(compressed)
+                        entry[suffix] = len(compressed)
+            manifest[logical] = entry
+    os.makedirs(out, exist_ok=True)
+    with open(os.path.join(out, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    with _lock:
+        _manifest = manifest
+    return manifest
+
+
+def manifest():
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(os.path.join(asset_folder(current_app), MANIFEST)) as f:
+                loaded = json.load(f)
+        except (OSError, ValueError):
+            loaded = {}
+        with _lock:
+            _manifest = loaded
+    return _manifest
+
+
+def asset_url(filename):
+    """URL of a static file: fingerprinted under /assets/ once built, else /static/"""
+    entry = manifest().get(filename)
+    if entry is None:
+        return url_for('static', filename=filename)
+    return url_for('asset', filename=entry['path'])
+
+
+def send_asset(filename):
+    """A fingerprinted asset, precompressed if the client accepts it, cached for a year"""
+    path = safe_join(asset_folder(current_app), filename)
+    if path is None or filename == MANIFEST or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for suffix, name in (('br', 'br'), ('gz', 'gzip')):
+        if request.accept_encodings[name] and os.path.isfile(f'{path}.{suffix}'):
+            path, encoding = f'{path}.{suffix}', name
+            break
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def exempt(view):
+    """Leave this view's responses uncompressed (e.g. to keep Range requests on the file)"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.compression_exempt = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _record(mimetype, bytes_in, bytes_out):
+    with _lock:
+        totals = _totals.setdefault(mimetype, {'responses': 0, 'bytes_in': 0, 'bytes_out': 0})
+        totals['responses'] += 1
+        totals['bytes_in'] += bytes_in
+        totals['bytes_out'] += bytes_out
+
+
+def _gzip_stream(chunks, mimetype, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    bytes_in = bytes_out = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        bytes_in += len(chunk)
+        compressed = compressor.compress(chunk)
+        if compressed:
+            bytes_out += len(compressed)
+            yield compressed
+    tail = compressor.flush()
+    bytes_out += len(tail)
+    yield tail
+    _record(mimetype, bytes_in, bytes_out)
+
+
+def compress(response):
+    """after_request hook: gzip text responses for clients that accept it"""
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+            or g.get('compression_exempt') or request.method == 'HEAD'
+            or not request.accept_encodings['gzip']):
+        return response
+
+    level = current_app.config['COMPRESS_LEVEL']
+    if response.is_streamed or response.direct_passthrough:
+        # send_file and generator bodies: compress as they are sent
+        chunks = response.response
+        if hasattr(chunks, 'close'):
+            response.call_on_close(chunks.close)
+        response.response = _gzip_stream(chunks, response.mimetype, level)
+        response.direct_passthrough = False
+        response.headers.pop('Content-Length', None)
+        # Byte ranges of the original no longer apply
+        response.headers.pop('Accept-Ranges', None)
+    else:
+        body = response.get_data()
+        if len(body) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        compressed = gzip.compress(body, level)
+        if len(compressed) >= len(body):
+            return response
+        response.set_data(compressed)
+        _record(response.mimetype, len(body), len(compressed))
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-gzip', weak)
+    return response
+
+
+def install(app):
+    """Compress responses and provide asset_url() to templates (idempotent)"""
+    if compress not in app.after_request_funcs.setdefault(None, []):
+        app.after_request(compress)
+    app.add_template_global(asset_url, 'asset_url')
+
+
+def report():
+    """Bytes before and after compression per content type, with totals, since start or reset()"""
+    with _lock:
+        rows = [dict(totals, mimetype=mimetype) for mimetype, totals in sorted(_totals.items())]
+    total = {'mimetype': 'all', 'responses': sum(row['responses'] for row in rows),
+             'bytes_in': sum(row['bytes_in'] for row in rows),
+             'bytes_out': sum(row['bytes_out'] for row in rows)}
+    for row in rows + [total]:
+        row['saved'] = 1 - row['bytes_out'] / row['bytes_in'] if row['bytes_in'] else 0.0
+    return {'types': rows, 'total': total}
+
+
+def reset():
+    with _lock:
+        _totals.clear()
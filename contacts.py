@@ -0,0 +1,353 @@
+# contacts.py - Friend phone normalisation, duplicate merge and bulk import
+#
+# Every friend carries phone_e164 ("+919876543210"), derived from the loose
+# country_code / whatsapp_number pair. (user_id, phone_e164) has a unique
+# index, so the same person cannot be added twice. Rows that existed before
+# the column did are backfilled at startup. A row whose number another
+# friend already holds keeps a NULL phone_e164 and shows up as a duplicate
+# until it is merged. Merging moves the duplicate's BillShare rows to the
+# kept friend with one UPDATE (archived shares too) and moves its rollup
+# totals with them. A share of an item the kept friend also has on that
+# bill is summed into the kept friend's row instead.
+#
+# Contacts can be imported in bulk from a CSV or a vCard (.vcf) file. The
+# user's existing numbers are loaded once, and new rows are inserted in
+# chunks, so a file of thousands of contacts is one request. A number added
+# by another request meanwhile is skipped (ON CONFLICT DO NOTHING), not an
+# error.
+import csv
+import io
+import re
+from collections import defaultdict, namedtuple
+
+from sqlalchemy import exists, select, tuple_
+from sqlalchemy.orm import aliased
+
+import sync
+
+INSERT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 200
+DEFAULT_COUNTRY_CODE = '+91'
+AVATAR = 'avatar1.png'
+
+# Header names accepted for each field in a contacts CSV (lower case)
+NAME_HEADERS = ('name', 'friend name', 'full name', 'display name', 'given name')
+PHONE_HEADERS = ('whatsapp number', 'whatsapp', 'phone', 'mobile', 'phone number',
+                 'mobile phone', 'phone 1 - value')
+COUNTRY_HEADERS = ('country code',)
+
+DuplicateGroup = namedtuple('DuplicateGroup', 'reason key friends')
+
+
+class PhoneNumberError(ValueError):
+    pass
+
+
+def normalize_e164(country_code, number, default_country_code=DEFAULT_COUNTRY_CODE):
+    """'+91', '98765 43210' -> '+919876543210'
+
+    A number written with a leading '+' or '00' is taken as already
+    international. Otherwise a single trunk '0' is dropped and the country
+    code is prefixed.
+    """
+    raw = (number or '').strip()
+    digits = re.sub(r'\D', '', raw)
+    if raw.startswith('+'):
+        full = digits
+    elif digits.startswith('00'):
+        full = digits[2:]
+    else:
+        code = re.sub(r'\D', '', country_code or default_country_code or '')
+        if not code:
+            raise PhoneNumberError('A country code is required')
+        full = code + (digits[1:] if digits.startswith('0') else digits)
+    if not 8 <= len(full) <= 15 or full.startswith('0'):
+        raise PhoneNumberError(f'"{number}" is not a valid international phone number')
+    return '+' + full
+
+
+def split_e164(phone, country_code):
+    """(country_code, whatsapp_number) for the legacy columns
+
+    Numbers from another country keep their full international form in
+    whatsapp_number with an empty country code.
+    """
+    code = re.sub(r'\D', '', country_code or '')
+    digits = phone.lstrip('+')
+    if code and digits.startswith(code):
+        return '+' + code, digits[len(code):]
+    return '', phone
+
+
+def _name_key(name):
+    return ' '.join((name or '').lower().split())
+
+
+def backfill_phones():
+    """Fill phone_e164 for friends created before the column existed"""
+    from sqlalchemy import bindparam
+    from app import db, Friend
+
+    rows = db.session.query(
+        Friend.id, Friend.user_id, Friend.country_code, Friend.whatsapp_number
+    ).filter(Friend.phone_e164.is_(None)).all()
+    if not rows:
+        return 0
+
+    taken = {
+        (user_id, phone)
+        for user_id, phone in db.session.query(Friend.user_id, Friend.phone_e164)
+        .filter(Friend.phone_e164.isnot(None))
+    }
+    updates = []
+    for friend_id, user_id, country_code, whatsapp_number in sorted(rows):
+        try:
+            phone = normalize_e164(country_code, whatsapp_number)
+        except PhoneNumberError:
+            continue
+        if (user_id, phone) in taken:
+            continue  # duplicate: left for find_duplicates() / merge
+        taken.add((user_id, phone))
+        updates.append({'friend_id': friend_id, 'phone': phone})
+
+    if updates:
+        table = Friend.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('friend_id')).values(phone_e164=bindparam('phone')),
+            updates,
+        )
+        sync.log_ids(Friend, [update['friend_id'] for update in updates])
+    db.session.commit()
+    return len(updates)
+
+
+def find_duplicates(user_id):
+    """Groups of friends sharing a phone number, then groups sharing a name"""
+    from app import Friend
+
+    friends = Friend.query.filter_by(user_id=user_id).order_by(Friend.id).all()
+    by_phone = defaultdict(list)
+    by_name = defaultdict(list)
+    for friend in friends:
+        try:
+            phone = friend.phone_e164 or normalize_e164(friend.country_code, friend.whatsapp_number)
+        except PhoneNumberError:
+            phone = None
+        if phone:
+            by_phone[phone].append(friend)
+        by_name[_name_key(friend.name)].append(friend)
+
+    groups = [DuplicateGroup('phone', phone, group) for phone, group in by_phone.items() if len(group) > 1]
+    in_phone_group = {friend.id for group in groups for friend in group.friends}
+    groups.extend(
+        DuplicateGroup('name', name, group)
+        for name, group in by_name.items()
+        if len(group) > 1 and not all(friend.id in in_phone_group for friend in group)
+    )
+    return groups
+
+
+def merge_friends(user_id, keep_id, merge_ids):
+    """Fold duplicates into one friend; returns how many shares moved"""
+    from app import db, Bill, BillShare, Friend
+    import archive
+    import rollups
+    import share_status
+    import share_writes
+
+    merge_ids = [friend_id for friend_id in set(merge_ids) if friend_id != keep_id]
+    keep = Friend.query.filter_by(id=keep_id, user_id=user_id).first()
+    duplicates = Friend.query.filter(Friend.user_id == user_id, Friend.id.in_(merge_ids)).all() if merge_ids else []
+    if keep is None or not duplicates:
+        return 0
+    duplicate_ids = [friend.id for friend in duplicates]
+    names = {friend.id: friend.name for friend in duplicates}
+
+    # A duplicate's share of an item that keep (or another duplicate) also
+    # has on that bill cannot just be repointed: the unique share index
+    # allows one row per item per friend. Those are summed into keep's row.
+    other = aliased(BillShare)
+    colliding = db.session.execute(
+        select(BillShare.id, BillShare.bill_id, BillShare.food_item,
+               *(getattr(BillShare, name) for name in share_writes.AMOUNTS))
+        .where(BillShare.friend_id.in_(duplicate_ids),
+               exists().where(other.bill_id == BillShare.bill_id, other.food_item == BillShare.food_item,
+                              other.friend_id.in_([keep.id] + duplicate_ids), other.id != BillShare.id))
+    ).all()
+    colliding_ids = [row.id for row in colliding]
+
+    # Move the per-day friend totals in the rollups along with the shares
+    totals = db.session.query(
+        Bill.visit_date, Bill.currency, BillShare.friend_id,
+        db.func.sum(BillShare.total_share), db.func.count(BillShare.id)
+    ).join(Bill, Bill.id == BillShare.bill_id).filter(
+        BillShare.friend_id.in_(duplicate_ids), BillShare.id.notin_(colliding_ids)
+    ).group_by(Bill.visit_date, Bill.currency, BillShare.friend_id).all()
+    archived = [row[1:] for row in archive.friend_share_totals(duplicate_ids)]
+    batch = rollups.RollupBatch()
+    for visit_date, currency, friend_id, amount, count in totals + archived:
+        batch.add_friend_total(user_id, visit_date, currency, friend_id, names[friend_id], -(amount or 0.0), -count)
+        batch.add_friend_total(user_id, visit_date, currency, keep.id, keep.name, amount or 0.0, count)
+    batch.flush()
+
+    if colliding:
+        folded = BillShare.id.in_(colliding_ids)
+        rollups.remove_shares(folded)
+        share_status.remove_shares(folded)
+        sync.log_ids(BillShare, colliding_ids, sync.DELETE)
+        BillShare.query.filter(folded).delete(synchronize_session=False)
+        rows = defaultdict(list)
+        for row in colliding:
+            rows[row.bill_id].append(dict(zip(share_writes.AMOUNTS, row[3:]), friend_id=keep.id, food_item=row.food_item))
+        # upsert() replaces keep's row, so it goes in with the rows it absorbs
+        for share in BillShare.query.filter(
+            BillShare.friend_id == keep.id,
+            tuple_(BillShare.bill_id, BillShare.food_item).in_([(row.bill_id, row.food_item) for row in colliding])
+        ):
+            rows[share.bill_id].append(dict({name: getattr(share, name) for name in share_writes.AMOUNTS},
+                                            friend_id=keep.id, food_item=share.food_item))
+        for bill in Bill.query.filter(Bill.id.in_(list(rows))):
+            share_writes.upsert(bill, rows[bill.id], {keep.id: keep.name})
+
+    sync.log_where(BillShare, BillShare.friend_id.in_(duplicate_ids))
+    moved = len(colliding) + BillShare.query.filter(BillShare.friend_id.in_(duplicate_ids)).update(
+        {BillShare.friend_id: keep.id}, synchronize_session=False)
+    moved += archive.move_friend_shares(duplicate_ids, keep.id)
+
+    sync.log_ids(Friend, duplicate_ids, sync.DELETE)
+    Friend.query.filter(Friend.id.in_(duplicate_ids)).delete(synchronize_session=False)
+    # Only now that the duplicates are gone can keep take over their number
+    if keep.phone_e164 is None:
+        for friend in [keep] + duplicates:
+            try:
+                keep.phone_e164 = friend.phone_e164 or normalize_e164(friend.country_code, friend.whatsapp_number)
+                break
+            except PhoneNumberError:
+                continue
+    db.session.commit()
+    return moved
+
+
+class ContactImportResult:
+    def __init__(self):
+        self.format = None
+        self.rows_read = 0
+        self.added = 0
+        self.skipped_existing = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def _find_column(columns, candidates):
+    for candidate in candidates:
+        if candidate in columns:
+            return columns[candidate]
+    return None
+
+
+def _csv_contacts(text):
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, None) or []
+    columns = {name.strip().lower(): index for index, name in enumerate(header)}
+    name_col = _find_column(columns, NAME_HEADERS)
+    phone_col = _find_column(columns, PHONE_HEADERS)
+    country_col = _find_column(columns, COUNTRY_HEADERS)
+    if name_col is None or phone_col is None:
+        raise ValueError('The CSV needs a Name column and a Phone / WhatsApp Number column')
+
+    def cell(row, index):
+        return row[index].strip() if index is not None and index < len(row) else ''
+
+    for row in reader:
+        if not any(value.strip() for value in row):
+            continue
+        yield reader.line_num, cell(row, name_col), cell(row, country_col), cell(row, phone_col)
+
+
+def _vcard_contacts(text):
+    # Unfold continuation lines (RFC 6350 3.2) before reading properties
+    lines = re.sub(r'\r?\n[ \t]', '', text).splitlines()
+    card_line, name, phones = 0, '', []
+    for number, line in enumerate(lines, 1):
+        prop, _, value = line.partition(':')
+        prop_name, _, params = prop.upper().partition(';')
+        if prop_name == 'BEGIN':
+            card_line, name, phones = number, '', []
+        elif prop_name == 'FN':
+            name = value.strip()
+        elif prop_name == 'N' and not name:
+            parts = [part.strip() for part in value.split(';')]
+            name = ' '.join(part for part in parts[1:2] + parts[:1] if part)
+        elif prop_name == 'TEL':
+            # Prefer a mobile number; the first TEL otherwise
+            mobile = 'CELL' in params or 'MOBILE' in params
+            phones.insert(0 if mobile else len(phones), value.strip())
+        elif prop_name == 'END':
+            yield card_line, name, '', phones[0] if phones else ''
+
+
+def _insert(table):
+    from app import db
+    from sqlalchemy.dialects import postgresql, sqlite
+
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(table)
+
+
+def import_contacts(user_id, stream, filename='', default_country_code=DEFAULT_COUNTRY_CODE):
+    """Add every new contact in a CSV or vCard file as a friend"""
+    from app import db, Friend
+
+    raw = stream.read()
+    text = raw.decode('utf-8-sig') if isinstance(raw, bytes) else raw
+    result = ContactImportResult()
+    if filename.lower().endswith(('.vcf', '.vcard')) or text.lstrip().upper().startswith('BEGIN:VCARD'):
+        result.format, contacts = 'vcard', _vcard_contacts(text)
+    else:
+        result.format, contacts = 'csv', _csv_contacts(text)
+
+    taken = {
+        phone for (phone,) in db.session.query(Friend.phone_e164)
+        .filter(Friend.user_id == user_id, Friend.phone_e164.isnot(None))
+    }
+    pending = []
+
+    def flush():
+        if pending:
+            added = db.session.execute(_insert(Friend.__table__).values(pending).on_conflict_do_nothing(
+                index_elements=['user_id', 'phone_e164'])).rowcount
+            sync.log_where(Friend, (Friend.user_id == user_id)
+                           & Friend.phone_e164.in_([row['phone_e164'] for row in pending]))
+            result.added += added
+            result.skipped_existing += len(pending) - added
+            pending.clear()
+
+    for line, name, country_code, number in contacts:
+        result.rows_read += 1
+        if not name:
+            result.error(line, 'Name is missing')
+            continue
+        try:
+            phone = normalize_e164(country_code, number, default_country_code)
+        except PhoneNumberError as e:
+            result.error(line, f'{name}: {e}')
+            continue
+        if phone in taken:
+            result.skipped_existing += 1
+            continue
+        taken.add(phone)
+        code, local = split_e164(phone, country_code or default_country_code)
+        pending.append(dict(
+            user_id=user_id, name=name[:100], country_code=code[:5],
+            whatsapp_number=local[:20], phone_e164=phone, avatar=AVATAR,
+        ))
+        if len(pending) >= INSERT_CHUNK_SIZE:
+            flush()
+    flush()
+    db.session.commit()
+    return result
@@ -0,0 +1,216 @@
+# export_jobs.py - Background CSV export jobs
+#
+# Large reports are built in a worker thread instead of inside the request.
+# Progress lives on the ExportJob row so any gunicorn worker can answer a
+# status poll, and the finished CSV is written to EXPORT_FOLDER where it is
+# served with Range support until it expires. A request identical to a
+# recent finished export (same user, report and parameters) reuses its file.
+#
+# Rows are read in keyset pages (keyset_pages), each fully fetched before
+# its rows are written, and progress goes through its own connection. No
+# cursor is open while progress is committed: on SQLite that commit would
+# wait on the reader's lock, on Postgres it would close the cursor.
+import csv
+import hashlib
+import heapq
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+PROGRESS_EVERY = 500
+STALE_AFTER = timedelta(minutes=10)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        from app import app
+        _executor = ThreadPoolExecutor(max_workers=app.config['EXPORT_MAX_WORKERS'],
+                                       thread_name_prefix='export')
+    return _executor
+
+
+def params_key(user_id, kind, params):
+    """Stable fingerprint of one report request"""
+    raw = json.dumps([user_id, kind, params], sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def find_reusable(user_id, kind, params):
+    """Most recent finished, unexpired export for an identical request"""
+    from app import app, ExportJob
+
+    now = datetime.utcnow()
+    reuse_after = now - timedelta(minutes=app.config['EXPORT_REUSE_MINUTES'])
+    job = ExportJob.query.filter(
+        ExportJob.user_id == user_id,
+        ExportJob.params_key == params_key(user_id, kind, params),
+        ExportJob.status.in_(('queued', 'running', 'done')),
+        ExportJob.created_at >= reuse_after,
+        ExportJob.expires_at > now,
+    ).order_by(ExportJob.created_at.desc()).first()
+    if job and job.status == 'done' and not os.path.exists(job.file_path or ''):
+        return None
+    return job
+
+
+def start_export(user_id, kind, params, download_name):
+    """Queue an export (or reuse a matching one) and return its job"""
+    from app import app, db, ExportJob
+
+    purge_expired()
+
+    job = find_reusable(user_id, kind, params)
+    if job:
+        return job
+
+    now = datetime.utcnow()
+    job = ExportJob(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        kind=kind,
+        params=json.dumps(params, sort_keys=True),
+        params_key=params_key(user_id, kind, params),
+        status='queued',
+        download_name=download_name,
+        created_at=now,
+        updated_at=now,
+        expires_at=now + timedelta(hours=app.config['EXPORT_RETENTION_HOURS']),
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    _get_executor().submit(_run_job, job.id)
+    return job
+
+
+def _run_job(job_id):
+    from app import app, db, ExportJob, EXPORT_REPORTS
+
+    with app.app_context():
+        job = db.session.get(ExportJob, job_id)
+        if job is None:
+            return
+        tmp_path = None
+        try:
+            build = EXPORT_REPORTS[job.kind]
+            total, rows = build(job.user_id, json.loads(job.params))
+
+            job.status = 'running'
+            job.rows_total = total
+            job.updated_at = datetime.utcnow()
+            db.session.commit()
+
+            os.makedirs(app.config['EXPORT_FOLDER'], exist_ok=True)
+            final_path = os.path.join(app.config['EXPORT_FOLDER'], f'{job.id}.csv')
+            tmp_path = final_path + '.part'
+
+            def on_progress(done):
+                # Not a session commit, which would expire the rows being written
+                table = ExportJob.__table__
+                with db.engine.begin() as connection:
+                    connection.execute(table.update().where(table.c.id == job_id).values(
+                        rows_done=done, updated_at=datetime.utcnow()))
+
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerows(rows(on_progress))
+            os.replace(tmp_path, final_path)
+
+            job.status = 'done'
+            job.rows_done = total
+            job.file_path = final_path
+            job.finished_at = datetime.utcnow()
+            job.updated_at = job.finished_at
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            job.status = 'failed'
+            job.error = str(e)[:500]
+            job.updated_at = datetime.utcnow()
+            db.session.commit()
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def keyset_pages(query, columns, key, size=PROGRESS_EVERY):
+    """Rows of query newest first, read size at a time by (date, id) keyset
+
+    columns maps each model queried to its (date, id) columns and key gives
+    a row's (date, id). The parts of a SpanningQuery are paged separately
+    and merged.
+    """
+    import archive
+    from sqlalchemy import tuple_
+
+    if isinstance(query, archive.SpanningQuery):
+        return heapq.merge(*(keyset_pages(part, columns, key, size) for part in query.queries),
+                           key=query.key, reverse=True)
+
+    date_column, id_column = columns[query.column_descriptions[0]['entity']]
+    query = query.order_by(None).order_by(date_column.desc(), id_column.desc())
+
+    def pages():
+        last = None
+        while True:
+            page = query if last is None else query.filter(tuple_(date_column, id_column) < last)
+            rows = page.limit(size).all()
+            if not rows:
+                return
+            last = key(rows[-1])
+            yield from rows
+            if len(rows) < size:
+                return
+    return pages()
+
+
+def tracked(items, on_progress):
+    """Yield items, reporting how many were consumed every PROGRESS_EVERY"""
+    done = 0
+    for item in items:
+        yield item
+        done += 1
+        if done % PROGRESS_EVERY == 0:
+            on_progress(done)
+
+
+def job_status(job):
+    """JSON-ready status; jobs whose worker died are reported as failed"""
+    from app import db
+
+    if job.status in ('queued', 'running') and job.updated_at < datetime.utcnow() - STALE_AFTER:
+        job.status = 'failed'
+        job.error = 'Export stopped responding, please request it again'
+        db.session.commit()
+
+    percent = 100 if job.status == 'done' else 0
+    if job.status == 'running' and job.rows_total:
+        percent = int(100 * (job.rows_done or 0) / job.rows_total)
+
+    return {
+        'id': job.id,
+        'status': job.status,
+        'rows_done': job.rows_done or 0,
+        'rows_total': job.rows_total or 0,
+        'percent': percent,
+        'error': job.error,
+        'expires_at': job.expires_at.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def purge_expired():
+    """Delete expired export files and their job rows"""
+    from app import db, ExportJob
+
+    expired = ExportJob.query.filter(ExportJob.expires_at <= datetime.utcnow()).all()
+    for job in expired:
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        db.session.delete(job)
+    if expired:
+        db.session.commit()
+    return len(expired)
@@ -0,0 +1,188 @@
+# fx.py - Bill currencies and conversion into the reporting currency
+#
+# Each bill keeps its amounts in its own currency (Bill.currency, an ISO
+# 4217 code). Reports convert into REPORTING_CURRENCY with a local rate
+# table, FX_RATES_FILE: CSV rows of "date,currency,rate", where rate is
+# units of currency per one ANCHOR (USD). A bill converts at the latest
+# rates on or before its visit date, or the earliest rates for older bills.
+#
+# The file is parsed once per process, and again when its mtime changes.
+# Each rate date becomes one snapshot of every currency known by then.
+# Lookups by visit date are cached per date, so a report bisects once per
+# distinct date. Reports never convert row by row against the table:
+#   - totals are summed per (visit date, currency) in SQL, and one factor
+#     per group converts them (convert_sums);
+#   - row listings use a Converter, which resolves one factor per distinct
+#     (currency, date) pair and reuses it for every row sharing it.
+import csv
+import os
+import threading
+from bisect import bisect_right
+from datetime import datetime
+
+ANCHOR = 'USD'
+SYMBOLS = {'INR': '₹', 'USD': '$', 'SGD': 'S$', 'EUR': '€', 'GBP': '£', 'AED': 'AED ', 'MYR': 'RM'}
+
+_lock = threading.Lock()
+_table = None
+_UNSEEN = object()
+
+
+class RateTable:
+    """Rate snapshots by date, loaded from one rates file"""
+
+    def __init__(self, path='', mtime=None, rows=()):
+        self.path = path
+        self.mtime = mtime
+        by_date = {}
+        for day, currency, rate in rows:
+            by_date.setdefault(day, {})[currency] = rate
+        self.dates = sorted(by_date)
+        self.snapshots = []
+        known = {ANCHOR: 1.0}
+        for day in self.dates:
+            known = dict(known, **by_date[day])
+            self.snapshots.append(known)
+        self.currencies = sorted(known)
+        self._by_date = {}
+
+    def rates_on(self, day):
+        """{currency: units per ANCHOR} in effect on day"""
+        rates = self._by_date.get(day)
+        if rates is None:
+            if not self.snapshots:
+                rates = {ANCHOR: 1.0}
+            else:
+                rates = self.snapshots[max(bisect_right(self.dates, day) - 1, 0)]
+            self._by_date[day] = rates
+        return rates
+
+    def factor(self, currency, target, day):
+        """Multiplier from currency to target on day, None without a rate"""
+        if currency == target:
+            return 1.0
+        rates = self.rates_on(day)
+        if currency not in rates or target not in rates:
+            return None
+        return rates[target] / rates[currency]
+
+
+def _read(path):
+    rows = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            if not row or row[0].strip().startswith('#') or row[0].strip().lower() == 'date':
+                continue
+            try:
+                day = datetime.strptime(row[0].strip(), '%Y-%m-%d').date()
+                rate = float(row[2])
+            except (IndexError, ValueError):
+                raise ValueError(f'{path}:{line_number}: expected "date,currency,rate"')
+            if rate <= 0:
+                raise ValueError(f'{path}:{line_number}: rate must be positive')
+            rows.append((day, row[1].strip().upper(), rate))
+    return rows
+
+
+def rate_table():
+    """The current RateTable, reloaded when FX_RATES_FILE changes"""
+    from app import app, log
+
+    global _table
+    path = app.config['FX_RATES_FILE']
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+    table = _table
+    if table is not None and table.path == path and table.mtime == mtime:
+        return table
+    with _lock:
+        if _table is None or _table.path != path or _table.mtime != mtime:
+            if mtime is None:
+                log.warning('FX rates file %s not found; only %s converts', path, ANCHOR)
+                rows = []
+            else:
+                rows = _read(path)
+            _table = RateTable(path, mtime, rows)
+        return _table
+
+
+def currencies():
+    """Currencies a bill can be recorded in"""
+    from app import app
+    return sorted(set(rate_table().currencies) | {app.config['DEFAULT_CURRENCY']})
+
+
+def normalize(code):
+    """Upper-case currency code if it's one we have rates for, else None"""
+    code = (code or '').strip().upper()
+    return code if code in currencies() else None
+
+
+def reporting_currency():
+    from app import app
+    return app.config['REPORTING_CURRENCY']
+
+
+def symbol(currency):
+    return SYMBOLS.get(currency, f'{currency} ')
+
+
+def format_money(amount, currency=None):
+    return f'{symbol(currency or reporting_currency())}{amount or 0:.2f}'
+
+
+def _as_date(day):
+    return day.date() if isinstance(day, datetime) else day
+
+
+class Converter:
+    """Converts amounts into target, one rate lookup per (currency, date)"""
+
+    def __init__(self, target=None, table=None):
+        self.target = target or reporting_currency()
+        self.table = table or rate_table()
+        self._factors = {}
+        self.missing = set()
+
+    def factor(self, currency, day):
+        key = (currency, day)
+        factor = self._factors.get(key, _UNSEEN)
+        if factor is _UNSEEN:
+            factor = self._factors[key] = self.table.factor(currency, self.target, _as_date(day))
+            if factor is None:
+                self.missing.add(currency)
+        return factor
+
+    def convert(self, amount, currency, day):
+        """amount in target, or None when there is no rate for currency"""
+        factor = self.factor(currency, day)
+        return None if factor is None else (amount or 0) * factor
+
+    def column(self, amounts, currencies, days):
+        """Convert whole columns; unconvertible entries come back as None"""
+        factors = [self.factor(currency, day) for currency, day in zip(currencies, days)]
+        return [None if factor is None else (amount or 0) * factor
+                for amount, factor in zip(amounts, factors)]
+
+
+def convert_sums(groups, target=None):
+    """Total in target of (visit_date, currency, amount) group sums
+
+    Returns (total, currencies without a rate); those groups are left out.
+    """
+    converter = Converter(target)
+    total = 0.0
+    for day, currency, amount in groups:
+        converted = converter.convert(amount, currency, day)
+        if converted is not None:
+            total += converted
+    return total, sorted(converter.missing)
+
+
+def unconverted_note(missing):
+    """Footnote for report totals that had to leave some currencies out"""
+    if not missing:
+        return ''
+    return f"excludes {', '.join(sorted(missing))} (no exchange rate)"
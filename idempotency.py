@@ -0,0 +1,73 @@
+# idempotency.py - Idempotency keys for form submissions that write
+#
+# share_bill.html carries a random key in a hidden field; API clients may
+# send an Idempotency-Key header instead. The first request with a key
+# claims it, inserting an IdempotencyKey row in the same transaction as its
+# writes, and stores what its response needs. A resubmission or retry with
+# the same key skips the writes and answers from that record. Keys belong
+# to one user and last IDEMPOTENCY_KEY_HOURS; claiming a key clears the
+# user's expired ones.
+#
+# The key row is inserted before any other write, so when two requests
+# race with one key the second waits on the first's transaction (row lock
+# on Postgres, the write lock on SQLite), then fails to claim the key and
+# replays the first one's result.
+import json
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+from sqlalchemy.exc import IntegrityError
+
+HEADER = 'Idempotency-Key'
+FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 64
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def request_key():
+    """The request's idempotency key (header, then form field), or None"""
+    key = (request.headers.get(HEADER) or request.form.get(FIELD) or '').strip()
+    return key if 0 < len(key) <= MAX_KEY_LENGTH else None
+
+
+def _cutoff():
+    return datetime.utcnow() - timedelta(hours=current_app.config['IDEMPOTENCY_KEY_HOURS'])
+
+
+def previous(user_id, endpoint, key):
+    """The stored result of an earlier request with this key, or None"""
+    from app import db, IdempotencyKey
+
+    record = db.session.get(IdempotencyKey, (user_id, key))
+    if record is None or record.endpoint != endpoint or record.result is None or record.created_at < _cutoff():
+        return None
+    return json.loads(record.result)
+
+
+def claim(user_id, endpoint, key):
+    """Take key for this request; returns its record, or None if another request has it
+
+    On None the session has been rolled back.
+    """
+    from app import db, IdempotencyKey
+
+    IdempotencyKey.query.filter(
+        IdempotencyKey.user_id == user_id, IdempotencyKey.created_at < _cutoff()
+    ).delete(synchronize_session=False)
+    record = IdempotencyKey(user_id=user_id, key=key, endpoint=endpoint)
+    db.session.add(record)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return None
+    return record
+
+
+def complete(record, result):
+    """Store the result to replay; committed with the request's writes"""
+    record.result = json.dumps(result)
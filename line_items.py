@@ -0,0 +1,166 @@
+# line_items.py - Receipt line items from OCR.space word boxes
+#
+# With overlay=True OCR.space returns every word with its bounding box. Its
+# own "Lines" often split a receipt row in two: the dish name on the left
+# and the price at the right edge are far apart and come back as separate
+# lines. Here the words are regrouped into rows by vertical position. Each
+# word goes into a bucket of its centre y (bucket height is a fraction of
+# the mean word height). Buckets are then walked top to bottom, and a bucket
+# joins the current row while its centre stays within half a word height of
+# the row's centre. That is linear in the number of words plus the number
+# of buckets. Only the few words within each row are sorted, left to right.
+#
+# A row becomes a LineItem(name, quantity, price) when it ends in a price
+# with two decimals and has a name. Quantities are read from "2", "2x",
+# "x2" or "2 @" next to the name, or from a Qty column before the price.
+# If a row has a unit price and a line total, the total is used. Headline
+# rows (total, tax, service charge...) are left to extract_amounts_from_text().
+# Without overlay data the plain text lines are parsed the same way.
+import re
+from collections import namedtuple
+
+LineItem = namedtuple('LineItem', 'name quantity price')
+
+# Bucket height as a fraction of the mean word height
+BUCKET_FRACTION = 0.25
+# A word belongs to a row while its centre is this many word heights away at most
+ROW_TOLERANCE = 0.5
+
+PRICE_RE = re.compile(r'^\(?-?(?:rs\.?|inr|[$€£₹])?\s*(\d{1,3}(?:,\d{3})+|\d+)[.,](\d{2})\)?$', re.I)
+QUANTITY_RE = re.compile(r'^(?:[x×](\d{1,2})|(\d{1,2})\s*[x×@]?)$', re.I)
+SUMMARY_WORDS = {
+    'total', 'subtotal', 'sub', 'tax', 'taxes', 'gst', 'cgst', 'sgst', 'igst', 'vat', 'cess',
+    'service', 'discount', 'tip', 'gratuity', 'change', 'cash', 'card', 'visa', 'mastercard',
+    'upi', 'amount', 'balance', 'round', 'rounding', 'due', 'paid', 'tender', 'net', 'payable', 'tva',
+}
+
+
+def overlay_words(parsed_result):
+    """(text, left, top, width, height) of every word in one ParsedResult"""
+    words = []
+    for line in (parsed_result.get('TextOverlay') or {}).get('Lines') or []:
+        for word in line.get('Words') or []:
+            text = (word.get('WordText') or '').strip()
+            if text:
+                words.append((text, float(word.get('Left', 0)), float(word.get('Top', 0)),
+                              float(word.get('Width', 0)), float(word.get('Height', 0))))
+    return words
+
+
+def group_rows(words):
+    """Words grouped into receipt rows, top to bottom, each row left to right"""
+    if not words:
+        return []
+    mean_height = sum(word[4] for word in words) / len(words) or 1.0
+    bucket_size = mean_height * BUCKET_FRACTION
+    tolerance = mean_height * ROW_TOLERANCE
+
+    buckets = {}
+    for word in words:
+        centre = word[2] + word[4] / 2
+        buckets.setdefault(int(centre // bucket_size), []).append((centre, word))
+
+    rows = []
+    row, row_sum = [], 0.0
+    for key in range(min(buckets), max(buckets) + 1):
+        bucket = buckets.get(key)
+        if not bucket:
+            continue
+        bucket_centre = sum(centre for centre, _ in bucket) / len(bucket)
+        if row and abs(bucket_centre - row_sum / len(row)) > tolerance:
+            rows.append(row)
+            row, row_sum = [], 0.0
+        for centre, word in bucket:
+            row.append(word)
+            row_sum += centre
+    rows.append(row)
+    return [[word[0] for word in sorted(row, key=lambda word: word[1])] for row in rows]
+
+
+def _price(token):
+    match = PRICE_RE.match(token.replace(' ', ''))
+    if not match:
+        return None
+    value = float(match.group(1).replace(',', '') + '.' + match.group(2))
+    return -value if token.startswith(('-', '(')) else value
+
+
+def parse_row(tokens):
+    """LineItem for one row of tokens, or None if it isn't an item row"""
+    prices = []
+    while tokens:
+        price = _price(tokens[-1])
+        if price is None:
+            break
+        prices.insert(0, price)
+        tokens = tokens[:-1]
+    if not prices or not tokens or prices[-1] <= 0:
+        return None
+
+    quantity = None
+    first = QUANTITY_RE.match(tokens[0])
+    if first and len(tokens) > 1:
+        quantity = int(first.group(1) or first.group(2))
+        tokens = tokens[1:]
+        if tokens and tokens[0] in ('x', 'X', '×', '@'):
+            tokens = tokens[1:]
+    if tokens and quantity is None:
+        last = QUANTITY_RE.match(tokens[-1])
+        if last and (last.group(1) or tokens[-1][-1:] in 'xX×@'):
+            quantity = int(last.group(1) or last.group(2))
+            tokens = tokens[:-1]
+        elif len(tokens) > 1 and tokens[-1] in ('x', 'X', '×', '@') and tokens[-2].isdigit():
+            quantity = int(tokens[-2])
+            tokens = tokens[:-2]
+        elif len(tokens) > 1 and last and tokens[-1].isdigit():
+            quantity = int(tokens[-1])  # a Qty column between name and price
+            tokens = tokens[:-1]
+
+    name = ' '.join(tokens).strip(' .:-*')
+    words = set(re.findall(r'[a-z]+', name.lower()))
+    if sum(ch.isalpha() for ch in name) < 2 or words & SUMMARY_WORDS:
+        return None
+
+    price = prices[-1]
+    if quantity is None:
+        quantity = 1
+        if len(prices) > 1 and prices[0] > 0:
+            ratio = price / prices[0]
+            if abs(ratio - round(ratio)) < 0.01 and 1 < round(ratio) < 100:
+                quantity = int(round(ratio))
+    return LineItem(name, quantity, round(price, 2))
+
+
+def extract_line_items(ocr_result):
+    """Line items from an OCR.space response, from word boxes when it has them"""
+    items = []
+    for parsed in ocr_result.get('ParsedResults') or []:
+        words = overlay_words(parsed)
+        if words:
+            rows = group_rows(words)
+        else:
+            rows = [line.split() for line in (parsed.get('ParsedText') or '').splitlines()]
+        for tokens in rows:
+            item = parse_row(tokens)
+            if item:
+                items.append(item)
+    return items
+
+
+def to_json(items):
+    return [{'name': item.name, 'quantity': item.quantity, 'price': item.price} for item in items]
+
+
+def from_json(data):
+    """LineItems from submitted JSON, dropping anything malformed"""
+    items = []
+    for entry in data if isinstance(data, list) else []:
+        try:
+            name = str(entry['name']).strip()[:200]
+            quantity = max(1, int(entry.get('quantity') or 1))
+            price = round(float(entry['price']), 2)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+        if name and price > 0:
+            items.append(LineItem(name, quantity, price))
+    return items
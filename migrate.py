@@ -88,56 +88,31 @@ def run_migration():
             User.is_super_admin = property(is_super_admin)
             print("✅ is_super_admin property added to User model!")
             
-            # Update existing users with new field values
-            users = User.query.all()
-            print(f"👥 Updating {len(users)} existing users...")
-            
+            # Backfill the new fields with one UPDATE each, rather than
+            # loading and saving every user
+            now = datetime.utcnow()
+            is_admin = db.func.coalesce(User.is_admin, False)
+            backfills = [
+                ('role', User.role.is_(None),
+                 {User.role: db.case((is_admin, 'admin'), else_='user')}),
+                ('admin_requested', User.admin_requested.is_(None), {User.admin_requested: is_admin}),
+                ('admin_approved', User.admin_approved.is_(None), {User.admin_approved: is_admin}),
+                ('created_at', User.created_at.is_(None), {User.created_at: now}),
+                # Auto-approve the first admin user (super admin)
+                ('super admin', User.username == 'admin',
+                 {User.admin_approved: True, User.admin_requested: True, User.is_admin: True, User.role: 'admin'}),
+            ]
+            print("👥 Updating existing users...")
             update_count = 0
-            for user in users:
+            for label, condition, values in backfills:
                 try:
-                    updates = []
-                    
-                    # Set role based on is_admin
-                    if not hasattr(user, 'role') or user.role is None:
-                        user.role = 'admin' if user.is_admin else 'user'
-                        updates.append(f"role={user.role}")
-                    
-                    # Set admin_requested and admin_approved
-                    if hasattr(user, 'admin_requested') and user.admin_requested is None:
-                        user.admin_requested = user.is_admin
-                        updates.append(f"admin_requested={user.admin_requested}")
-                    
-                    if hasattr(user, 'admin_approved') and user.admin_approved is None:
-                        user.admin_approved = user.is_admin
-                        updates.append(f"admin_approved={user.admin_approved}")
-                    
-                    # Set created_at for existing users
-                    if hasattr(user, 'created_at') and user.created_at is None:
-                        user.created_at = datetime.utcnow()
-                        updates.append("created_at=now")
-                    
-                    # Auto-approve the first admin user (super admin)
-                    if user.username == 'admin' and hasattr(user, 'admin_approved'):
-                        user.admin_approved = True
-                        user.admin_requested = True
-                        user.is_admin = True
-                        user.role = 'admin'
-                        updates.append("super_admin=auto-approved")
-                    
-                    # TEST THE SUPER ADMIN PROPERTY
-                    try:
-                        is_super = user.is_super_admin
-                        updates.append(f"is_super_admin={is_super}")
-                    except Exception as prop_error:
-                        print(f"   ⚠️ Could not test is_super_admin for {user.username}: {prop_error}")
-                    
-                    if updates:
-                        print(f"   ✅ {user.username}: {', '.join(updates)}")
-                        update_count += 1
-                        
-                except Exception as user_error:
-                    print(f"   ❌ Error updating {user.username}: {user_error}")
-                    continue
+                    count = User.query.filter(condition).update(values, synchronize_session=False)
+                    db.session.commit()
+                    update_count += count
+                    print(f"   ✅ {label}: {count} users")
+                except Exception as update_error:
+                    db.session.rollback()
+                    print(f"   ❌ Error setting {label}: {update_error}")
             
             # Commit all changes
             db.session.commit()
@@ -145,33 +120,25 @@ def run_migration():
             # Summary report
             print(f"\n📊 MIGRATION SUMMARY:")
             print(f"   ✅ Columns added: {len(columns_to_add)}")
-            print(f"   ✅ Users updated: {update_count}/{len(users)}")
+            print(f"   ✅ User fields updated: {update_count}")
             print(f"   ✅ Database type: {'PostgreSQL' if 'postgres' in database_url else 'SQLite'}")
             print(f"   ✅ is_super_admin property: Added successfully")
             
-            # Final verification
+            # Final verification: users per status from one grouped query,
+            # and the admins by name
             print(f"\n🔍 FINAL USER STATUS:")
-            users = User.query.all()
-            for user in users:
-                try:
-                    admin_status = ""
-                    if user.is_admin:
-                        if getattr(user, 'admin_approved', False):
-                            admin_status = "✅ Approved Admin"
-                        else:
-                            admin_status = "⏳ Pending Approval"
-                    else:
-                        admin_status = "👤 Regular User"
-                    
-                    role = getattr(user, 'role', 'N/A')
-                    
-                    # Test super admin status
-                    super_admin_status = "🌟 SUPER ADMIN" if user.is_super_admin else ""
-                    
-                    print(f"   👤 {user.username}: {admin_status} (role: {role}) {super_admin_status}")
-                    
-                except Exception as e:
-                    print(f"   ❌ Error reading {user.username}: {e}")
+            statuses = db.session.query(
+                User.is_admin, User.admin_approved, User.role, db.func.count()
+            ).group_by(User.is_admin, User.admin_approved, User.role).all()
+            for admin, approved, role, count in statuses:
+                if admin:
+                    admin_status = "✅ Approved Admin" if approved else "⏳ Pending Approval"
+                else:
+                    admin_status = "👤 Regular User"
+                print(f"   {admin_status} (role: {role or 'N/A'}): {count}")
+            for user in User.query.filter(User.is_admin.is_(True)).order_by(User.id).limit(20):
+                super_admin_status = "🌟 SUPER ADMIN" if user.is_super_admin else ""
+                print(f"   👤 {user.username}: admin (role: {user.role}) {super_admin_status}")
             
             print(f"\n🎉 MIGRATION COMPLETED SUCCESSFULLY!")
             return True
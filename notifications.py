@@ -0,0 +1,184 @@
+# notifications.py - WhatsApp message rendering and bulk reminder packs
+#
+# Message templates are parsed once at import time into literal/field parts
+# and rendered by joining a list, instead of growing strings with += per
+# line. Links are built with urllib's quote(), so '&', '#', '+', newlines
+# and emoji survive the trip into wa.me. build_pack() renders one message
+# per friend for any number of bills from a single query ordered by friend.
+# Amounts are shown in the bill's currency; a reminder spanning bills in
+# several currencies totals them in the reporting currency (see fx.py).
+import re
+from collections import namedtuple
+from itertools import groupby
+from string import Formatter
+from urllib.parse import quote
+
+import fx
+
+WHATSAPP_BASE_URL = 'https://wa.me/'
+
+# total is in the reporting currency, for adding up across the pack
+PackEntry = namedtuple('PackEntry', 'friend_id friend_name phone share_count total message url')
+
+AMOUNT_FIELDS = ('total_amount', 'food_amount', 'tax_share', 'service_charge_share', 'total_share', 'total')
+
+
+class MessageTemplate:
+    """A str.format template pre-parsed into (literal, field, format spec) parts"""
+
+    def __init__(self, source):
+        self.parts = [
+            (literal, field, spec)
+            for literal, field, spec, _ in Formatter().parse(source)
+        ]
+
+    def render(self, **values):
+        out = []
+        append = out.append
+        for literal, field, spec in self.parts:
+            append(literal)
+            if field is not None:
+                append(format(values[field], spec or ''))
+        return ''.join(out)
+
+
+BILL_HEADER = MessageTemplate(
+    "🍽️ *Bill Sharing - {restaurant_name}*\n"
+    "Date: {visit_date}\n"
+    "Total Amount: {total_amount}\n\n"
+    "*Individual Shares:*\n"
+)
+BILL_SHARE_LINE = MessageTemplate(
+    "👤 {friend_name}:\n"
+    "   Food: {food_amount} ({food_item})\n"
+    "   Tax: {tax_share}\n"
+    "   Service: {service_charge_share}\n"
+    "   *Total: {total_share}*\n\n"
+)
+BILL_FOOTER = "Please transfer your share. Thank you! 🙏"
+
+INDIVIDUAL_SHARE = MessageTemplate(
+    "Hi {friend_name}! 👋\n\n"
+    "Here's your share for {restaurant_name}:\n"
+    "🍽️ Food: {food_amount} ({food_item})\n"
+    "📊 Tax: {tax_share}\n"
+    "🔔 Service: {service_charge_share}\n"
+    "💰 *Total Amount: {total_share}*\n\n"
+    "Please transfer this amount. Thank you! 😊"
+)
+
+REMINDER_HEADER = MessageTemplate("Hi {friend_name}! 👋\n\nHere are your shares{period}:\n")
+REMINDER_LINE = MessageTemplate("🍽️ {visit_date} {restaurant_name} - {food_item}: {total_share}\n")
+REMINDER_FOOTER = MessageTemplate(
+    "\n💰 *Total Amount: {total}*\n\n"
+    "Please transfer this amount. Thank you! 😊"
+)
+
+
+def _money(values, currency):
+    """values with the amount fields formatted in currency"""
+    return {key: fx.format_money(value, currency) if key in AMOUNT_FIELDS else value
+            for key, value in values.items()}
+
+
+def whatsapp_phone(country_code, whatsapp_number):
+    """wa.me expects the full international number as digits only"""
+    return re.sub(r'\D', '', f'{country_code or ""}{whatsapp_number or ""}')
+
+
+def whatsapp_url(phone, message):
+    return f"{WHATSAPP_BASE_URL}{phone}?text={quote(message, safe='')}"
+
+
+def bill_message(bill, bill_shares_data):
+    """Group message listing every friend's share of one bill"""
+    parts = [BILL_HEADER.render(
+        restaurant_name=bill.restaurant_name,
+        visit_date=bill.visit_date.strftime('%Y-%m-%d'),
+        total_amount=fx.format_money(bill.total_amount, bill.currency),
+    )]
+    parts.extend(BILL_SHARE_LINE.render(**_money(share, bill.currency)) for share in bill_shares_data)
+    parts.append(BILL_FOOTER)
+    return ''.join(parts)
+
+
+def individual_message(friend_name, restaurant_name, share, currency):
+    return INDIVIDUAL_SHARE.render(**_money(dict(
+        friend_name=friend_name,
+        restaurant_name=restaurant_name,
+        food_amount=share.food_amount,
+        food_item=share.food_item,
+        tax_share=share.tax_share,
+        service_charge_share=share.service_charge_share,
+        total_share=share.total_share,
+    ), currency))
+
+
+def _pack_rows(user_id, bill_ids=None, start_date=None, end_date=None):
+    from app import db, Bill, BillShare, Friend
+
+    query = db.session.query(
+        Friend.id, Friend.name, Friend.country_code, Friend.whatsapp_number,
+        Bill.restaurant_name, Bill.visit_date, Bill.currency,
+        BillShare.food_item, BillShare.food_amount, BillShare.tax_share,
+        BillShare.service_charge_share, BillShare.total_share,
+    ).join(Bill, Bill.id == BillShare.bill_id).join(
+        Friend, Friend.id == BillShare.friend_id
+    ).filter(Bill.user_id == user_id)
+    if bill_ids:
+        query = query.filter(Bill.id.in_(bill_ids))
+    if start_date:
+        query = query.filter(Bill.visit_date >= start_date)
+    if end_date:
+        query = query.filter(Bill.visit_date <= end_date)
+    return query.order_by(Friend.id, Bill.visit_date, BillShare.id).yield_per(1000)
+
+
+def build_pack(user_id, bill_ids=None, start_date=None, end_date=None, period_label=''):
+    """One rendered message and wa.me link per friend, in a single pass"""
+    period = f' for {period_label}' if period_label else ''
+    converter = fx.Converter()
+    pack = []
+    for friend_id, rows in groupby(_pack_rows(user_id, bill_ids, start_date, end_date), key=lambda r: r[0]):
+        rows = list(rows)
+        _, friend_name, country_code, whatsapp_number = rows[0][:4]
+
+        converted = [converter.convert(row.total_share, row.currency, row.visit_date) for row in rows]
+        total = sum(amount for amount in converted if amount is not None)
+
+        if len(rows) == 1:
+            row = rows[0]
+            message = INDIVIDUAL_SHARE.render(**_money(dict(
+                friend_name=friend_name, restaurant_name=row.restaurant_name,
+                food_amount=row.food_amount, food_item=row.food_item, tax_share=row.tax_share,
+                service_charge_share=row.service_charge_share, total_share=row.total_share,
+            ), row.currency))
+        else:
+            parts = [REMINDER_HEADER.render(friend_name=friend_name, period=period)]
+            parts.extend(
+                REMINDER_LINE.render(visit_date=row.visit_date.strftime('%Y-%m-%d'),
+                                     restaurant_name=row.restaurant_name, food_item=row.food_item,
+                                     total_share=fx.format_money(row.total_share, row.currency))
+                for row in rows
+            )
+            # Shares all in one currency are totalled in it; a mix is converted
+            currencies = {row.currency for row in rows}
+            if len(currencies) == 1:
+                currency = currencies.pop()
+                message_total = fx.format_money(sum(row.total_share for row in rows), currency)
+            else:
+                message_total = fx.format_money(total, converter.target)
+            parts.append(REMINDER_FOOTER.render(total=message_total))
+            message = ''.join(parts)
+
+        phone = whatsapp_phone(country_code, whatsapp_number)
+        pack.append(PackEntry(friend_id, friend_name, phone, len(rows), total,
+                              message, whatsapp_url(phone, message)))
+    return pack
+
+
+def pack_csv_rows(pack):
+    yield ['Friend Name', 'WhatsApp Number', 'Shares', 'Total Amount', 'WhatsApp Link', 'Message']
+    for entry in pack:
+        yield [entry.friend_name, f'+{entry.phone}', entry.share_count,
+               fx.format_money(entry.total), entry.url, entry.message]
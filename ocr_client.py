@@ -0,0 +1,421 @@
+# ocr_client.py - Resilient client for the OCR.space API
+#
+# Every call has connect/read timeouts and a bounded number of attempts with
+# jittered exponential backoff. Transport failures feed a circuit breaker:
+# after OCR_BREAKER_THRESHOLD consecutive failures calls fail fast with
+# CircuitOpenError (the upload page then sends users to manual entry) until
+# OCR_BREAKER_RESET seconds pass and a single trial call is let through.
+# Optionally a second, hedged request is sent when the first one has not
+# answered within OCR_HEDGE_AFTER seconds, and whichever finishes first wins.
+#
+# Each process keeps one pooled requests.Session, so the TCP/TLS handshake
+# to the provider is paid once and later uploads reuse a keep-alive
+# connection. Images are passed as bytes straight into the multipart body.
+#
+# AsyncOCRClient is the same client for the async handlers in asgi.py: it
+# posts with httpx and awaits instead of blocking, and shares the retry
+# policy, counters and (through get_async_client) the process's breaker.
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # optional dependency, only the ASGI mode needs it
+    httpx = None
+
+OCR_SPACE_URL = 'https://api.ocr.space/parse/image'
+
+# OCR.space has two engines; a processing error on one is retried on the other
+ALTERNATE_ENGINE = {'1': '2', '2': '1'}
+
+
+class OCRError(Exception):
+    """The OCR provider could not be reached or kept failing"""
+
+
+class CircuitOpenError(OCRError):
+    """Calls are short-circuited because the provider is failing"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with closed / open / half-open states"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.open_count = 0
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.trial_in_flight or self.consecutive_failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_in_flight:
+                    self.open_count += 1
+                self.opened_at = self.clock()
+            self.trial_in_flight = False
+
+    def release_trial(self):
+        """End a half-open trial that neither failed nor succeeded (cancelled)"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0
+        return max(0.0, self.reset_timeout - (self.clock() - self.opened_at))
+
+
+def pooled_session(pool_size=10, verify=True):
+    """Keep-alive session; retries are handled by OCRClient, not urllib3"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = verify
+    return session
+
+
+class OCRClient:
+    def __init__(self, api_key='helloworld', url=OCR_SPACE_URL, connect_timeout=3.05, read_timeout=20.0,
+                 max_attempts=3, backoff_base=0.5, backoff_cap=4.0, hedge_after=None,
+                 breaker=None, sleep=time.sleep, session=None):
+        self.session = session or pooled_session()
+        self.api_key = api_key
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys((
+            'calls', 'requests', 'successes', 'failures', 'timeouts', 'processing_errors',
+            'retries', 'short_circuited', 'hedged', 'hedge_wins',
+        ), 0)
+        self.latencies = deque(maxlen=500)
+        self._hedge_pool = None
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def _backoff(self, attempt):
+        """Full jitter: uniform in [0, min(cap, base * 2**attempt)]"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def _post(self, filename, content, payload):
+        self._count('requests')
+        started = time.monotonic()
+        try:
+            response = self.session.post(
+                self.url,
+                files={'file': (filename, content)},
+                data=payload,
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            return response.json()
+        finally:
+            with self.lock:
+                self.latencies.append(time.monotonic() - started)
+
+    def _post_hedged(self, filename, content, payload):
+        if not self.hedge_after:
+            return self._post(filename, content, payload)
+
+        if self._hedge_pool is None:
+            self._hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='ocr-hedge')
+        primary = self._hedge_pool.submit(self._post, filename, content, payload)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        self._count('hedged')
+        hedge = self._hedge_pool.submit(self._post, filename, content, payload)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is hedge:
+                    self._count('hedge_wins')
+                return result
+        raise error
+
+    # The steps of one parse() call, shared with AsyncOCRClient
+
+    def _admit(self, attempt):
+        if attempt:
+            self._count('retries')
+        if self.breaker.allow():
+            return
+        self._count('short_circuited')
+        if attempt:
+            raise CircuitOpenError('OCR temporarily disabled after repeated failures')
+        raise CircuitOpenError(f'OCR temporarily disabled, retry in {self.breaker.retry_after():.0f}s')
+
+    def _payload(self, overlay, language, engine):
+        return {
+            'isOverlayRequired': overlay,
+            'apikey': self.api_key,
+            'language': language,
+            'OCREngine': engine,
+        }
+
+    def _failed(self, timed_out):
+        if timed_out:
+            self._count('timeouts')
+        self._count('failures')
+        self.breaker.record_failure()
+
+    def _answered(self, result, engine):
+        """True if result is final, else the engine to retry on"""
+        # The provider answered, so it is healthy even if this image failed
+        self.breaker.record_success()
+        if not result.get('IsErroredOnProcessing'):
+            self._count('successes')
+            return True
+
+        # Processing errors are retried on the other engine, not with identical parameters
+        self._count('processing_errors')
+        return ALTERNATE_ENGINE.get(str(engine), '1')
+
+    def parse(self, content, filename='upload.png', overlay=False, language='eng', engine='1'):
+        """OCR an image given as bytes; returns the OCR.space JSON response"""
+        self._count('calls')
+        self._admit(0)
+
+        last_error = None
+        result = None
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self.sleep(self._backoff(attempt - 1))
+                self._admit(attempt)
+            try:
+                result = self._post_hedged(filename, content, self._payload(overlay, language, engine))
+            except (requests.RequestException, ValueError) as e:
+                self._failed(isinstance(e, requests.Timeout))
+                last_error = e
+                continue
+            except Exception:
+                # Still a failed attempt: a half-open trial must not stay in flight
+                self._failed(False)
+                raise
+            outcome = self._answered(result, engine)
+            if outcome is True:
+                return result
+            engine = outcome
+
+        if result is not None:
+            return result
+        raise OCRError(f'OCR service unavailable: {last_error}')
+
+    def metrics(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            counters = dict(self.counters)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+        return dict(
+            counters,
+            breaker_state=self.breaker.state,
+            breaker_consecutive_failures=self.breaker.consecutive_failures,
+            breaker_open_count=self.breaker.open_count,
+            breaker_retry_after=round(self.breaker.retry_after(), 1),
+            latency_p50=percentile(0.50),
+            latency_p95=percentile(0.95),
+            latency_p99=percentile(0.99),
+            hedge_after=self.hedge_after,
+        )
+
+
+class AsyncOCRClient(OCRClient):
+    """OCRClient for asyncio handlers, over a pooled httpx.AsyncClient"""
+
+    def __init__(self, pool_size=10, sleep=asyncio.sleep, session=None, **kwargs):
+        if session is None:
+            limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            session = httpx.AsyncClient(limits=limits)
+        super().__init__(sleep=sleep, session=session, **kwargs)
+
+    async def _post(self, filename, content, payload):
+        self._count('requests')
+        started = time.monotonic()
+        try:
+            response = await self.session.post(
+                self.url,
+                files={'file': (filename, content)},
+                data=payload,
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+            )
+            response.raise_for_status()
+            return response.json()
+        finally:
+            with self.lock:
+                self.latencies.append(time.monotonic() - started)
+
+    async def _post_hedged(self, filename, content, payload):
+        if not self.hedge_after:
+            return await self._post(filename, content, payload)
+
+        primary = asyncio.ensure_future(self._post(filename, content, payload))
+        done, _ = await asyncio.wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        self._count('hedged')
+        hedge = asyncio.ensure_future(self._post(filename, content, payload))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is hedge:
+                        self._count('hedge_wins')
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise error
+
+    async def parse(self, content, filename='upload.png', overlay=False, language='eng', engine='1'):
+        """OCR an image given as bytes; returns the OCR.space JSON response"""
+        self._count('calls')
+        self._admit(0)
+
+        last_error = None
+        result = None
+        for attempt in range(self.max_attempts):
+            if attempt:
+                await self.sleep(self._backoff(attempt - 1))
+                self._admit(attempt)
+            try:
+                result = await self._post_hedged(filename, content, self._payload(overlay, language, engine))
+            except (httpx.HTTPError, httpx.InvalidURL, ValueError) as e:
+                self._failed(isinstance(e, httpx.TimeoutException))
+                last_error = e
+                continue
+            except Exception:
+                # Still a failed attempt: a half-open trial must not stay in flight
+                self._failed(False)
+                raise
+            except BaseException:
+                # Cancelled (the client went away): says nothing about the provider
+                self.breaker.release_trial()
+                raise
+            outcome = self._answered(result, engine)
+            if outcome is True:
+                return result
+            engine = outcome
+
+        if result is not None:
+            return result
+        raise OCRError(f'OCR service unavailable: {last_error}')
+
+    async def aclose(self):
+        await self.session.aclose()
+
+
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Per-process client configured from app.config"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from app import app
+
+                config = app.config
+                _client = OCRClient(
+                    session=pooled_session(config['OCR_POOL_SIZE']),
+                    url=config['OCR_API_URL'],
+                    api_key=config['OCR_API_KEY'],
+                    connect_timeout=config['OCR_CONNECT_TIMEOUT'],
+                    read_timeout=config['OCR_READ_TIMEOUT'],
+                    max_attempts=config['OCR_MAX_ATTEMPTS'],
+                    hedge_after=config['OCR_HEDGE_AFTER'] or None,
+                    breaker=CircuitBreaker(config['OCR_BREAKER_THRESHOLD'], config['OCR_BREAKER_RESET']),
+                )
+    return _client
+
+
+def get_async_client():
+    """Per-process async client; shares the breaker with get_client()"""
+    global _async_client
+    if _async_client is None:
+        from app import app
+
+        config = app.config
+        _async_client = AsyncOCRClient(
+            pool_size=config['OCR_POOL_SIZE'],
+            url=config['OCR_API_URL'],
+            api_key=config['OCR_API_KEY'],
+            connect_timeout=config['OCR_CONNECT_TIMEOUT'],
+            read_timeout=config['OCR_READ_TIMEOUT'],
+            max_attempts=config['OCR_MAX_ATTEMPTS'],
+            hedge_after=config['OCR_HEDGE_AFTER'] or None,
+            breaker=get_client().breaker,
+        )
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
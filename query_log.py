@@ -0,0 +1,159 @@
+# query_log.py - Opt-in slow-query log with EXPLAIN capture
+#
+# With SLOW_QUERY_MS > 0, SQLAlchemy cursor events time every statement.
+# Statements slower than the threshold are grouped by their SQL text, which
+# is already parametrised. Each group keeps its count, total and worst time,
+# the endpoints that issued it and the shape of its parameters (types and
+# lengths, never the values). The first time a SELECT turns up slow, its
+# plan is captured once with EXPLAIN QUERY PLAN (SQLite) or EXPLAIN
+# (Postgres). That runs on a raw DBAPI cursor, so it does not fire these
+# events again. On Postgres it runs inside a savepoint, so a failed EXPLAIN
+# cannot abort the request's transaction.
+#
+# Like the OCR metrics, the log is kept in memory per worker process and
+# bounded to MAX_ENTRIES statements. The time measured covers execute(),
+# which includes the first rows, but not the fetches after them.
+import threading
+import time
+from datetime import datetime
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+MAX_ENTRIES = 200
+MAX_ROUTES = 10
+
+_entries = {}
+_lock = threading.Lock()
+_threshold = None
+_explain = True
+
+
+def param_shape(parameters, executemany=False):
+    """Types and sizes of bound parameters, without their values"""
+    if executemany:
+        rows = list(parameters or ())
+        return f'executemany x{len(rows)}: {param_shape(rows[0]) if rows else "()"}'
+
+    def describe(value):
+        if value is None:
+            return 'None'
+        if isinstance(value, (str, bytes)):
+            return f'{type(value).__name__}({len(value)})'
+        if isinstance(value, (list, tuple, set)):
+            return f'{type(value).__name__}[{len(value)}]'
+        return type(value).__name__
+
+    if isinstance(parameters, dict):
+        return ', '.join(f'{key}={describe(value)}' for key, value in parameters.items())
+    return ', '.join(describe(value) for value in parameters or ())
+
+
+def issuer():
+    if has_request_context():
+        return request.endpoint or request.path
+    return f'thread:{threading.current_thread().name}'
+
+
+def explain(conn, cursor, statement, parameters):
+    """Plan for one statement as text lines, or None if it can't be explained"""
+    if not statement.lstrip()[:6].upper().startswith(('SELECT', 'WITH')):
+        return None
+
+    sqlite = conn.dialect.name == 'sqlite'
+    prefix = 'EXPLAIN QUERY PLAN ' if sqlite else 'EXPLAIN '
+    raw = cursor.connection.cursor()
+    try:
+        if not sqlite:
+            raw.execute('SAVEPOINT slow_query_explain')
+        try:
+            raw.execute(prefix + statement, parameters)
+            rows = raw.fetchall()
+        except Exception as e:
+            if not sqlite:
+                raw.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            return [f'EXPLAIN failed: {e}']
+        if not sqlite:
+            raw.execute('RELEASE SAVEPOINT slow_query_explain')
+    finally:
+        raw.close()
+
+    if sqlite:
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_log_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_log_started', None)
+    if started is None:
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms < _threshold:
+        return
+
+    with _lock:
+        entry = _entries.get(statement)
+        if entry is None:
+            if len(_entries) >= MAX_ENTRIES:
+                # Forget the statement that has cost the least overall
+                del _entries[min(_entries, key=lambda key: _entries[key]['total_ms'])]
+            entry = _entries[statement] = dict(
+                statement=statement, count=0, total_ms=0.0, max_ms=0.0,
+                routes={}, param_shape='', plan=None, first_seen=datetime.utcnow(),
+            )
+        entry['count'] += 1
+        entry['total_ms'] += elapsed_ms
+        entry['last_seen'] = datetime.utcnow()
+        if elapsed_ms >= entry['max_ms']:
+            entry['max_ms'] = elapsed_ms
+            entry['param_shape'] = param_shape(parameters, executemany)
+        route = issuer()
+        if route in entry['routes'] or len(entry['routes']) < MAX_ROUTES:
+            entry['routes'][route] = entry['routes'].get(route, 0) + 1
+        needs_plan = _explain and entry['plan'] is None and not executemany
+        if needs_plan:
+            entry['plan'] = []  # claimed; other threads won't explain it too
+
+    if needs_plan:
+        plan = explain(conn, cursor, statement, parameters)
+        with _lock:
+            entry['plan'] = plan
+
+
+def install(app):
+    """Start timing statements if SLOW_QUERY_MS is set (idempotent)"""
+    global _threshold, _explain
+    threshold = app.config.get('SLOW_QUERY_MS') or 0
+    if threshold <= 0 or _threshold is not None:
+        return False
+    _threshold = threshold
+    _explain = app.config.get('SLOW_QUERY_EXPLAIN', True)
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    return True
+
+
+def enabled():
+    return _threshold is not None
+
+
+def worst(limit=50, order='total_ms'):
+    """Slow statements, worst first, as copies safe to hand to a template"""
+    with _lock:
+        entries = [dict(entry, routes=dict(entry['routes'])) for entry in _entries.values()]
+    for entry in entries:
+        entry['mean_ms'] = entry['total_ms'] / entry['count']
+    entries.sort(key=lambda entry: entry[order], reverse=True)
+    return entries[:limit]
+
+
+def reset():
+    with _lock:
+        _entries.clear()
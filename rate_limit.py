@@ -0,0 +1,170 @@
+# rate_limit.py - Token-bucket rate limiting and admission control
+#
+# Expensive endpoints (remote OCR, full-table CSV downloads, password
+# hashing) each have two token buckets: one per client (the logged-in user,
+# or the IP address before login, taken from X-Forwarded-For behind
+# TRUSTED_PROXY_HOPS proxies) and one for the route as a whole. The
+# per-client bucket stops one user from hogging a route. The route bucket
+# caps how much of the server the route can take, whoever is asking.
+#
+# Buckets must be shared by every gunicorn worker, so they live in a small
+# local SQLite file (RATE_LIMIT_DB, WAL mode) rather than in process memory.
+# A request refills and takes from both of its buckets in one BEGIN
+# IMMEDIATE transaction. A bucket may go below zero: that reserves the next
+# token for this request. If the wait until then is at most
+# RATE_LIMIT_MAX_WAIT, the request sleeps and runs (a short queue). If it's
+# longer, nothing is taken and the request gets 429 with Retry-After.
+#
+# The async handlers in asgi.py call admit() and await the wait instead of
+# sleeping in check().
+#
+# If the bucket file cannot be used (locked past its timeout, disk full)
+# requests are let through and a warning is logged: a broken limiter must
+# not take the app down with it.
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from flask import jsonify, render_template, request, session
+
+Limit = namedtuple('Limit', 'rate burst')  # tokens per second, bucket size
+RouteLimit = namedtuple('RouteLimit', 'methods client route')
+
+LIMITS = {
+    'login': RouteLimit(('POST',), Limit(10 / 60, 5), Limit(20, 40)),
+    'register': RouteLimit(('POST',), Limit(3 / 60, 3), Limit(5, 10)),
+    'upload_bill_image': RouteLimit(('POST',), Limit(10 / 60, 5), Limit(2, 8)),
+    'receipt_review': RouteLimit(('POST',), Limit(2 / 60, 2), Limit(0.5, 4)),
+    'download_all_bills': RouteLimit(('GET',), Limit(6 / 60, 3), Limit(2, 6)),
+    'download_bills_range': RouteLimit(('POST',), Limit(6 / 60, 3), Limit(2, 6)),
+    'download_friend_bills': RouteLimit(('POST',), Limit(6 / 60, 3), Limit(2, 6)),
+    'export_columnar': RouteLimit(('GET',), Limit(6 / 60, 3), Limit(2, 6)),
+}
+
+PRUNE_EVERY = 600  # seconds between sweeps of idle buckets, per process
+PRUNE_IDLE = 86400  # a bucket untouched this long is full again anyway
+
+SCHEMA = 'CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+
+
+class BucketStore:
+    """Token buckets in a SQLite file shared by every worker on the host"""
+
+    def __init__(self, path, timeout=2.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._last_prune = 0.0
+
+    def _connection(self):
+        # One connection per thread, and a fresh one after a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def acquire(self, buckets, max_wait, now=None):
+        """Take a token from every (key, Limit) bucket, all or none
+
+        Returns (admitted, wait): admitted requests may run after sleeping
+        wait seconds; rejected ones can retry after wait seconds.
+        """
+        now = time.time() if now is None else now
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            keys = [key for key, _ in buckets]
+            stored = dict((key, (tokens, updated)) for key, tokens, updated in conn.execute(
+                f"SELECT key, tokens, updated FROM bucket WHERE key IN ({','.join('?' * len(keys))})", keys))
+            levels = []
+            wait = 0.0
+            for key, limit in buckets:
+                tokens, updated = stored.get(key, (limit.burst, now))
+                tokens = min(limit.burst, tokens + max(0.0, now - updated) * limit.rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / limit.rate)
+                levels.append((key, tokens - 1))
+            if wait > max_wait:
+                conn.execute('ROLLBACK')
+                return False, wait
+            conn.executemany('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                             [(key, tokens, now) for key, tokens in levels])
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        if now - self._last_prune > PRUNE_EVERY:
+            self._last_prune = now
+            conn.execute('DELETE FROM bucket WHERE updated < ?', (now - PRUNE_IDLE,))
+        return True, wait
+
+
+_store = None
+
+
+def _get_store():
+    global _store
+    from app import app
+
+    path = app.config['RATE_LIMIT_DB']
+    if _store is None or _store.path != path:
+        _store = BucketStore(path)
+    return _store
+
+
+def client_key():
+    user_id = session.get('user_id')
+    if user_id:
+        return f'user:{user_id}'
+    return f'ip:{request.remote_addr}'
+
+
+def _rejected(retry_after):
+    headers = {'Retry-After': str(retry_after)}
+    message = f'Too many requests. Please try again in {retry_after} seconds.'
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'error': message, 'retry_after': retry_after}), 429, headers
+    return render_template('rate_limited.html', message=message, retry_after=retry_after), 429, headers
+
+
+def admit():
+    """(rejection response or None, seconds to wait before running)"""
+    from app import app, log
+
+    limits = LIMITS.get(request.endpoint)
+    if limits is None or request.method not in limits.methods or not app.config['RATE_LIMIT_ENABLED']:
+        return None, 0
+    buckets = [(f'{client_key()}:{request.endpoint}', limits.client),
+               (f'route:{request.endpoint}', limits.route)]
+    try:
+        admitted, wait = _get_store().acquire(buckets, app.config['RATE_LIMIT_MAX_WAIT'])
+    except sqlite3.Error:
+        log.warning('Rate limiter unavailable, letting the request through', exc_info=True)
+        return None, 0
+    if not admitted:
+        retry_after = max(1, math.ceil(wait))
+        log.info('Rate limited', extra={'endpoint': request.endpoint, 'retry_after': retry_after})
+        return _rejected(retry_after), 0
+    return None, wait
+
+
+def check():
+    """before_request hook: wait for a token, or answer 429 if the wait is too long"""
+    rejected, wait = admit()
+    if wait > 0:
+        time.sleep(wait)
+    return rejected
+
+
+def install(app):
+    """Check LIMITS before every request (idempotent)"""
+    if check not in app.before_request_funcs.setdefault(None, []):
+        app.before_request(check)
@@ -0,0 +1,217 @@
+# receipts.py - Batch receipt upload, concurrent OCR and the review queue
+#
+# A batch upload saves every image and queues one ReceiptReview row per
+# file, then returns straight away. OCR and amount extraction run in a
+# per-process thread pool of OCR_BATCH_WORKERS threads, so a trip's worth
+# of receipts is scanned a few at a time without tying up the request or
+# overrunning the OCR connection pool. Each scan fills in its row and
+# moves it from 'scanning' to 'pending'. The review page refreshes itself
+# until nothing is scanning.
+#
+# Reviewed receipts are confirmed in bulk. Every selected row is validated
+# like a single OCR bill (app.build_ocr_bill), and the valid ones become
+# bills in one transaction. Rows that fail validation stay pending, with
+# the values the user typed and the reason.
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import line_items
+import ocr_client
+
+STALE_AFTER = timedelta(minutes=10)
+MIN_TEXT_LENGTH = 10
+
+# Review form fields, also the editable ReceiptReview columns
+FIELDS = ('restaurant_name', 'visit_date', 'base_amount', 'discount_amount',
+          'service_charge', 'tax_amount', 'total_amount')
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        from app import app
+        _executor = ThreadPoolExecutor(max_workers=app.config['OCR_BATCH_WORKERS'],
+                                       thread_name_prefix='receipt-ocr')
+    return _executor
+
+
+def scan(content, filename):
+    """(text, amounts, line items, error) for one receipt image"""
+    from app import extract_amounts_from_text, ocr_space_bytes
+
+    try:
+        result = ocr_space_bytes(content, filename, overlay=True, language='eng')
+    except ocr_client.CircuitOpenError:
+        return '', None, [], 'Bill scanning is temporarily unavailable'
+    except ocr_client.OCRError:
+        return '', None, [], 'The OCR service is not responding'
+    if result.get('IsErroredOnProcessing'):
+        return '', None, [], 'OCR processing failed'
+
+    parsed_results = result.get('ParsedResults') or []
+    text = parsed_results[0].get('ParsedText', '') if parsed_results else ''
+    if len(text.strip()) < MIN_TEXT_LENGTH:
+        return text, None, [], 'Very little text extracted'
+    return text, extract_amounts_from_text(text), line_items.extract_line_items(result), None
+
+
+def guess_restaurant(text):
+    """First line with letters in it: receipts usually open with the name"""
+    for line in text.splitlines():
+        line = line.strip()
+        if sum(ch.isalpha() for ch in line) >= 3:
+            return line[:200]
+    return ''
+
+
+def start_batch(user_id, files):
+    """Save the uploaded images, queue them for OCR and return the batch id"""
+    from app import app, db, ReceiptReview, allowed_file
+    from werkzeug.utils import secure_filename
+
+    batch_id = uuid.uuid4().hex
+    reviews = []
+    for file in files:
+        if not file or not file.filename or not allowed_file(file.filename):
+            continue
+        # Prefixed so receipts from different batches can share a name
+        filename = f'{batch_id[:8]}_{len(reviews)}_{secure_filename(file.filename)}'
+        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        reviews.append(ReceiptReview(
+            user_id=user_id, batch_id=batch_id, image_filename=filename,
+            original_filename=file.filename[:300], status='scanning', visit_date=date.today(),
+        ))
+    if not reviews:
+        return None, 0
+    db.session.add_all(reviews)
+    db.session.commit()
+
+    executor = _get_executor()
+    for review in reviews:
+        executor.submit(_scan_job, review.id)
+    return batch_id, len(reviews)
+
+
+def _scan_job(review_id):
+    from app import app, db, ReceiptReview
+
+    with app.app_context():
+        review = db.session.get(ReceiptReview, review_id)
+        if review is None or review.status != 'scanning':
+            return
+        try:
+            with open(os.path.join(app.config['UPLOAD_FOLDER'], review.image_filename), 'rb') as f:
+                text, amounts, items, error = scan(f.read(), review.image_filename)
+        except Exception as e:
+            text, amounts, items, error = '', None, [], f'Could not scan: {e}'
+
+        review.extracted_text = text
+        review.error = error
+        review.restaurant_name = guess_restaurant(text)
+        review.line_items = json.dumps(line_items.to_json(items)) if items else None
+        if amounts:
+            review.base_amount = amounts['subtotal']
+            review.discount_amount = amounts['discount']
+            review.service_charge = amounts['service_charge']
+            review.tax_amount = amounts['tax']
+            review.total_amount = amounts['total']
+        review.status = 'pending'
+        review.scanned_at = datetime.utcnow()
+        db.session.commit()
+
+
+def review_queue(user_id, batch_id=None):
+    """Receipts still scanning or waiting for review, oldest first"""
+    from app import db, ReceiptReview
+
+    # A scan whose worker died is handed to the user as-is
+    ReceiptReview.query.filter(
+        ReceiptReview.user_id == user_id,
+        ReceiptReview.status == 'scanning',
+        ReceiptReview.created_at < datetime.utcnow() - STALE_AFTER,
+    ).update({ReceiptReview.status: 'pending', ReceiptReview.error: 'Scanning did not finish'},
+             synchronize_session=False)
+    db.session.commit()
+
+    query = ReceiptReview.query.filter(ReceiptReview.user_id == user_id,
+                                       ReceiptReview.status.in_(('scanning', 'pending')))
+    if batch_id:
+        query = query.filter(ReceiptReview.batch_id == batch_id)
+    return query.order_by(ReceiptReview.id).all()
+
+
+def _keep_edits(review, fields):
+    """Store what the user typed, so a row that fails validation keeps it"""
+    review.restaurant_name = (fields.get('restaurant_name') or '').strip()[:200]
+    try:
+        review.visit_date = datetime.strptime(fields.get('visit_date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        pass
+    for name in FIELDS[2:]:
+        try:
+            setattr(review, name, float(fields.get(name) or 0))
+        except ValueError:
+            pass
+
+
+def confirm(user_id, forms):
+    """forms: {review_id: {field: value}}; returns (bills created, {review_id: error})"""
+    from app import db, ReceiptReview, build_ocr_bill
+    import rollups
+
+    reviews = ReceiptReview.query.filter(
+        ReceiptReview.user_id == user_id,
+        ReceiptReview.id.in_(list(forms)),
+        ReceiptReview.status == 'pending',
+    ).all() if forms else []
+
+    created, errors = [], {}
+    for review in reviews:
+        fields = forms[review.id]
+        _keep_edits(review, fields)
+        try:
+            bill = build_ocr_bill(user_id, dict(fields, image_filename=review.image_filename,
+                                                line_items=review.line_items))
+        except ValueError as e:
+            review.error = errors[review.id] = str(e)
+            continue
+        db.session.add(bill)
+        created.append((review, bill))
+
+    try:
+        db.session.flush()
+        batch = rollups.RollupBatch()
+        for review, bill in created:
+            batch.add_bill(bill)
+            review.status = 'confirmed'
+            review.bill_id = bill.id
+            review.error = None
+        batch.flush()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(created), errors
+
+
+def discard(user_id, review_ids):
+    """Drop receipts from the queue along with their images"""
+    from app import app, db, ReceiptReview
+
+    reviews = ReceiptReview.query.filter(
+        ReceiptReview.user_id == user_id,
+        ReceiptReview.id.in_(review_ids),
+        ReceiptReview.status.in_(('scanning', 'pending')),
+    ).all() if review_ids else []
+    for review in reviews:
+        path = os.path.join(app.config['UPLOAD_FOLDER'], review.image_filename)
+        if os.path.exists(path):
+            os.remove(path)
+        db.session.delete(review)
+    db.session.commit()
+    return len(reviews)
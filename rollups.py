@@ -0,0 +1,406 @@
+# rollups.py - Pre-aggregated spending rollups
+#
+# Spend is kept per user in day and month buckets for three dimensions:
+#   restaurant - bill totals per restaurant
+#   friend     - share totals per friend
+#   category   - base / discount / service / tax per bill
+#
+# Bill and share writes call record_bill / record_shares (and the remove_*
+# variants) in the same transaction, so the analytics views never have to
+# touch the raw Bill and BillShare tables. rebuild() recomputes everything
+# from scratch and is exposed as `flask backfill-rollups`.
+#
+# Buckets are also keyed by the bill's currency, so amounts in different
+# currencies are never added together. spending_series() converts them
+# into REPORTING_CURRENCY as it reads (see fx.py): day buckets at their
+# day's rates, month buckets at the rates on the first of the month.
+from collections import defaultdict
+from datetime import datetime
+
+import archive
+import fx
+
+GRAINS = ('day', 'month')
+DIMENSIONS = ('restaurant', 'friend', 'category')
+CATEGORIES = ('base', 'discount', 'service', 'tax')
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def period_start(visit_date, grain):
+    """First day of the bucket that visit_date falls into"""
+    visit_date = _as_date(visit_date)
+    if grain == 'month':
+        return visit_date.replace(day=1)
+    return visit_date
+
+
+def restaurant_key(name):
+    return ' '.join((name or '').lower().split())
+
+
+def _currency(bill):
+    # Before a flush a new bill may not have its column default yet
+    from app import app
+    return bill.currency or app.config['DEFAULT_CURRENCY']
+
+
+def _bump(bucket, label, amount, count):
+    """Add amount/count to one bucket, creating it if needed"""
+    from app import db, SpendRollup
+    from sqlalchemy.exc import IntegrityError
+
+    # Increment in SQL so concurrent writers never lose an update
+    updated = SpendRollup.query.filter_by(**bucket).update({
+        SpendRollup.amount: SpendRollup.amount + amount,
+        SpendRollup.entry_count: SpendRollup.entry_count + count,
+        SpendRollup.label: label,
+    }, synchronize_session=False)
+    if updated:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(SpendRollup(label=label, amount=amount, entry_count=count, **bucket))
+    except IntegrityError:
+        # Another worker created the bucket first - fall back to increment
+        SpendRollup.query.filter_by(**bucket).update({
+            SpendRollup.amount: SpendRollup.amount + amount,
+            SpendRollup.entry_count: SpendRollup.entry_count + count,
+        }, synchronize_session=False)
+
+
+def _bill_amounts(bill):
+    return {
+        'base': bill.base_amount or 0.0,
+        'discount': bill.discount_amount or 0.0,
+        'service': bill.service_charge or 0.0,
+        'tax': bill.tax_amount or 0.0,
+    }
+
+
+class RollupBatch:
+    """Collects rollup deltas for many bills/shares and applies them per bucket
+
+    Bulk writers (imports, batch confirms) add everything they insert in a
+    transaction and call flush() once, so N bills on the same day cost one
+    bucket update instead of N.
+    """
+
+    def __init__(self):
+        self._deltas = defaultdict(lambda: [0.0, 0, ''])
+
+    def _add(self, user_id, visit_date, currency, dimension, key, label, amount, count):
+        for grain in GRAINS:
+            delta = self._deltas[(user_id, grain, period_start(visit_date, grain), currency, dimension, str(key))]
+            delta[0] += amount
+            delta[1] += count
+            delta[2] = label
+
+    def add_bill(self, bill, sign=1):
+        self.add_bill_totals(bill.user_id, bill.visit_date, _currency(bill), bill.restaurant_name,
+                             sign * (bill.total_amount or 0.0),
+                             [sign * amount for amount in _bill_amounts(bill).values()], sign)
+
+    def add_bill_totals(self, user_id, visit_date, currency, restaurant_name, total, amounts, count):
+        """amounts are the base / discount / service / tax sums, in CATEGORIES order"""
+        self._add(user_id, visit_date, currency, 'restaurant', restaurant_key(restaurant_name), restaurant_name,
+                  total or 0.0, count)
+        for category, amount in zip(CATEGORIES, amounts):
+            self._add(user_id, visit_date, currency, 'category', category, category, amount or 0.0, count)
+
+    def add_shares(self, bill, shares, sign=1):
+        """shares is an iterable of (friend_id, friend_name, total_share) tuples"""
+        for friend_id, friend_name, total_share in shares:
+            self._add(bill.user_id, bill.visit_date, _currency(bill), 'friend', friend_id, friend_name,
+                      sign * (total_share or 0.0), sign)
+
+    def add_friend_total(self, user_id, visit_date, currency, friend_id, friend_name, amount, count):
+        self._add(user_id, visit_date, currency, 'friend', friend_id, friend_name, amount, count)
+
+    def flush(self):
+        """Apply all deltas: one lookup, one executemany UPDATE, one bulk INSERT"""
+        from app import db, SpendRollup
+        from sqlalchemy import bindparam
+        from sqlalchemy.exc import IntegrityError
+
+        deltas = {key: delta for key, delta in self._deltas.items() if delta[0] or delta[1]}
+        self._deltas.clear()
+        if not deltas:
+            return
+
+        user_ids = {key[0] for key in deltas}
+        periods = [key[2] for key in deltas]
+        table = SpendRollup.__table__
+        existing = {}
+        rows = db.session.execute(db.select(
+            table.c.id, table.c.user_id, table.c.grain, table.c.period_start,
+            table.c.currency, table.c.dimension, table.c.dim_key,
+        ).where(
+            table.c.user_id.in_(user_ids),
+            table.c.period_start.between(min(periods), max(periods)),
+        ))
+        for row_id, *key in rows:
+            existing[tuple(key)] = row_id
+
+        updates, inserts = [], []
+        for key, (amount, count, label) in deltas.items():
+            if key in existing:
+                updates.append({'row_id': existing[key], 'delta_amount': amount,
+                                'delta_count': count, 'new_label': label})
+            else:
+                user_id, grain, start, currency, dimension, dim_key = key
+                inserts.append(dict(user_id=user_id, grain=grain, period_start=start, currency=currency,
+                                    dimension=dimension, dim_key=dim_key, label=label, amount=amount,
+                                    entry_count=count))
+
+        if updates:
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('row_id')).values(
+                    amount=table.c.amount + bindparam('delta_amount'),
+                    entry_count=table.c.entry_count + bindparam('delta_count'),
+                    label=bindparam('new_label'),
+                ), updates)
+        if inserts:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert(), inserts)
+            except IntegrityError:
+                # Raced with another writer - apply the new buckets one by one
+                for row in inserts:
+                    bucket = {k: row[k] for k in ('user_id', 'grain', 'period_start', 'currency', 'dimension', 'dim_key')}
+                    _bump(bucket, row['label'], row['amount'], row['entry_count'])
+
+
+def record_bill(bill, sign=1):
+    """Apply a new (sign=1) or removed (sign=-1) bill to the rollups"""
+    batch = RollupBatch()
+    batch.add_bill(bill, sign)
+    batch.flush()
+
+
+def record_shares(bill, shares, sign=1):
+    """Apply shares of one bill to the per-friend rollups
+
+    shares is an iterable of (friend_id, friend_name, total_share) tuples.
+    Shares are summed per friend first so each friend costs one write.
+    """
+    batch = RollupBatch()
+    batch.add_shares(bill, shares, sign)
+    batch.flush()
+
+
+def _bill_groups(*criteria):
+    """Bill sums per (user, visit day, currency, restaurant): total, base, discount, service, tax, count"""
+    from app import db, Bill
+
+    return db.session.query(
+        Bill.user_id, Bill.visit_date, Bill.currency, Bill.restaurant_name,
+        db.func.sum(Bill.total_amount),
+        db.func.sum(Bill.base_amount),
+        db.func.sum(Bill.discount_amount),
+        db.func.sum(Bill.service_charge),
+        db.func.sum(Bill.tax_amount),
+        db.func.count(Bill.id),
+    ).filter(*criteria).group_by(Bill.user_id, Bill.visit_date, Bill.currency, Bill.restaurant_name)
+
+
+def _share_groups(*criteria):
+    """Share sums per (user, visit day, currency, friend); criteria may use Bill columns"""
+    from app import db, Bill, BillShare, Friend
+
+    return db.session.query(
+        Bill.user_id, Bill.visit_date, Bill.currency, BillShare.friend_id, Friend.name,
+        db.func.sum(BillShare.total_share),
+        db.func.count(BillShare.id),
+    ).join(Bill, Bill.id == BillShare.bill_id).join(
+        Friend, Friend.id == BillShare.friend_id
+    ).filter(*criteria).group_by(Bill.user_id, Bill.visit_date, Bill.currency, BillShare.friend_id, Friend.name)
+
+
+def remove_bills(*criteria):
+    """Take the bills matching criteria, and all of their shares, out of the rollups"""
+    batch = RollupBatch()
+    for user_id, visit_date, currency, name, total, *amounts, count in _bill_groups(*criteria):
+        batch.add_bill_totals(user_id, visit_date, currency, name, -(total or 0.0),
+                              [-(amount or 0.0) for amount in amounts], -count)
+    for user_id, visit_date, currency, friend_id, friend_name, amount, count in _share_groups(*criteria):
+        batch.add_friend_total(user_id, visit_date, currency, friend_id, friend_name, -(amount or 0.0), -count)
+    batch.flush()
+
+
+def remove_shares(*criteria, amounts=True):
+    """Take the shares matching criteria (but not their bills) out of the rollups
+
+    amounts=False takes off only their counts, for shares whose amounts were
+    folded into another share of the same bill and friend.
+    """
+    batch = RollupBatch()
+    for user_id, visit_date, currency, friend_id, friend_name, amount, count in _share_groups(*criteria):
+        batch.add_friend_total(user_id, visit_date, currency, friend_id, friend_name,
+                               -(amount or 0.0) if amounts else 0.0, -count)
+    batch.flush()
+
+
+def remove_friend_shares(friends):
+    """Take every share of these friends out of the rollups"""
+    from app import BillShare
+
+    names = {friend.id: friend.name for friend in friends}
+    friend_ids = list(names)
+    batch = RollupBatch()
+    shares = _share_groups(BillShare.friend_id.in_(friend_ids))
+    for user_id, visit_date, currency, friend_id, _, amount, count in shares:
+        batch.add_friend_total(user_id, visit_date, currency, friend_id, names[friend_id], -(amount or 0.0), -count)
+    for user_id, visit_date, currency, friend_id, amount, count in archive.friend_share_totals(friend_ids):
+        batch.add_friend_total(user_id, visit_date, currency, friend_id, names[friend_id], -(amount or 0.0), -count)
+    batch.flush()
+
+
+def rebuild(user_id=None):
+    """Recompute rollups from Bill and BillShare (all users or just one)
+
+    Raw rows are grouped per visit day in SQL and only the resulting
+    buckets are held in memory, so the cost is bounded by the number of
+    buckets rather than the number of bills.
+    """
+    from app import db, ArchivedBill, ArchivedBillShare, Bill, Friend, SpendRollup
+
+    buckets = defaultdict(lambda: [0.0, 0, ''])
+
+    def add(uid, visit_date, currency, dimension, key, label, amount, count):
+        for grain in GRAINS:
+            bucket = buckets[(uid, grain, period_start(visit_date, grain), currency, dimension, str(key))]
+            bucket[0] += amount or 0.0
+            bucket[1] += count
+            bucket[2] = label
+
+    scope = [Bill.user_id == user_id] if user_id is not None else []
+    for uid, visit_date, currency, name, total, base, discount, service, tax, count in _bill_groups(*scope):
+        add(uid, visit_date, currency, 'restaurant', restaurant_key(name), name, total, count)
+        for category, amount in zip(CATEGORIES, (base, discount, service, tax)):
+            add(uid, visit_date, currency, 'category', category, category, amount, count)
+
+    for uid, visit_date, currency, friend_id, friend_name, amount, count in _share_groups(*scope):
+        add(uid, visit_date, currency, 'friend', friend_id, friend_name, amount, count)
+
+    # Archived bills still count towards spending
+    archived_bill_rows = db.session.query(
+        ArchivedBill.user_id, ArchivedBill.visit_date, ArchivedBill.currency, ArchivedBill.restaurant_name,
+        db.func.sum(ArchivedBill.total_amount),
+        db.func.sum(ArchivedBill.base_amount),
+        db.func.sum(ArchivedBill.discount_amount),
+        db.func.sum(ArchivedBill.service_charge),
+        db.func.sum(ArchivedBill.tax_amount),
+        db.func.count(ArchivedBill.id),
+    ).group_by(ArchivedBill.user_id, ArchivedBill.visit_date, ArchivedBill.currency, ArchivedBill.restaurant_name)
+    if user_id is not None:
+        archived_bill_rows = archived_bill_rows.filter(ArchivedBill.user_id == user_id)
+    archived_share_rows = archive.share_totals(
+        *([ArchivedBillShare.user_id == user_id] if user_id is not None else []))
+
+    for uid, visit_date, currency, name, total, base, discount, service, tax, count in archived_bill_rows:
+        add(uid, visit_date, currency, 'restaurant', restaurant_key(name), name, total, count)
+        for category, amount in zip(CATEGORIES, (base, discount, service, tax)):
+            add(uid, visit_date, currency, 'category', category, category, amount, count)
+
+    # The archive may be another database, so friend names are looked up separately
+    archived_share_rows = archived_share_rows.all()
+    friend_ids = {row[3] for row in archived_share_rows}
+    names = dict(db.session.query(Friend.id, Friend.name).filter(Friend.id.in_(friend_ids))) if friend_ids else {}
+    for uid, visit_date, currency, friend_id, amount, count in archived_share_rows:
+        if friend_id in names:
+            add(uid, visit_date, currency, 'friend', friend_id, names[friend_id], amount, count)
+
+    delete = SpendRollup.query
+    if user_id is not None:
+        delete = delete.filter(SpendRollup.user_id == user_id)
+    delete.delete(synchronize_session=False)
+
+    rows = [
+        dict(user_id=uid, grain=grain, period_start=start, currency=currency, dimension=dimension,
+             dim_key=key, label=label, amount=amount, entry_count=count)
+        for (uid, grain, start, currency, dimension, key), (amount, count, label) in buckets.items()
+    ]
+    for i in range(0, len(rows), BACKFILL_CHUNK_SIZE):
+        db.session.execute(SpendRollup.__table__.insert(), rows[i:i + BACKFILL_CHUNK_SIZE])
+    db.session.commit()
+    return len(rows)
+
+
+def _parse_period(value, grain):
+    if not value:
+        return None
+    fmt = '%Y-%m' if grain == 'month' and len(value) == 7 else '%Y-%m-%d'
+    return period_start(datetime.strptime(value, fmt).date(), grain)
+
+
+def spending_series(user_id, dimension, grain='month', start=None, end=None, top=8):
+    """Time series for one dimension, read only from the rollup table
+
+    Returns the `top` keys by total amount in the window, each with one
+    point per period that has spend, in REPORTING_CURRENCY. Buckets in a
+    currency without a rate are left out and listed under 'missing'.
+    """
+    from app import db, SpendRollup
+
+    if dimension not in DIMENSIONS:
+        raise ValueError(f'Unknown dimension: {dimension}')
+    if grain not in GRAINS:
+        raise ValueError(f'Unknown grain: {grain}')
+
+    filters = [
+        SpendRollup.user_id == user_id,
+        SpendRollup.grain == grain,
+        SpendRollup.dimension == dimension,
+        SpendRollup.entry_count != 0,
+    ]
+    start_date = _parse_period(start, grain)
+    end_date = _parse_period(end, grain)
+    if start_date:
+        filters.append(SpendRollup.period_start >= start_date)
+    if end_date:
+        filters.append(SpendRollup.period_start <= end_date)
+
+    # Keys are ranked after conversion, so every bucket in the window is read
+    rows = db.session.query(
+        SpendRollup.dim_key, SpendRollup.label, SpendRollup.period_start, SpendRollup.currency,
+        SpendRollup.amount, SpendRollup.entry_count,
+    ).filter(*filters).order_by(SpendRollup.period_start)
+    converter = fx.Converter()
+    labels, totals = {}, defaultdict(float)
+    points = defaultdict(dict)  # key -> {period: [amount, count]}
+    for key, label, start_day, currency, amount, count in rows:
+        amount = converter.convert(amount, currency, start_day)
+        if amount is None:
+            continue
+        labels[key] = label or key
+        totals[key] += amount
+        point = points[key].setdefault(start_day, [0.0, 0])
+        point[0] += amount
+        point[1] += count
+    top_keys = sorted(totals, key=totals.get, reverse=True)[:top]
+
+    fmt = '%Y-%m' if grain == 'month' else '%Y-%m-%d'
+    periods = sorted({day for key in top_keys for day in points[key]})
+    series = [{
+        'key': key,
+        'label': labels[key],
+        'total': round(totals[key], 2),
+        'points': [{'period': day.strftime(fmt), 'amount': round(amount, 2), 'count': count}
+                   for day, (amount, count) in sorted(points[key].items())],
+    } for key in top_keys]
+
+    return {
+        'dimension': dimension,
+        'grain': grain,
+        'currency': converter.target,
+        'missing': sorted(converter.missing),
+        'periods': [p.strftime(fmt) for p in periods],
+        'series': series,
+    }
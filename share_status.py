@@ -0,0 +1,184 @@
+# share_status.py - Per-bill split totals kept on the bill row
+#
+# Bill.share_count, Bill.shared_amount and Bill.unassigned_amount
+# (total_amount + discount_amount - shared_amount: shares are split from
+# item prices, before the discount) are kept up to date by every write that
+# adds or removes shares, in the same transaction. That lets the bills list
+# and the dashboard show split status and filter unsettled bills without
+# joining BillShare. Changes are applied as relative UPDATEs
+# (shared_amount = shared_amount + :delta), so concurrent writers don't
+# lose each other's updates. rebuild() recomputes everything from BillShare.
+from collections import defaultdict, namedtuple
+
+import sync
+
+# Differences below a cent are rounding, not money left to assign
+TOLERANCE = 0.01
+
+STATUSES = ('unshared', 'partial', 'settled', 'over')
+
+Split = namedtuple('Split', 'food_amount tax_share service_charge_share total_share')
+
+
+def status(share_count, unassigned_amount):
+    if not share_count:
+        return 'unshared'
+    if unassigned_amount > TOLERANCE:
+        return 'partial'
+    if unassigned_amount < -TOLERANCE:
+        return 'over'
+    return 'settled'
+
+
+def split(tax_amount, service_charge, food_amounts, people=None):
+    """Each person's Split: their food plus an even part of tax and service charge
+
+    The extras are divided among `people` (default: one per food amount).
+    """
+    people = len(food_amounts) if people is None else people
+    tax_share = tax_amount / people if people and tax_amount > 0 else 0
+    service_charge_share = service_charge / people if people and service_charge > 0 else 0
+    return [Split(food_amount, tax_share, service_charge_share, food_amount + tax_share + service_charge_share)
+            for food_amount in food_amounts]
+
+
+def status_filter(name):
+    """SQL condition on Bill matching one status"""
+    from app import Bill
+
+    if name == 'unsettled':
+        return Bill.unassigned_amount > TOLERANCE
+    if name == 'unshared':
+        return Bill.share_count == 0
+    if name == 'partial':
+        return (Bill.share_count > 0) & (Bill.unassigned_amount > TOLERANCE)
+    if name == 'settled':
+        return (Bill.share_count > 0) & Bill.unassigned_amount.between(-TOLERANCE, TOLERANCE)
+    if name == 'over':
+        return Bill.unassigned_amount < -TOLERANCE
+    return None
+
+
+def to_assign(total_amount, discount_amount):
+    """What a bill's shares add up to once fully split"""
+    return total_amount + (discount_amount or 0.0)
+
+
+def _to_assign_column(table):
+    from app import db
+
+    return table.c.total_amount + db.func.coalesce(table.c.discount_amount, 0.0)
+
+
+def initial(bill, shares=()):
+    """Set the totals on a bill that is about to be inserted with its shares"""
+    bill.share_count = len(shares)
+    bill.shared_amount = sum(share.total_share for share in shares)
+    bill.unassigned_amount = to_assign(bill.total_amount, bill.discount_amount) - bill.shared_amount
+
+
+def apply(deltas):
+    """deltas: {bill_id: (share count change, amount change)}, one executemany"""
+    from sqlalchemy import bindparam
+    from app import db, Bill
+
+    rows = [
+        {'target_id': bill_id, 'delta_count': count, 'delta_amount': amount}
+        for bill_id, (count, amount) in deltas.items()
+        if count or amount
+    ]
+    if not rows:
+        return
+    table = Bill.__table__
+    db.session.execute(
+        table.update().where(table.c.id == bindparam('target_id')).values(
+            share_count=table.c.share_count + bindparam('delta_count'),
+            shared_amount=table.c.shared_amount + bindparam('delta_amount'),
+            # SET expressions see the old row, so add the delta here too
+            unassigned_amount=_to_assign_column(table) - table.c.shared_amount - bindparam('delta_amount'),
+        ),
+        rows,
+    )
+    sync.log_ids(Bill, [row['target_id'] for row in rows])
+
+
+def add_shares(bill_id, amounts):
+    apply({bill_id: (len(amounts), sum(amounts))})
+
+
+def remove_shares(*criteria, amounts=True):
+    """Take the shares matching criteria off their bills' totals (before deleting them)
+
+    amounts=False takes off only their count, for shares whose amounts were
+    folded into another share of the same bill.
+    """
+    from app import db, BillShare
+
+    rows = db.session.query(
+        BillShare.bill_id, db.func.count(BillShare.id), db.func.sum(BillShare.total_share)
+    ).filter(*criteria).group_by(BillShare.bill_id)
+    apply({bill_id: (-count, -(amount or 0.0) if amounts else 0.0) for bill_id, count, amount in rows})
+
+
+def remove_friends(friend_ids):
+    """Take these friends' shares off their bills' totals (before deleting them)"""
+    from app import BillShare
+
+    remove_shares(BillShare.friend_id.in_(friend_ids))
+
+
+def rebuild(user_id=None):
+    """Recompute the totals of every bill (or one user's) from BillShare"""
+    from sqlalchemy import true
+    from app import db, Bill, BillShare
+
+    totals = db.session.query(
+        BillShare.bill_id, db.func.count(BillShare.id), db.func.sum(BillShare.total_share)
+    ).group_by(BillShare.bill_id)
+    bills = db.session.query(Bill.id, Bill.share_count, Bill.shared_amount)
+    if user_id is not None:
+        totals = totals.join(Bill, Bill.id == BillShare.bill_id).filter(Bill.user_id == user_id)
+        bills = bills.filter(Bill.user_id == user_id)
+
+    target = defaultdict(lambda: (0, 0.0))
+    target.update((bill_id, (count, amount or 0.0)) for bill_id, count, amount in totals)
+
+    # Only bills whose stored totals are off get an UPDATE
+    deltas = {}
+    for bill_id, share_count, shared_amount in bills:
+        count, amount = target[bill_id]
+        share_count, shared_amount = share_count or 0, shared_amount or 0.0
+        if count != share_count or abs(amount - shared_amount) > 1e-9:
+            deltas[bill_id] = (count - share_count, amount - shared_amount)
+
+    table = Bill.__table__
+    scope = table.c.user_id == user_id if user_id is not None else true()
+    db.session.execute(table.update().where(
+        scope & (table.c.share_count.is_(None) | table.c.shared_amount.is_(None))
+    ).values(
+        share_count=db.func.coalesce(table.c.share_count, 0),
+        shared_amount=db.func.coalesce(table.c.shared_amount, 0.0),
+    ))
+    apply(deltas)
+    db.session.execute(table.update().where(scope).values(
+        unassigned_amount=_to_assign_column(table) - table.c.shared_amount))
+    db.session.commit()
+    return len(deltas)
+
+
+def correct_discounted():
+    """Fix unassigned_amount on discounted bills stored before it counted the discount
+
+    One UPDATE of just the rows that are off, so after the first run it
+    changes nothing. Returns the bills corrected (commits).
+    """
+    from app import db, Bill
+
+    table = Bill.__table__
+    expected = _to_assign_column(table) - table.c.shared_amount
+    corrected = db.session.execute(table.update().where(
+        db.func.coalesce(table.c.discount_amount, 0.0) != 0,
+        db.func.abs(table.c.unassigned_amount - expected) > 1e-9,
+    ).values(unassigned_amount=expected)).rowcount
+    db.session.commit()
+    return corrected
@@ -0,0 +1,166 @@
+# share_writes.py - Share writes keyed by (bill, friend, food item)
+#
+# bill_share has a unique index on (bill_id, friend_id, food_item), and
+# every share write goes through upsert(): INSERT ... ON CONFLICT DO UPDATE
+# on that key. Submitting the same split again - a resubmitted form, a
+# retried request, a re-imported CSV - replaces a bill's rows instead of
+# adding a second set. Rows matching what is stored are not written at
+# all, so an exact retry costs one SELECT. Rollups, the bill's split totals
+# and the sync log move by the difference between the old and new rows.
+#
+# Rows with the same key in one submission are merged, amounts summed.
+# initialize_database() creates the index but refuses while duplicates
+# written before it existed remain, and logs an error. `flask
+# dedupe-bill-shares` folds them: each key's rows are summed into its newest
+# row and the rest deleted, so bill totals and rollups keep their amounts.
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import and_, exists, inspect, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import aliased
+
+import rollups
+import share_status
+import sync
+
+AMOUNTS = ('food_amount', 'tax_share', 'service_charge_share', 'total_share')
+KEY = ('bill_id', 'friend_id', 'food_item')
+UNIQUE_INDEX = 'uq_bill_share_item'
+# Amounts read back from a CSV are rounded to the cent
+ROUNDING = 0.005
+
+
+def merge(rows):
+    """One row per (friend_id, food_item), amounts summed, in first-seen order"""
+    merged = OrderedDict()
+    for row in rows:
+        key = (int(row['friend_id']), row['food_item'])
+        if key in merged:
+            for name in AMOUNTS:
+                merged[key][name] += row.get(name) or 0.0
+        else:
+            merged[key] = {'friend_id': key[0], 'food_item': key[1],
+                           **{name: row.get(name) or 0.0 for name in AMOUNTS}}
+    return list(merged.values())
+
+
+def _insert(table):
+    from app import db
+
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(table)
+
+
+def _differs(stored, row):
+    """New, or an amount off by more than rounding"""
+    return stored is None or any(abs((old or 0.0) - row[name]) > ROUNDING
+                                 for old, name in zip(stored, AMOUNTS))
+
+
+def upsert(bill, rows, names, batch=None, deltas=None):
+    """Write one bill's shares by (friend, food item); returns (inserted, updated)
+
+    rows are dicts with friend_id, food_item and AMOUNTS; names maps
+    friend_id to the name the rollups show. Bulk writers pass their
+    RollupBatch and {bill_id: (count, amount)} deltas and apply them once;
+    otherwise they are applied here. Does not commit.
+    """
+    from app import db, BillShare
+
+    rows = merge(rows)
+    if not rows:
+        return 0, 0
+    key_columns = tuple_(BillShare.friend_id, BillShare.food_item)
+    stored = {
+        (friend_id, food_item): amounts
+        for friend_id, food_item, *amounts in db.session.execute(
+            select(BillShare.friend_id, BillShare.food_item, *(getattr(BillShare, name) for name in AMOUNTS))
+            .where(BillShare.bill_id == bill.id,
+                   key_columns.in_([(row['friend_id'], row['food_item']) for row in rows])))
+    }
+    changed = [row for row in rows if _differs(stored.get((row['friend_id'], row['food_item'])), row)]
+    if not changed:
+        return 0, 0
+
+    replaced = [(row['friend_id'], stored[(row['friend_id'], row['food_item'])][-1] or 0.0)
+                for row in changed if (row['friend_id'], row['food_item']) in stored]
+    inserted = len(changed) - len(replaced)
+    own_batch = batch is None
+    batch = rollups.RollupBatch() if own_batch else batch
+    batch.add_shares(bill, [(friend_id, names.get(friend_id, ''), total) for friend_id, total in replaced], -1)
+    batch.add_shares(bill, [(row['friend_id'], names.get(row['friend_id'], ''), row['total_share'])
+                            for row in changed])
+    delta = (inserted, sum(row['total_share'] for row in changed) - sum(total for _, total in replaced))
+
+    table = BillShare.__table__
+    now = datetime.utcnow()
+    statement = _insert(table).values([dict(row, bill_id=bill.id, shared_at=now) for row in changed])
+    statement = statement.on_conflict_do_update(
+        index_elements=list(KEY),
+        set_={name: statement.excluded[name] for name in AMOUNTS + ('shared_at',)})
+    db.session.execute(statement)
+    sync.log_where(BillShare, and_(BillShare.bill_id == bill.id, key_columns.in_(
+        [(row['friend_id'], row['food_item']) for row in changed])))
+
+    if deltas is None:
+        share_status.apply({bill.id: delta})
+    else:
+        count, amount = deltas.get(bill.id, (0, 0.0))
+        deltas[bill.id] = (count + delta[0], amount + delta[1])
+    if own_batch:
+        batch.flush()
+    return inserted, len(replaced)
+
+
+def _same_key(other):
+    from app import BillShare
+
+    return and_(other.bill_id == BillShare.bill_id, other.friend_id == BillShare.friend_id,
+                other.food_item == BillShare.food_item)
+
+
+def duplicate_condition():
+    """Shares with a newer row for the same bill, friend and food item"""
+    from app import BillShare
+
+    newer = aliased(BillShare)
+    return exists().where(_same_key(newer), newer.id > BillShare.id)
+
+
+def dedupe():
+    """Fold each key's duplicate shares into its newest row, amounts summed; returns rows removed (commits)"""
+    from app import db, BillShare
+
+    dropped = duplicate_condition()
+    removed = BillShare.query.filter(dropped).count()
+    if removed:
+        older, other = aliased(BillShare), aliased(BillShare)
+        kept = and_(~dropped, exists().where(_same_key(older), older.id < BillShare.id))
+        # The amounts stay with the same bill and friend, only the counts drop
+        rollups.remove_shares(dropped, amounts=False)
+        share_status.remove_shares(dropped, amounts=False)
+        sync.log_where(BillShare, kept)
+        BillShare.query.filter(kept).update({
+            getattr(BillShare, name): select(db.func.sum(getattr(other, name))).where(_same_key(other)).scalar_subquery()
+            for name in AMOUNTS
+        }, synchronize_session=False)
+        sync.log_where(BillShare, dropped, sync.DELETE)
+        BillShare.query.filter(dropped).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+def ensure_unique_index():
+    """Create the unique share index if it is missing; returns the duplicate shares blocking it
+
+    Nothing is deleted here: `flask dedupe-bill-shares` folds duplicates.
+    """
+    from app import db, BillShare
+
+    if any(index['name'] == UNIQUE_INDEX for index in inspect(db.engine).get_indexes(BillShare.__tablename__)):
+        return 0
+    blocking = BillShare.query.filter(duplicate_condition()).count()
+    if not blocking:
+        next(index for index in BillShare.__table__.indexes if index.name == UNIQUE_INDEX).create(db.engine)
+    return blocking
@@ -0,0 +1,252 @@
+# statements.py - Month-end statements for every friend of every user
+#
+#   flask generate-statements --month 2025-03 [--workers 4]
+#
+# Builds one statement per friend with shares in the period, as a CSV (the
+# same rows as download_friend_bills) and a PDF, for all users. Each user
+# is one task in a process pool, so the CSV formatting, currency conversion
+# and PDF layout use every core. A worker reads all of its user's shares in
+# the period in one pass, sorted by friend (hot and archive tables merged),
+# and cuts it into statements, instead of querying once per friend.
+#
+# The parent writes what the workers return into a single zip:
+#   <user_id>-<username>/<friend_id>-<friend name>.csv / .pdf
+#   manifest.json - period, and for each statement its user, friend, share
+#                   count, total in REPORTING_CURRENCY and each file's size
+#                   and sha256
+# It is built under a temporary name and renamed when complete.
+#
+# Workers are started with "spawn": each imports the app and opens its own
+# database connections rather than inheriting the parent's. The PDF is
+# written by pdf_document() below: monospaced text on A4 landscape pages,
+# which needs no PDF library. Its built-in font only covers Windows-1252,
+# so currency symbols outside it (the rupee sign) print as their codes.
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+import archive
+import fx
+
+YIELD_PER = 1000
+
+PAGE_WIDTH, PAGE_HEIGHT = 842, 595  # A4 landscape, in points
+MARGIN = 36
+FONT_SIZE = 8
+LEADING = 10
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING - 2  # room for the page number
+MAX_CELL_WIDTH = 32
+
+
+def _slug(name, fallback):
+    return secure_filename(name or '') or fallback
+
+
+def user_shares(user_id, start_date, end_date):
+    """All of a user's shares in the period, by friend and newest first within a friend"""
+    from app import db, ArchivedBillShare, Bill, BillShare
+
+    hot = BillShare.query.join(Bill).options(db.contains_eager(BillShare.bill)).filter(
+        Bill.user_id == user_id,
+        Bill.visit_date >= start_date,
+        Bill.visit_date <= end_date,
+    ).order_by(BillShare.friend_id, Bill.visit_date.desc())
+    if not archive.needs_archive(start_date):
+        return hot.yield_per(YIELD_PER)
+
+    cold = ArchivedBillShare.query.join(ArchivedBillShare.bill).options(
+        db.contains_eager(ArchivedBillShare.bill)
+    ).filter(
+        ArchivedBillShare.user_id == user_id,
+        ArchivedBillShare.visit_date >= start_date,
+        ArchivedBillShare.visit_date <= end_date,
+    ).order_by(ArchivedBillShare.friend_id, ArchivedBillShare.visit_date.desc())
+    return archive.SpanningQuery(
+        [hot, cold], key=lambda share: (-share.friend_id, share.bill.visit_date)).yield_per(YIELD_PER)
+
+
+def _file_entry(path, content):
+    return {'path': path, 'bytes': len(content), 'sha256': hashlib.sha256(content).hexdigest()}
+
+
+def user_statements(user_id, start_date, end_date):
+    """(files, manifest entries) for one user: files are (path in the zip, bytes)"""
+    from app import app, db, Friend, User, friend_bills_csv_rows
+
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        friends = {friend.id: friend for friend in Friend.query.filter_by(user_id=user_id)}
+        folder = f'{user_id}-{_slug(user.username, "user")}'
+        files, entries = [], []
+        shares = user_shares(user_id, start_date, end_date)
+        for friend_id, friend_shares in itertools.groupby(shares, key=lambda share: share.friend_id):
+            friend = friends.get(friend_id)
+            if friend is None:
+                continue
+            friend_shares = list(friend_shares)
+            rows = list(friend_bills_csv_rows(friend, friend_shares, start_date, end_date))
+            converter = fx.Converter()
+            total = 0.0
+            for share in friend_shares:
+                factor = converter.factor(share.bill.currency, share.bill.visit_date)
+                if factor is not None:
+                    total += share.total_share * factor
+
+            name = f'{folder}/{friend_id}-{_slug(friend.name, "friend")}'
+            csv_content = csv_document(rows)
+            pdf_content = pdf_document(table_lines(rows), f'{friend.name} - {start_date} to {end_date}')
+            files += [(f'{name}.csv', csv_content), (f'{name}.pdf', pdf_content)]
+            entries.append({
+                'user_id': user_id,
+                'username': user.username,
+                'friend_id': friend_id,
+                'friend_name': friend.name,
+                'shares': len(friend_shares),
+                'total': round(total, 2),
+                'currency': converter.target,
+                'unconverted': sorted(converter.missing),
+                'files': [_file_entry(f'{name}.csv', csv_content), _file_entry(f'{name}.pdf', pdf_content)],
+            })
+        db.session.remove()
+    return files, entries
+
+
+def csv_document(rows):
+    import csv
+
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue().encode('utf-8')
+
+
+def table_lines(rows):
+    """Statement rows as monospaced text lines, each column padded to its widest cell"""
+    rows = [[str(cell)[:MAX_CELL_WIDTH] for cell in row] for row in rows]
+    # Column widths come from the table (the rows after the first blank one)
+    start = next((i for i, row in enumerate(rows) if not row), len(rows))
+    widths = {}
+    for row in rows[start:]:
+        for column, cell in enumerate(row):
+            widths[column] = max(widths.get(column, 0), len(cell))
+    lines = []
+    for i, row in enumerate(rows):
+        if i < start:
+            lines.append(' '.join(row))
+        else:
+            lines.append('  '.join(cell.ljust(widths[column]) for column, cell in enumerate(row)).rstrip())
+    return lines
+
+
+def _encodable(text):
+    try:
+        text.encode('cp1252')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+# Currency symbols the PDF font has no glyph for, printed as their codes
+PDF_SYMBOLS = {symbol: f'{code} ' for code, symbol in fx.SYMBOLS.items() if not _encodable(symbol)}
+
+
+def _pdf_text(text):
+    for symbol, code in PDF_SYMBOLS.items():
+        text = text.replace(symbol, code)
+    data = text.encode('cp1252', 'replace')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def pdf_document(lines, title=''):
+    """A PDF of monospaced text lines, as many pages as they need"""
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+    # 1 catalog, 2 page tree, 3 font, 4 info, then a page and its content per page
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(b'%d 0 R' % (5 + 2 * i) for i in range(len(pages))), len(pages)),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>',
+        b'<< /Title %s /Producer (bill-sharing-app) /CreationDate (D:%s) >>' % (
+            _pdf_text(title), datetime.now().strftime('%Y%m%d%H%M%S').encode()),
+    ]
+    for number, page_lines in enumerate(pages, start=1):
+        content = [b'BT /F1 %d Tf %d TL %d %d Td' % (FONT_SIZE, LEADING, MARGIN, PAGE_HEIGHT - MARGIN)]
+        content += [_pdf_text(line) + b" '" for line in page_lines]
+        content.append(b'ET')
+        content.append(b'BT /F1 %d Tf %d %d Td %s Tj ET' % (
+            FONT_SIZE, MARGIN, MARGIN // 2, _pdf_text(f'Page {number} of {len(pages)}')))
+        stream = b'\n'.join(content)
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>'
+                       % (PAGE_WIDTH, PAGE_HEIGHT, 6 + 2 * (number - 1)))
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+    xref = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    out.write(b''.join(b'%010d 00000 n \n' % offset for offset in offsets))
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R /Info 4 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+              % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def users_with_shares(start_date, end_date):
+    """Ids of users with any share in the period, hot or archived"""
+    from app import db, ArchivedBillShare, Bill, BillShare
+
+    user_ids = {user_id for user_id, in db.session.query(Bill.user_id).join(BillShare).filter(
+        Bill.visit_date >= start_date, Bill.visit_date <= end_date).distinct()}
+    if archive.needs_archive(start_date):
+        user_ids.update(user_id for user_id, in db.session.query(ArchivedBillShare.user_id).filter(
+            ArchivedBillShare.visit_date >= start_date, ArchivedBillShare.visit_date <= end_date).distinct())
+    return sorted(user_ids)
+
+
+def generate(start_date, end_date, path, workers=None):
+    """Write every statement of the period into the zip at path; returns the manifest"""
+    from app import app, log
+
+    user_ids = users_with_shares(start_date, end_date)
+    workers = workers or app.config['STATEMENT_WORKERS']
+    entries = []
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.part'
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as bundle:
+            if user_ids:
+                with ProcessPoolExecutor(max_workers=min(workers, len(user_ids)),
+                                         mp_context=multiprocessing.get_context('spawn')) as pool:
+                    futures = [pool.submit(user_statements, user_id, start_date, end_date)
+                               for user_id in user_ids]
+                    for done, future in enumerate(as_completed(futures), start=1):
+                        files, user_entries = future.result()
+                        for name, content in files:
+                            bundle.writestr(name, content)
+                        entries.extend(user_entries)
+                        log.info('Statements built', extra={'users_done': done, 'users': len(user_ids)})
+            entries.sort(key=lambda entry: (entry['user_id'], entry['friend_id']))
+            manifest = {
+                'period': {'start': start_date.isoformat(), 'end': end_date.isoformat()},
+                'generated_at': datetime.utcnow().isoformat(timespec='seconds'),
+                'currency': fx.reporting_currency(),
+                'users': len({entry['user_id'] for entry in entries}),
+                'statements': entries,
+            }
+            bundle.writestr('manifest.json', json.dumps(manifest, indent=2))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return manifest
@@ -0,0 +1,183 @@
+# sync.py - Change log and delta sync for clients that keep a local copy
+#
+# Every insert, update and delete of a bill, share or friend appends a row to
+# change_log: (seq, user_id, entity, entity_id, op). seq is the table's
+# autoincrement id and serves as the client's cursor. ORM writes are picked
+# up by an after_flush hook in the same transaction. Bulk UPDATE/DELETE and
+# executemany INSERT bypass the unit of work, so those call sites log their
+# rows explicitly with log_where() / log_ids(), using one INSERT ... SELECT.
+#
+# /api/sync?cursor=N returns the current state of every entity changed after
+# N, and the ids of those deleted since, with the new cursor. Only the last
+# change per entity matters, so a page is collapsed before rows are loaded,
+# and compact() can drop superseded log rows without breaking any cursor.
+# cursor=0 (or none) returns a full snapshot instead.
+#
+# On Postgres a sequence value is taken at insert time but becomes visible
+# at commit, so a client could step past a change that commits late. Pages
+# therefore stop at changes younger than SYNC_SETTLE_SECONDS. Archived bills
+# (see archive.py) are not synced; clients keep what they already have.
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+UPSERT = 'upsert'
+DELETE = 'delete'
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+IDS_CHUNK_SIZE = 500
+
+# Entity name per model class name, and the key of its list in the payload
+ENTITIES = {'Bill': 'bill', 'BillShare': 'share', 'Friend': 'friend'}
+PAYLOAD_KEYS = {'bill': 'bills', 'share': 'shares', 'friend': 'friends'}
+
+
+def _models():
+    from app import Bill, BillShare, Friend
+    return {'bill': Bill, 'share': BillShare, 'friend': Friend}
+
+
+def _after_flush(session, flush_context):
+    from app import Bill, ChangeLog
+
+    changes = []
+    share_bills = {}
+    # new / dirty / deleted still describe this flush at this point
+    for objects, op, modified_only in ((session.new, UPSERT, False),
+                                       (session.dirty, UPSERT, True),
+                                       (session.deleted, DELETE, False)):
+        for obj in objects:
+            entity = ENTITIES.get(type(obj).__name__)
+            if entity is None or obj.id is None:
+                continue
+            if modified_only and not session.is_modified(obj, include_collections=False):
+                continue
+            if entity == 'share':
+                share_bills[obj.id] = obj.bill_id
+                changes.append((None, entity, obj.id, op))
+            else:
+                changes.append((obj.user_id, entity, obj.id, op))
+    if not changes:
+        return
+
+    connection = session.connection()
+    owners = {}
+    if share_bills:
+        owners = dict(connection.execute(
+            Bill.__table__.select().with_only_columns(Bill.__table__.c.id, Bill.__table__.c.user_id)
+            .where(Bill.__table__.c.id.in_(set(share_bills.values())))
+        ).all())
+    now = datetime.utcnow()
+    rows = []
+    for user_id, entity, entity_id, op in changes:
+        if entity == 'share':
+            user_id = owners.get(share_bills[entity_id])
+            if user_id is None:
+                continue
+        rows.append(dict(user_id=user_id, entity=entity, entity_id=entity_id, op=op, changed_at=now))
+    if rows:
+        connection.execute(ChangeLog.__table__.insert(), rows)
+
+
+def install(db):
+    """Log ORM writes of bills, shares and friends from every session (idempotent)"""
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+
+
+def log_where(model, condition, op=UPSERT):
+    """Log the rows of model matching condition, before a bulk write changes them"""
+    from app import db, Bill, BillShare, ChangeLog
+
+    entity = ENTITIES[model.__name__]
+    columns = [db.literal(entity), model.id, db.literal(op), db.literal(datetime.utcnow())]
+    if model is BillShare:
+        source = db.select(Bill.user_id, *columns).join(Bill, Bill.id == BillShare.bill_id)
+    else:
+        source = db.select(model.user_id, *columns)
+    db.session.execute(ChangeLog.__table__.insert().from_select(
+        ['user_id', 'entity', 'entity_id', 'op', 'changed_at'], source.where(condition)))
+
+
+def log_ids(model, ids, op=UPSERT):
+    ids = list(ids)
+    for i in range(0, len(ids), IDS_CHUNK_SIZE):
+        log_where(model, model.id.in_(ids[i:i + IDS_CHUNK_SIZE]), op)
+
+
+def serialize(obj):
+    row = {}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.key)
+        row[column.key] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return row
+
+
+def _owned(model, user_id):
+    from app import Bill, BillShare
+
+    if model is BillShare:
+        return BillShare.query.join(Bill, Bill.id == BillShare.bill_id).filter(Bill.user_id == user_id)
+    return model.query.filter(model.user_id == user_id)
+
+
+def _empty_payload():
+    payload = {key: [] for key in PAYLOAD_KEYS.values()}
+    payload['deleted'] = {key: [] for key in PAYLOAD_KEYS.values()}
+    return payload
+
+
+def snapshot(user_id):
+    """Everything the user has, with the cursor to continue from"""
+    from app import db, ChangeLog
+
+    # Read the cursor first: changes made while the snapshot is read are
+    # sent again on the next sync, which is harmless
+    cursor = db.session.query(db.func.max(ChangeLog.id)).scalar() or 0
+    payload = _empty_payload()
+    for entity, model in _models().items():
+        payload[PAYLOAD_KEYS[entity]] = [serialize(obj) for obj in _owned(model, user_id).order_by(model.id)]
+    payload.update(cursor=cursor, has_more=False, snapshot=True)
+    return payload
+
+
+def changes_since(user_id, cursor, limit=PAGE_SIZE, settle_seconds=0):
+    """Entities changed after cursor: at most limit log entries per page"""
+    from app import db, ChangeLog
+
+    query = ChangeLog.query.filter(ChangeLog.user_id == user_id, ChangeLog.id > cursor)
+    if settle_seconds:
+        query = query.filter(ChangeLog.changed_at <= datetime.utcnow() - timedelta(seconds=settle_seconds))
+    entries = query.order_by(ChangeLog.id).with_entities(
+        ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op
+    ).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # Last operation per entity wins
+    latest = {}
+    for _, entity, entity_id, op in entries:
+        latest[(entity, entity_id)] = op
+
+    payload = _empty_payload()
+    models = _models()
+    for entity, model in models.items():
+        upserts = [entity_id for (kind, entity_id), op in latest.items() if kind == entity and op == UPSERT]
+        deletes = [entity_id for (kind, entity_id), op in latest.items() if kind == entity and op == DELETE]
+        payload['deleted'][PAYLOAD_KEYS[entity]] = sorted(deletes)
+        for i in range(0, len(upserts), IDS_CHUNK_SIZE):
+            chunk = upserts[i:i + IDS_CHUNK_SIZE]
+            payload[PAYLOAD_KEYS[entity]].extend(
+                serialize(obj) for obj in _owned(model, user_id).filter(model.id.in_(chunk)).order_by(model.id))
+    payload.update(cursor=entries[-1][0] if entries else cursor, has_more=has_more, snapshot=False)
+    return payload
+
+
+def compact():
+    """Delete log rows superseded by a later change to the same entity"""
+    from app import db, ChangeLog
+
+    latest = db.select(db.func.max(ChangeLog.id)).group_by(ChangeLog.entity, ChangeLog.entity_id)
+    deleted = ChangeLog.query.filter(ChangeLog.id.notin_(latest)).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted